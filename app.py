@@ -1,75 +1,2008 @@
-from flask import Flask, render_template, jsonify
-import pandas as pd
-import numpy as np
-import plotly.graph_objs as go
-import plotly.express as px
-from plotly.subplots import make_subplots
+import time
+_INICIO_IMPORTACION = time.perf_counter()
+
+from flask import Flask, render_template, jsonify, request, Response, g, url_for
+import click
+from markupsafe import Markup
+import os
+import importlib
+import logging
+import contextlib
+import hashlib
+import shutil
+import tempfile
+import threading
+import multiprocessing
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor, ProcessPoolExecutor, TimeoutError as TimeoutFuturo
 import warnings
 import json
+import re
+import zlib
+import gzip
+import html
+import zipfile
+import posixpath
+import xml.etree.ElementTree as ET
+import mimetypes
+import math
+import bisect
+import hmac
+import urllib.request
+import urllib.error
+import urllib.parse
+from datetime import date, datetime
+from dataclasses import dataclass, field
+try:
+    import fcntl
+except ImportError:  # Windows: sin bloqueo entre procesos del registro de capturas
+    fcntl = None
+try:
+    import orjson
+except ImportError:  # Sin orjson las figuras se serializan con json (más lento)
+    orjson = None
+try:
+    import brotli
+except ImportError:  # Sin brotli solo se generan variantes .gz
+    brotli = None
 warnings.filterwarnings('ignore')
 
+# Tiempo (ms) de importación de cada módulo pesado, para el reporte de arranque
+TIEMPOS_IMPORTACION = {}
+
+# Módulo que se importa en el primer acceso a uno de sus atributos. pandas,
+# numpy y plotly suman la mayor parte del arranque y la página de inicio no
+# los necesita; así solo los paga quien los usa (o el precalentamiento).
+class ModuloDiferido:
+    def __init__(self, nombre):
+        self._nombre = nombre
+        self._modulo = None
+
+    def cargar(self):
+        if self._modulo is None:
+            inicio = time.perf_counter()
+            modulo = importlib.import_module(self._nombre)
+            TIEMPOS_IMPORTACION.setdefault(self._nombre, round((time.perf_counter() - inicio) * 1000, 1))
+            self._modulo = modulo
+        return self._modulo
+
+    def __getattr__(self, atributo):
+        valor = getattr(self.cargar(), atributo)
+        # Cachear el atributo para no pasar por __getattr__ la próxima vez
+        self.__dict__[atributo] = valor
+        return valor
+
+pd = ModuloDiferido('pandas')
+np = ModuloDiferido('numpy')
+go = ModuloDiferido('plotly.graph_objs')
+_plotly_subplots = ModuloDiferido('plotly.subplots')
+pio = ModuloDiferido('plotly.io')
+MODULOS_PESADOS = (np, pd, go, _plotly_subplots, pio)
+
+def make_subplots(*args, **kwargs):
+    return _plotly_subplots.make_subplots(*args, **kwargs)
+
 app = Flask(__name__)
 
+# Logging estructurado con nivel configurable (LOG_LEVEL=DEBUG para el detalle
+# de cada gráfico; en producción basta INFO)
+logger = logging.getLogger('iguanas')
+if not logger.handlers:
+    _manejador_log = logging.StreamHandler()
+    _manejador_log.setFormatter(logging.Formatter(
+        '%(asctime)s %(levelname)s [%(process)d] %(name)s: %(message)s'
+    ))
+    logger.addHandler(_manejador_log)
+    logger.propagate = False
+logger.setLevel(os.environ.get('LOG_LEVEL', 'INFO').upper())
+
+# Registro de métricas en formato de exposición de Prometheus. Cada worker
+# lleva sus propios contadores (las métricas son por proceso).
+BUCKETS_SEGUNDOS = (0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10)
+
+class RegistroMetricas:
+    def __init__(self):
+        self._lock = threading.Lock()
+        # nombre -> (tipo, ayuda)
+        self._definiciones = {}
+        # (nombre, etiquetas) -> valor | [conteos por bucket, suma, total]
+        self._valores = {}
+
+    def _definir(self, nombre, tipo, ayuda):
+        if nombre not in self._definiciones:
+            self._definiciones[nombre] = (tipo, ayuda)
+
+    def incrementar(self, nombre, ayuda='', valor=1, **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._definir(nombre, 'counter', ayuda)
+            self._valores[clave] = self._valores.get(clave, 0) + valor
+
+    def fijar(self, nombre, valor, ayuda='', **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._definir(nombre, 'gauge', ayuda)
+            self._valores[clave] = valor
+
+    def observar(self, nombre, valor, ayuda='', **etiquetas):
+        clave = (nombre, tuple(sorted(etiquetas.items())))
+        with self._lock:
+            self._definir(nombre, 'histogram', ayuda)
+            serie = self._valores.get(clave)
+            if serie is None:
+                serie = self._valores[clave] = [[0] * len(BUCKETS_SEGUNDOS), 0.0, 0]
+            for i, limite in enumerate(BUCKETS_SEGUNDOS):
+                if valor <= limite:
+                    serie[0][i] += 1
+            serie[1] += valor
+            serie[2] += 1
+
+    @staticmethod
+    def _etiquetas(pares):
+        if not pares:
+            return ''
+        texto = ','.join('{}="{}"'.format(k, str(v).replace('\\', '\\\\').replace('"', '\\"')) for k, v in pares)
+        return '{' + texto + '}'
+
+    def exponer(self):
+        with self._lock:
+            valores = sorted(self._valores.items(), key=lambda item: item[0])
+            definiciones = dict(self._definiciones)
+
+        lineas = []
+        anterior = None
+        for (nombre, pares), valor in valores:
+            tipo, ayuda = definiciones[nombre]
+            if nombre != anterior:
+                lineas.append(f'# HELP {nombre} {ayuda}')
+                lineas.append(f'# TYPE {nombre} {tipo}')
+                anterior = nombre
+            if tipo == 'histogram':
+                conteos, suma, total = valor
+                for limite, conteo in zip(BUCKETS_SEGUNDOS, conteos):
+                    lineas.append(f'{nombre}_bucket{self._etiquetas(pares + (("le", limite),))} {conteo}')
+                lineas.append(f'{nombre}_bucket{self._etiquetas(pares + (("le", "+Inf"),))} {total}')
+                lineas.append(f'{nombre}_sum{self._etiquetas(pares)} {suma}')
+                lineas.append(f'{nombre}_count{self._etiquetas(pares)} {total}')
+            else:
+                lineas.append(f'{nombre}{self._etiquetas(pares)} {valor}')
+        return '\n'.join(lineas) + '\n'
+
+metricas = RegistroMetricas()
+
+# Span de tiempo de una etapa (carga, kpis, grafico, serializacion, plantilla...)
+@contextlib.contextmanager
+def medir(etapa, **etiquetas):
+    inicio = time.perf_counter()
+    try:
+        yield
+    finally:
+        duracion = time.perf_counter() - inicio
+        metricas.observar('iguanas_etapa_duracion_segundos', duracion,
+                          'Duración de cada etapa del procesamiento', etapa=etapa, **etiquetas)
+        logger.debug('etapa=%s %s duracion_ms=%.1f', etapa,
+                     ' '.join(f'{k}={v}' for k, v in etiquetas.items()), duracion * 1000)
+
 # Configuración Railway
 PORT = int(os.environ.get("PORT", 8080))
 
 # Configuración de paleta de colores
 PALETA_ECOLOGICA = ['#2E8B57', '#90EE90', '#DAA520', '#FF8C00']
 
-# Cargar datos con codificación correcta
-def cargar_datos():
+# Ruta del libro de capturas (configurable para despliegues con otro volumen de datos)
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+RUTA_DATOS = os.environ.get('RUTA_DATOS', os.path.join(BASE_DIR, 'data', 'especies.xlsx'))
+
+# Origen de los datos: 'local' (RUTA_DATOS), 'csv' (URL_DATOS_CSV), 'sheets'
+# (GOOGLE_SHEETS_URL) o 'catalogo' (DIR_CATALOGO). Si no se indica se elige
+# según las URLs definidas.
+FUENTE_DATOS = os.environ.get('FUENTE_DATOS', '')
+GOOGLE_SHEETS_URL = os.environ.get('GOOGLE_SHEETS_URL')
+URL_DATOS_CSV = os.environ.get('URL_DATOS_CSV')
+DIR_DATOS_REMOTOS = os.environ.get('DIR_DATOS_REMOTOS', os.path.join(BASE_DIR, 'data', '.remoto'))
+# Segundos entre consultas a la fuente remota y límite de cada descarga
+INTERVALO_ACTUALIZACION = float(os.environ.get('INTERVALO_ACTUALIZACION', 300))
+TIMEOUT_DESCARGA = float(os.environ.get('TIMEOUT_DESCARGA', 20))
+# Catálogo de libros: un libro por sitio y temporada
+# (<sitio>/<temporada>.xlsx) bajo DIR_CATALOGO. Los libros nuevos o
+# modificados se parsean en paralelo con WORKERS_CATALOGO procesos.
+DIR_CATALOGO = os.environ.get('DIR_CATALOGO', os.path.join(BASE_DIR, 'data', 'catalogo'))
+WORKERS_CATALOGO = int(os.environ.get('WORKERS_CATALOGO', os.cpu_count() or 1))
+# Segundos durante los que se reutiliza la última firma del catálogo sin
+# volver a recorrer el directorio
+INTERVALO_COMPROBACION = float(os.environ.get('INTERVALO_COMPROBACION', 2))
+# Segundos antes de reintentar una lectura fallida del libro (o catálogo)
+# sin cambios en su firma; la espera se duplica con cada fallo hasta el máximo
+REINTENTO_CARGA = float(os.environ.get('REINTENTO_CARGA', 5))
+REINTENTO_CARGA_MAXIMO = float(os.environ.get('REINTENTO_CARGA_MAXIMO', 300))
+
+# Snapshots columnares compartidos entre workers (un .npy por columna, mapeado en memoria)
+DIR_SNAPSHOTS = os.environ.get('DIR_SNAPSHOTS', os.path.join(BASE_DIR, 'data', '.snapshots'))
+SNAPSHOTS_ACTIVOS = os.environ.get('SNAPSHOTS_ACTIVOS', '1') == '1'
+
+# Incrustar las figuras en el HTML (1) o dejar que la página las pida a /api/graficos (0)
+GRAFICOS_EN_LINEA = os.environ.get('GRAFICOS_EN_LINEA', '1') == '1'
+
+# Generación concurrente de gráficos: 'hilos', 'procesos' o 'secuencial'
+GRAFICOS_EJECUTOR = os.environ.get('GRAFICOS_EJECUTOR', 'hilos')
+GRAFICOS_WORKERS = int(os.environ.get('GRAFICOS_WORKERS', min(5, os.cpu_count() or 1)))
+# Tiempo máximo (s) que una página espera por sus gráficos
+GRAFICOS_TIMEOUT = float(os.environ.get('GRAFICOS_TIMEOUT', 10))
+
+# Histograma y boxplot agregados en el servidor: 'auto' (a partir de
+# UMBRAL_AGREGACION filas), '1' siempre o '0' nunca (datos crudos)
+GRAFICOS_AGREGADOS = os.environ.get('GRAFICOS_AGREGADOS', 'auto')
+UMBRAL_AGREGACION = int(os.environ.get('UMBRAL_AGREGACION', 5000))
+# Máximo de atípicos dibujados por caja
+LIMITE_ATIPICOS = 1000
+
+# Construir las figuras como diccionarios (sin validar con plotly) y
+# serializarlas con orjson si está instalado
+FIGURAS_LIGERAS = os.environ.get('FIGURAS_LIGERAS', '1') == '1'
+
+# Registro de solo anexado (JSON Lines) con las capturas recibidas por la API
+RUTA_CAPTURAS = os.environ.get('RUTA_CAPTURAS', os.path.join(BASE_DIR, 'data', 'capturas.jsonl'))
+# POST /api/capturas exige "Authorization: Bearer <token>"; sin token
+# configurado la ruta rechaza todas las altas
+TOKEN_CAPTURAS = os.environ.get('TOKEN_CAPTURAS', '')
+MAXIMO_LOTE_CAPTURAS = 1000
+
+# Resultados por combinación de filtros del dashboard (selección, KPIs y
+# figuras) que se conservan en la caché LRU de cada versión del dataset
+LIMITE_CACHE_FILTROS = int(os.environ.get('LIMITE_CACHE_FILTROS', 256))
+
+# Lectura de libros .xlsx: `streaming` (zip + iterparse, solo la hoja de
+# datos y las columnas que usa la aplicación) o `pandas` (read_excel). Si el
+# lector por streaming no entiende el libro se recurre a pandas.
+LECTOR_EXCEL = os.environ.get('LECTOR_EXCEL', 'streaming')
+# Hoja con los registros (si no existe, la primera del libro)
+HOJA_DATOS = os.environ.get('HOJA_DATOS', 'Datos')
+
+# Directorio de salida de `flask export-static`
+DIR_SITIO_ESTATICO = os.environ.get('DIR_SITIO_ESTATICO', os.path.join(BASE_DIR, 'sitio'))
+
+# Compresión gzip/brotli de las respuestas (desactivable si ya comprime el
+# proxy) a partir de este tamaño en bytes, y vigencia de la caché de los
+# estáticos con huella en la URL
+COMPRESION_RESPUESTAS = os.environ.get('COMPRESION_RESPUESTAS', '1') == '1'
+MIN_BYTES_COMPRESION = int(os.environ.get('MIN_BYTES_COMPRESION', 1024))
+# Bytes de cuerpos comprimidos que se conservan en su propia caché LRU
+LIMITE_CACHE_COMPRESION = int(os.environ.get('LIMITE_CACHE_COMPRESION_MB', 16)) * 2**20
+CACHE_ESTATICOS_SEGUNDOS = 365 * 24 * 3600
+
+# Intervalos de confianza bootstrap y prueba de permutación de
+# /api/estadisticas: remuestreos por defecto y máximo, y memoria de trabajo
+# de cada lote de remuestreos. Sin "Authorization: Bearer <TOKEN_ESTADISTICAS>"
+# solo se aceptan unos remuestreos y niveles fijos con la semilla 0, de modo
+# que las peticiones anónimas siempre acaban en las mismas entradas de caché
+REMUESTREOS_BOOTSTRAP = int(os.environ.get('REMUESTREOS_BOOTSTRAP', 10000))
+MAXIMO_REMUESTREOS = 100000
+REMUESTREOS_PUBLICOS = tuple(sorted({1000, 2000, 5000, 10000, REMUESTREOS_BOOTSTRAP}))
+NIVELES_PUBLICOS = (0.8, 0.9, 0.95, 0.99)
+TOKEN_ESTADISTICAS = os.environ.get('TOKEN_ESTADISTICAS', '')
+MEMORIA_REMUESTREO = int(os.environ.get('MEMORIA_REMUESTREO_MB', 64)) * 2**20
+
+# Avisos de cambios de KPIs por SSE (/api/kpis/stream): cada cuántos
+# segundos comprueba un único hilo por worker si cambió el dataset, cada
+# cuántos se envía un latido a los clientes y en cuánto reconectan. Cada
+# conexión se cierra tras DURACION_MAXIMA_SSE segundos (el navegador
+# reconecta con Last-Event-ID) para que ninguna ocupe un hilo para siempre.
+INTERVALO_NOTIFICACION = float(os.environ.get('INTERVALO_NOTIFICACION', 5))
+LATIDO_SSE = float(os.environ.get('LATIDO_SSE', 15))
+DURACION_MAXIMA_SSE = float(os.environ.get('DURACION_MAXIMA_SSE', 300))
+REINTENTO_SSE_MS = 5000
+LIMITE_HISTORIAL_KPIS = 64
+
+# Limpiar y validar un dataset recién leído (común a Excel y CSV)
+def preparar_dataset(df):
+    # Limpiar nombres de columnas (quitar espacios al final)
+    df.columns = df.columns.str.strip()
+    
+    # Parsear las fechas de entrega una sola vez al cargar
+    if 'Fecha_entrga_CAV' in df.columns:
+        df['Fecha_entrga_CAV'] = pd.to_datetime(df['Fecha_entrga_CAV'], errors='coerce', dayfirst=True)
+    
+    # Pesos exportados como texto con coma decimal (Google Sheets en español)
+    if 'Peso_Kg' in df.columns and not pd.api.types.is_numeric_dtype(df['Peso_Kg']):
+        df['Peso_Kg'] = pd.to_numeric(df['Peso_Kg'].astype(str).str.replace(',', '.', regex=False), errors='coerce')
+    
+    logger.debug("Columnas después de limpiar: %s", list(df.columns))
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Tipos de datos:\n%s", df.dtypes)
+    
+    # Verificar columnas críticas
+    columnas_requeridas = ['Edad', 'Sexo', 'Peso_Kg']
+    for col in columnas_requeridas:
+        if col not in df.columns:
+            logger.error("Columna '%s' no encontrada. Columnas disponibles: %s", col, list(df.columns))
+            return None
+    
+    # Verificar valores únicos en Edad y Sexo
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Valores únicos en Edad: %s", list(df['Edad'].unique()))
+        logger.debug("Valores únicos en Sexo: %s", list(df['Sexo'].unique()))
+    
+    return compactar_dataset(df)
+
+# Representación compacta en memoria: texto con los espacios normalizados,
+# columnas de baja cardinalidad como categorías (filtros y groupby sobre
+# códigos enteros), pesos en float32 y fechas en datetime64
+FRACCION_CATEGORICA = 0.5
+# Decimales con los que se restituyen los pesos float32 al mostrarlos
+DECIMALES_PESO = 4
+
+def normalizar_espacios(texto):
+    return ' '.join(texto.split())
+
+# Normalizar una columna de texto trabajando solo sobre sus valores únicos
+def compactar_texto(serie):
+    codigos, unicos = pd.factorize(serie)
+    unicos = np.asarray(unicos, dtype=object)
+    normalizados = [normalizar_espacios(str(v)) for v in unicos]
+    # Alta cardinalidad ya normalizada (p. ej. CNI): se deja tal cual
+    if len(unicos) > max(1, len(serie) * FRACCION_CATEGORICA) and \
+            all(a == b for a, b in zip(normalizados, unicos)):
+        return serie
+    normalizados = pd.Series(normalizados, dtype=object)
+    remapeo, categorias = pd.factorize(normalizados.mask(normalizados == ''))
+    codigos = np.where(codigos < 0, -1, np.append(remapeo, -1)[codigos])
+    if len(categorias) <= max(1, len(serie) * FRACCION_CATEGORICA):
+        categorica = pd.Categorical.from_codes(codigos, categories=categorias)
+        return categorica.reorder_categories(sorted(categorias))
+    # Alta cardinalidad: texto normal, nulos como NaN
+    return pd.Index(categorias, dtype=object).take(codigos, allow_fill=True, fill_value=np.nan).to_numpy()
+
+def compactar_dataset(df):
+    for columna in df.columns:
+        serie = df[columna]
+        if columna == 'Peso_Kg':
+            df[columna] = serie.astype('float32')
+        elif not (pd.api.types.is_numeric_dtype(serie) or pd.api.types.is_datetime64_any_dtype(serie)
+                  or isinstance(serie.dtype, pd.CategoricalDtype)):
+            df[columna] = compactar_texto(serie)
+    return df
+
+# Valores en float64 sin el ruido del float32 (0.235 y no 0.23499999940395355)
+def valores_float64(serie):
+    valores = serie.to_numpy(dtype='float64', na_value=np.nan)
+    return valores.round(DECIMALES_PESO) if serie.dtype == np.float32 else valores
+
+# Añadir filas nuevas conservando el esquema compacto del dataset base
+def concatenar_compacto(df_base, df_nuevo):
+    df_base = df_base.copy(deep=False)
+    for columna in df_base.columns:
+        tipo = df_base[columna].dtype
+        if isinstance(tipo, pd.CategoricalDtype):
+            nuevas = [v for v in df_nuevo[columna].dropna().unique() if v not in tipo.categories]
+            if nuevas:
+                tipo = pd.CategoricalDtype(sorted(list(tipo.categories) + nuevas))
+                df_base[columna] = df_base[columna].cat.set_categories(tipo.categories)
+            df_nuevo[columna] = pd.Categorical(df_nuevo[columna], dtype=tipo)
+        elif tipo == np.float32:
+            df_nuevo[columna] = df_nuevo[columna].astype('float32')
+    return pd.concat([df_base, df_nuevo], ignore_index=True)
+
+# Columnas del libro que usa la aplicación (KPIs, gráficos, filtros, tabla y
+# exportaciones); las demás no se leen
+COLUMNAS_LIBRO = ('Individuos', 'Fecha_entrga_CAV', 'Nombre_comun', 'Nombre_científico', 'Peso_Kg',
+                  'Edad', 'Sexo', 'CNI', 'Estado_Conservación')
+# Columnas cuyos números son fechas de Excel (días desde 1899-12-30)
+COLUMNAS_FECHA = ('Fecha_entrga_CAV',)
+# Textos que read_excel interpreta como nulos por defecto
+TEXTOS_NULOS = frozenset({
+    '', '#N/A', '#N/A N/A', '#NA', '-1.#IND', '-1.#QNAN', '-NaN', '-nan', '1.#IND', '1.#QNAN',
+    '<NA>', 'N/A', 'NA', 'NULL', 'NaN', 'None', 'n/a', 'nan', 'null',
+})
+
+_NS_XLSX = '{http://schemas.openxmlformats.org/spreadsheetml/2006/main}'
+_NS_REL_DOCUMENTO = '{http://schemas.openxmlformats.org/officeDocument/2006/relationships}'
+_NS_REL_PAQUETE = '{http://schemas.openxmlformats.org/package/2006/relationships}'
+# Celda: letras de la columna, fila, resto de atributos, <v> y texto en línea
+_CELDA = re.compile(
+    rb'<c r="([A-Z]+)(\d+)"([^>]*?)(?:/>|>(?:<f\b[^>]*?(?:/>|>[^<]*</f>))?'
+    rb'(?:<v>([^<]*)</v>|<v\s*/>|<is><t\b[^>]*?(?:/>|>([^<]*)</t>)</is>)?</c>)')
+_TIPO_CELDA = re.compile(rb'\bt="(\w+)"')
+
+def _usar_columna(nombre):
+    return str(nombre).strip() in COLUMNAS_LIBRO
+
+# Ruta dentro del zip de la hoja de datos y si el libro usa el sistema de
+# fechas de 1904
+def _hoja_de_datos(libro_zip, nombre=HOJA_DATOS):
+    libro = ET.fromstring(libro_zip.read('xl/workbook.xml'))
+    hojas = [(h.get('name'), h.get(_NS_REL_DOCUMENTO + 'id')) for h in libro.iter(_NS_XLSX + 'sheet')]
+    if not hojas:
+        raise ValueError('El libro no tiene hojas')
+    id_hoja = next((id_ for nombre_hoja, id_ in hojas if nombre_hoja == nombre), hojas[0][1])
+    relaciones = ET.fromstring(libro_zip.read('xl/_rels/workbook.xml.rels'))
+    destino = next(r.get('Target') for r in relaciones.iter(_NS_REL_PAQUETE + 'Relationship')
+                   if r.get('Id') == id_hoja)
+    ruta = destino.lstrip('/') if destino.startswith('/') else posixpath.normpath(posixpath.join('xl', destino))
+    propiedades = libro.find(_NS_XLSX + 'workbookPr')
+    fechas_1904 = propiedades is not None and propiedades.get('date1904') in ('1', 'true')
+    return ruta, fechas_1904
+
+# Tabla de textos compartidos (sin las guías fonéticas, como openpyxl); los
+# textos nulos para read_excel quedan como None
+def _textos_compartidos(libro_zip):
     try:
-        # Intentar con diferentes codificaciones
-        try:
-            df = pd.read_excel('data/especies.xlsx')
-        except:
-            # Si falla, intentar con engine openpyxl
-            df = pd.read_excel('data/especies.xlsx', engine='openpyxl')
-        
-        # Limpiar nombres de columnas (quitar espacios al final)
-        df.columns = df.columns.str.strip()
-        
-        print("=== COLUMNAS DESPUÉS DE LIMPIAR ===")
-        print(list(df.columns))
-        print(f"\n=== TIPOS DE DATOS ===")
-        print(df.dtypes)
-        
-        # Verificar columnas críticas
-        columnas_requeridas = ['Edad', 'Sexo', 'Peso_Kg']
-        for col in columnas_requeridas:
-            if col not in df.columns:
-                print(f"ERROR: Columna '{col}' no encontrada")
-                print(f"Columnas disponibles: {list(df.columns)}")
-                return None
-        
-        # Verificar valores únicos en Edad
-        print(f"\n=== VALORES ÚNICOS EN EDAD ===")
-        print(df['Edad'].unique())
-        
-        print(f"\n=== VALORES ÚNICOS EN SEXO ===")
-        print(df['Sexo'].unique())
+        archivo = libro_zip.open('xl/sharedStrings.xml')
+    except KeyError:
+        return []
+    etiqueta_si, etiqueta_t = _NS_XLSX + 'si', _NS_XLSX + 't'
+    ruta_runs = f'{_NS_XLSX}r/{_NS_XLSX}t'
+    textos = []
+    with archivo:
+        for _, elemento in ET.iterparse(archivo):
+            if elemento.tag != etiqueta_si:
+                continue
+            texto = elemento.findtext(etiqueta_t)
+            if texto is None:
+                texto = ''.join(t.text or '' for t in elemento.iterfind(ruta_runs))
+            textos.append(None if texto in TEXTOS_NULOS else texto)
+            elemento.clear()
+    return textos
+
+# Valor de una celda a partir de su tipo (atributo t), su <v> y su texto en
+# línea (<is><t>): textos resueltos, números como float, errores como None
+def _valor_celda(tipo, crudo, en_linea, textos):
+    if tipo == 's':
+        return textos[int(crudo)] if crudo else None
+    if tipo == 'n':
+        return float(crudo) if crudo else None
+    if tipo == 'inlineStr':
+        texto = en_linea
+    elif tipo == 'b':
+        return crudo == b'1' if crudo else None
+    elif tipo == 'e':
+        return None
+    else:
+        # 'str' (resultado de fórmula) y 'd' (fecha ISO)
+        texto = crudo
+    texto = texto.decode('utf-8')
+    if '&' in texto:
+        texto = html.unescape(texto)
+    return None if texto in TEXTOS_NULOS else texto
+
+# Bloques de unos 1 MB de la hoja que contienen solo filas completas
+def _bloques_filas(archivo, tamano_bloque=1 << 20):
+    pendiente = b''
+    inicio = None
+    while True:
+        leido = archivo.read(tamano_bloque)
+        pendiente += leido
+        if inicio is None:
+            inicio = pendiente.find(b'<row')
+            if inicio < 0:
+                inicio = None
+                if not leido:
+                    return
+                continue
+            pendiente = pendiente[inicio:]
+        fin = pendiente.rfind(b'</row>')
+        if fin >= 0:
+            fin += len(b'</row>')
+            yield pendiente[:fin]
+            pendiente = pendiente[fin:]
+        if not leido:
+            return
+
+# Columna de NumPy a partir de los valores leídos: float64 (int64 si todos
+# son enteros y no hay nulos), datetime64 para las fechas de Excel y object
+# para texto o tipos mezclados
+def _columna_numpy(nombre, valores, fechas_1904):
+    tipos = {type(v) for v in valores if v is not None}
+    if tipos != {float}:
+        if str(nombre).strip() in COLUMNAS_FECHA:
+            origen = pd.Timestamp('1904-01-01' if fechas_1904 else '1899-12-30')
+            valores = [origen + pd.Timedelta(milliseconds=round(v * 86_400_000)) if type(v) is float else v
+                       for v in valores]
+        else:
+            # Como openpyxl, los números enteros entre textos se leen como int
+            valores = [int(v) if type(v) is float and v.is_integer() else v for v in valores]
+        return np.array(valores, dtype=object)
+
+    numeros = np.array([np.nan if v is None else v for v in valores], dtype=np.float64)
+    if str(nombre).strip() in COLUMNAS_FECHA:
+        fechas = np.full(len(numeros), np.datetime64('NaT'), dtype='datetime64[us]')
+        validos = ~np.isnan(numeros)
+        origen = np.datetime64('1904-01-01' if fechas_1904 else '1899-12-30', 'us')
+        # Redondeo al milisegundo, como openpyxl
+        milisegundos = np.round(numeros[validos] * 86_400_000).astype(np.int64)
+        fechas[validos] = origen + milisegundos.astype('timedelta64[ms]')
+        return fechas
+    if not np.isnan(numeros).any() and np.array_equal(numeros, np.trunc(numeros)):
+        return numeros.astype(np.int64)
+    return numeros
+
+# Leer la hoja de datos de un .xlsx por streaming. Solo se descomprimen
+# workbook.xml, sus relaciones, sharedStrings.xml y la hoja de datos: los
+# estilos, las tablas dinámicas y sus cachés (pivotCacheRecords) y el resto
+# de hojas no se tocan. La hoja se lee en bloques de filas y las celdas se
+# extraen con una expresión regular (varias veces más rápido que construir
+# el árbol XML); solo se decodifican las columnas de COLUMNAS_LIBRO. Si hay
+# celdas con una forma que la expresión no reconoce (texto enriquecido,
+# celdas sin referencia...) o no se encuentran filas (p. ej. etiquetas con
+# prefijo de espacio de nombres) se lanza ValueError y leer_excel recurre a
+# pandas. Las fechas se reconocen por columna (COLUMNAS_FECHA), no por el
+# formato de celda. Como read_excel, la primera fila con valores es el
+# encabezado y las filas en blanco del final se descartan.
+def leer_xlsx_streaming(ruta):
+    with zipfile.ZipFile(ruta) as libro_zip:
+        ruta_hoja, fechas_1904 = _hoja_de_datos(libro_zip)
+        textos = _textos_compartidos(libro_zip)
+        tipos = {}
+        # Encabezado: {letras de la columna: nombre}; columnas: {letras: [valor
+        # de cada fila desde la siguiente al encabezado]}
+        fila_encabezado, encabezado, columnas = None, {}, None
+        with libro_zip.open(ruta_hoja) as archivo:
+            for bloque in _bloques_filas(archivo):
+                celdas = _CELDA.findall(bloque)
+                if len(celdas) != bloque.count(b'<c ') + bloque.count(b'<c>') + bloque.count(b'<c/>'):
+                    raise ValueError('La hoja tiene celdas que el lector por streaming no reconoce')
+                for letras, fila, atributos, crudo, en_linea in celdas:
+                    tipo = tipos.get(atributos)
+                    if tipo is None:
+                        encontrado = _TIPO_CELDA.search(atributos)
+                        tipo = tipos[atributos] = encontrado.group(1).decode() if encontrado else 'n'
+                    if columnas is None:
+                        if fila_encabezado is None or fila == fila_encabezado:
+                            valor = _valor_celda(tipo, crudo, en_linea, textos)
+                            if valor is not None:
+                                fila_encabezado = fila
+                                encabezado[letras] = str(valor)
+                            continue
+                        columnas = _columnas_usadas(encabezado)
+                        primera_fila = int(fila_encabezado) + 1
+                    valores = columnas.get(letras)
+                    if valores is not None:
+                        valor = _valor_celda(tipo, crudo, en_linea, textos)
+                        if valor is None:
+                            continue
+                        posicion = int(fila) - primera_fila
+                        faltan = posicion - len(valores)
+                        if faltan >= 0:
+                            valores.extend([None] * faltan)
+                            valores.append(valor)
+                        else:
+                            valores[posicion] = valor
+    if fila_encabezado is None:
+        raise ValueError('La hoja de datos está vacía')
+    if columnas is None:
+        columnas = _columnas_usadas(encabezado)
+    # Las filas en blanco intermedias quedan como filas nulas y las del final
+    # se descartan
+    filas = max(map(len, columnas.values()), default=0)
+    return pd.DataFrame({
+        encabezado[letras]: _columna_numpy(encabezado[letras], valores + [None] * (filas - len(valores)), fechas_1904)
+        for letras, valores in columnas.items()
+    }, index=pd.RangeIndex(filas))
+
+# Columnas del encabezado que se leen (la primera aparición de cada nombre)
+def _columnas_usadas(encabezado):
+    columnas, vistos = {}, set()
+    for letras, nombre in encabezado.items():
+        if _usar_columna(nombre) and nombre.strip() not in vistos:
+            columnas[letras] = []
+            vistos.add(nombre.strip())
+    return columnas
+
+def leer_excel_pandas(ruta):
+    with pd.ExcelFile(ruta) as libro:
+        hoja = HOJA_DATOS if HOJA_DATOS in libro.sheet_names else 0
+        return libro.parse(hoja, usecols=_usar_columna)
+
+# Leer y validar el libro de Excel (sin caché)
+def leer_excel(ruta):
+    try:
+        if LECTOR_EXCEL == 'streaming' and ruta.lower().endswith(('.xlsx', '.xlsm')):
+            try:
+                df = leer_xlsx_streaming(ruta)
+            except (zipfile.BadZipFile, KeyError, StopIteration, ET.ParseError, ValueError) as e:
+                logger.warning("No se pudo leer %s por streaming (%s); se lee con pandas", ruta, e)
+                df = leer_excel_pandas(ruta)
+        else:
+            df = leer_excel_pandas(ruta)
         
+        return preparar_dataset(df)
+    except Exception as e:
+        logger.exception("Error cargando datos: %s", e)
+        return None
+
+# Leer y validar un CSV (exportación de Google Sheets u otra URL)
+def leer_csv(ruta):
+    try:
+        return preparar_dataset(pd.read_csv(ruta, encoding='utf-8-sig'))
+    except Exception as e:
+        logger.exception("Error cargando datos: %s", e)
+        return None
+
+def leer_archivo(ruta):
+    return leer_csv(ruta) if ruta.lower().endswith('.csv') else leer_excel(ruta)
+
+# Escribir un snapshot columnar del DataFrame de forma atómica.
+# Las columnas numéricas y de fecha se guardan tal cual; las categóricas y
+# las de texto como códigos enteros más la lista de categorías en el
+# manifiesto. Se escribe en un directorio temporal y se renombra al final,
+# de modo que ningún worker llega a ver un snapshot a medio escribir.
+# El formato forma parte del nombre: un cambio de esquema no reutiliza
+# snapshots antiguos.
+FORMATO_SNAPSHOT = 2
+
+def _nombre_snapshot(version):
+    return f'{version}.f{FORMATO_SNAPSHOT}'
+
+def escribir_snapshot(df, version, directorio=DIR_SNAPSHOTS):
+    destino = os.path.join(directorio, _nombre_snapshot(version))
+    if os.path.isdir(destino):
+        return destino
+
+    os.makedirs(directorio, exist_ok=True)
+    tmp = tempfile.mkdtemp(prefix=f'.{version}-', dir=directorio)
+    try:
+        manifiesto = {'version': version, 'filas': len(df), 'columnas': []}
+        for i, columna in enumerate(df.columns):
+            serie = df[columna]
+            archivo = f'{i:03d}.npy'
+            entrada = {'nombre': columna, 'archivo': archivo}
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                arreglo = serie.cat.codes.to_numpy()
+                entrada['tipo'] = 'categoria'
+                entrada['categorias'] = [str(c) for c in serie.cat.categories]
+            elif pd.api.types.is_numeric_dtype(serie) or pd.api.types.is_datetime64_any_dtype(serie):
+                arreglo = serie.to_numpy()
+                entrada['tipo'] = 'numerico'
+            else:
+                # factorize marca los nulos con -1
+                codigos, categorias = pd.factorize(serie)
+                arreglo = codigos.astype(np.int32)
+                entrada['tipo'] = 'categorico'
+                entrada['categorias'] = list(categorias)
+            np.save(os.path.join(tmp, archivo), arreglo, allow_pickle=False)
+            manifiesto['columnas'].append(entrada)
+
+        with open(os.path.join(tmp, 'manifiesto.json'), 'w', encoding='utf-8') as f:
+            json.dump(manifiesto, f, ensure_ascii=False, default=str)
+
+        try:
+            os.rename(tmp, destino)
+        except OSError:
+            # Otro worker publicó el mismo snapshot antes que nosotros
+            shutil.rmtree(tmp, ignore_errors=True)
+    except Exception:
+        shutil.rmtree(tmp, ignore_errors=True)
+        raise
+
+    limpiar_snapshots(directorio, conservar=_nombre_snapshot(version))
+    return destino
+
+# Abrir un snapshot mapeando cada columna en memoria (None si no existe)
+def abrir_snapshot(version, directorio=DIR_SNAPSHOTS):
+    ruta = os.path.join(directorio, _nombre_snapshot(version))
+    try:
+        with open(os.path.join(ruta, 'manifiesto.json'), encoding='utf-8') as f:
+            manifiesto = json.load(f)
+    except (OSError, ValueError):
+        return None
+
+    columnas = {}
+    for entrada in manifiesto['columnas']:
+        arreglo = np.load(os.path.join(ruta, entrada['archivo']), mmap_mode='r', allow_pickle=False)
+        if entrada['tipo'] == 'categoria':
+            arreglo = pd.Categorical.from_codes(arreglo, categories=entrada['categorias'])
+        elif entrada['tipo'] == 'categorico':
+            # El NaN final recoge los códigos -1 (valores nulos)
+            categorias = np.array(entrada['categorias'] + [np.nan], dtype=object)
+            arreglo = categorias[arreglo]
+        columnas[entrada['nombre']] = arreglo
+
+    return pd.DataFrame(columnas, copy=False)
+
+# Borrar snapshots de versiones anteriores y temporales abandonados.
+# Los workers que aún tengan mapeado un snapshot borrado siguen leyéndolo sin
+# problema: el sistema libera las páginas cuando se cierra el último mapeo.
+def limpiar_snapshots(directorio, conservar, antiguedad_tmp=3600):
+    try:
+        entradas = os.listdir(directorio)
+    except OSError:
+        return
+    ahora = time.time()
+    for nombre in entradas:
+        ruta = os.path.join(directorio, nombre)
+        if nombre == conservar or not os.path.isdir(ruta):
+            continue
+        try:
+            if nombre.startswith('.') and ahora - os.path.getmtime(ruta) < antiguedad_tmp:
+                continue
+        except OSError:
+            continue
+        shutil.rmtree(ruta, ignore_errors=True)
+
+# Cargar una versión concreta: snapshot mapeado si existe, si no parsear el
+# Excel y publicar el snapshot para el resto de workers
+def cargar_version(ruta, version, directorio=DIR_SNAPSHOTS):
+    if not SNAPSHOTS_ACTIVOS:
+        return leer_archivo(ruta)
+
+    df = abrir_snapshot(version, directorio)
+    if df is not None:
         return df
+
+    df = leer_archivo(ruta)
+    if df is None:
+        return None
+    try:
+        escribir_snapshot(df, version, directorio)
     except Exception as e:
-        print(f"Error cargando datos: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.warning("No se pudo escribir el snapshot %s: %s", version, e)
+        return df
+    mapeado = abrir_snapshot(version, directorio)
+    return mapeado if mapeado is not None else df
+
+# Huella de contenido del archivo: sirve como identificador de versión del dataset
+def calcular_hash_archivo(ruta, tamano_bloque=1 << 20):
+    h = hashlib.sha1()
+    with open(ruta, 'rb') as f:
+        for bloque in iter(lambda: f.read(tamano_bloque), b''):
+            h.update(bloque)
+    return h.hexdigest()[:16]
+
+# Versión del dataset: la del libro más, si las hay, el número de capturas
+# anexadas (p. ej. "e78beca32751ff49+12"). Solo las versiones sin capturas
+# de un único libro tienen snapshot en disco; las de un catálogo llevan el
+# número de libros tras una arroba ("3f0c9a1be27d4c55@6").
+def componer_version(version_libro, capturas):
+    return f'{version_libro}+{capturas}' if capturas else version_libro
+
+def version_con_snapshot(version):
+    return '+' not in version and '@' not in version
+
+# Validación de capturas recibidas por la API
+EDADES_VALIDAS = ('Adulto', 'Subadulto', 'Juvenil')
+SEXOS_VALIDOS = ('Hembra', 'Macho')
+PESO_MAXIMO_KG = 50
+INDIVIDUO_MAXIMO = 10_000
+LONGITUD_MAXIMA_TEXTO = 200
+
+def _texto_captura(valor, columna, problemas):
+    if valor is None:
+        return None
+    if not isinstance(valor, (str, int)) or isinstance(valor, bool):
+        problemas.append(f"'{columna}' debe ser texto")
+        return None
+    valor = normalizar_espacios(str(valor))
+    if len(valor) > LONGITUD_MAXIMA_TEXTO:
+        problemas.append(f"'{columna}' supera {LONGITUD_MAXIMA_TEXTO} caracteres")
+    return valor or None
+
+def _categoria_captura(valor, columna, validos, problemas):
+    texto = _texto_captura(valor, columna, problemas)
+    if texto is None:
+        problemas.append(f"'{columna}' es obligatorio")
         return None
+    for valido in validos:
+        if texto.lower() == valido.lower():
+            return valido
+    problemas.append(f"'{columna}' debe ser uno de: {', '.join(validos)}")
+    return None
+
+def _fecha_captura(valor, problemas):
+    if valor is None:
+        return date.today().isoformat()
+    if isinstance(valor, str):
+        texto = valor.strip()
+        for formato in ('%Y-%m-%d', '%d/%m/%Y'):
+            try:
+                return datetime.strptime(texto, formato).date().isoformat()
+            except ValueError:
+                pass
+    problemas.append("'Fecha_entrga_CAV' debe tener formato AAAA-MM-DD o DD/MM/AAAA")
+    return None
+
+# Validar una captura contra las columnas del dataset. Devuelve el registro
+# normalizado o lanza ValueError con todos los problemas encontrados.
+def validar_captura(registro, columnas):
+    if not isinstance(registro, dict):
+        raise ValueError('Cada captura debe ser un objeto JSON')
+    problemas = []
+    desconocidas = [c for c in registro if c not in columnas]
+    if desconocidas:
+        problemas.append(f"Columnas desconocidas: {', '.join(map(str, desconocidas))}")
+
+    peso = registro.get('Peso_Kg')
+    if isinstance(peso, bool) or not isinstance(peso, (int, float)) or not math.isfinite(peso):
+        problemas.append("'Peso_Kg' debe ser un número")
+        peso = None
+    elif not 0 < peso <= PESO_MAXIMO_KG:
+        problemas.append(f"'Peso_Kg' debe estar entre 0 y {PESO_MAXIMO_KG} kg")
+
+    individuo = registro.get('Individuos')
+    if individuo is not None and (isinstance(individuo, bool) or not isinstance(individuo, int)
+                                  or not 1 <= individuo <= INDIVIDUO_MAXIMO):
+        problemas.append(f"'Individuos' debe ser un entero entre 1 y {INDIVIDUO_MAXIMO}")
+
+    normalizado = {columna: None for columna in columnas}
+    validadas = {
+        'Individuos': individuo,
+        'Fecha_entrga_CAV': _fecha_captura(registro.get('Fecha_entrga_CAV'), problemas),
+        'Peso_Kg': float(peso) if peso is not None else None,
+        'Edad': _categoria_captura(registro.get('Edad'), 'Edad', EDADES_VALIDAS, problemas),
+        'Sexo': _categoria_captura(registro.get('Sexo'), 'Sexo', SEXOS_VALIDOS, problemas),
+    }
+    # El resto de columnas del libro son de texto (CNI, nombres, estado)
+    for columna, valor in registro.items():
+        if columna in columnas and columna not in validadas:
+            normalizado[columna] = _texto_captura(valor, columna, problemas)
+    normalizado.update(validadas)
+    if problemas:
+        raise ValueError('; '.join(problemas))
+    return normalizado
+
+# Registro de capturas en disco: un JSON por línea, solo se anexa. Cada
+# worker lo lee desde su último desplazamiento, así que todos ven las
+# capturas escritas por los demás sin releer el libro.
+class RegistroCapturas:
+    def __init__(self, ruta):
+        self.ruta = ruta
+
+    # (inodo, tamaño) o None si todavía no existe
+    def firma(self):
+        try:
+            st = os.stat(self.ruta)
+        except FileNotFoundError:
+            return None
+        return (st.st_ino, st.st_size)
+
+    # Líneas completas a partir de un desplazamiento en bytes
+    def leer_desde(self, desplazamiento):
+        try:
+            with open(self.ruta, 'rb') as f:
+                f.seek(desplazamiento)
+                contenido = f.read()
+        except FileNotFoundError:
+            return [], 0
+        fin = contenido.rfind(b'\n') + 1
+        registros = []
+        for numero, linea in enumerate(contenido[:fin].splitlines()):
+            if not linea.strip():
+                continue
+            try:
+                registros.append(json.loads(linea))
+            except ValueError:
+                logger.error("Línea corrupta en %s (desplazamiento %d, línea %d)", self.ruta, desplazamiento, numero)
+        return registros, desplazamiento + fin
+
+    # Bloqueo exclusivo entre procesos mientras se anexa
+    @contextlib.contextmanager
+    def bloqueo(self):
+        os.makedirs(os.path.dirname(self.ruta) or '.', exist_ok=True)
+        with open(self.ruta, 'ab') as f:
+            if fcntl is not None:
+                fcntl.flock(f, fcntl.LOCK_EX)
+            try:
+                yield f
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f, fcntl.LOCK_UN)
+
+    # Anexar registros en una sola escritura y forzarla a disco
+    def anexar(self, archivo, registros):
+        datos = ''.join(json.dumps(r, ensure_ascii=False) + '\n' for r in registros).encode('utf-8')
+        archivo.write(datos)
+        archivo.flush()
+        os.fsync(archivo.fileno())
+
+# Estimador P² (Jain y Chlamtac) de un cuantil en memoria constante: cinco
+# marcadores cuyas alturas se ajustan con interpolación parabólica
+class CuantilP2:
+    def __init__(self, p=0.5):
+        self.p = p
+        self.n = 0
+        self.alturas = []
+        self.posiciones = [1, 2, 3, 4, 5]
+        self.incrementos = [0, p / 2, p, (1 + p) / 2, 1]
+        self.deseadas = [1 + 4 * i for i in self.incrementos]
+
+    # Inicializar los marcadores con los cuantiles exactos de valores ya ordenados
+    @classmethod
+    def desde_ordenados(cls, ordenados, p=0.5):
+        estimador = cls(p)
+        if len(ordenados) < 5:
+            for valor in ordenados:
+                estimador.agregar(float(valor))
+            return estimador
+        n = len(ordenados)
+        estimador.n = n
+        estimador.deseadas = [1 + (n - 1) * i for i in estimador.incrementos]
+        estimador.posiciones = [int(round(d)) for d in estimador.deseadas]
+        estimador.alturas = [float(ordenados[i - 1]) for i in estimador.posiciones]
+        return estimador
+
+    def agregar(self, x):
+        self.n += 1
+        q, pos = self.alturas, self.posiciones
+        if self.n <= 5:
+            bisect.insort(q, x)
+            return
+        if x < q[0]:
+            q[0] = x
+            k = 0
+        elif x >= q[4]:
+            q[4] = x
+            k = 3
+        else:
+            k = bisect.bisect_right(q, x, 1, 4) - 1
+        for i in range(k + 1, 5):
+            pos[i] += 1
+        for i in range(5):
+            self.deseadas[i] += self.incrementos[i]
+        for i in (1, 2, 3):
+            d = self.deseadas[i] - pos[i]
+            if (d >= 1 and pos[i + 1] - pos[i] > 1) or (d <= -1 and pos[i - 1] - pos[i] < -1):
+                d = 1 if d > 0 else -1
+                parabolica = q[i] + d / (pos[i + 1] - pos[i - 1]) * (
+                    (pos[i] - pos[i - 1] + d) * (q[i + 1] - q[i]) / (pos[i + 1] - pos[i])
+                    + (pos[i + 1] - pos[i] - d) * (q[i] - q[i - 1]) / (pos[i] - pos[i - 1])
+                )
+                if q[i - 1] < parabolica < q[i + 1]:
+                    q[i] = parabolica
+                else:
+                    q[i] += d * (q[i + d] - q[i]) / (pos[i + d] - pos[i])
+                pos[i] += d
+
+    @property
+    def valor(self):
+        if not self.alturas:
+            return None
+        if self.n < 5:
+            return float(np.quantile(self.alturas, self.p))
+        return self.alturas[2]
+
+# Agregados del dataset que se actualizan en O(1) por captura: conteos
+# Edad x Sexo, min/max, media y varianza del peso (Welford), mediana (P²)
+# y capturas por día. Se inicializan una vez por versión del libro.
+class AgregadosIncrementales:
+    def __init__(self):
+        self.total = 0
+        self.conteos = {}
+        self.n_peso = 0
+        self.media = 0.0
+        self.m2 = 0.0
+        self.peso_min = math.inf
+        self.peso_max = -math.inf
+        self.mediana = CuantilP2(0.5)
+        self.por_dia = {}
+        self.individuo_max = 0
+
+    @classmethod
+    def desde_df(cls, df):
+        agregados = cls()
+        agregados.total = len(df)
+        conteos = df.groupby(['Edad', 'Sexo'], dropna=False, sort=False, observed=True).size()
+        agregados.conteos = {
+            tuple(None if pd.isna(v) else v for v in clave): int(n) for clave, n in conteos.items()
+        }
+        pesos = valores_float64(df['Peso_Kg'])
+        pesos = pesos[~np.isnan(pesos)]
+        if len(pesos):
+            agregados.n_peso = len(pesos)
+            agregados.media = float(pd.Series(pesos).mean())
+            agregados.m2 = float(((pesos - agregados.media) ** 2).sum())
+            agregados.peso_min = float(pesos.min())
+            agregados.peso_max = float(pesos.max())
+            agregados.mediana = CuantilP2.desde_ordenados(np.sort(pesos))
+        if 'Fecha_entrga_CAV' in df.columns:
+            dias = df['Fecha_entrga_CAV'].dropna().dt.strftime('%Y-%m-%d').value_counts()
+            agregados.por_dia = {dia: int(n) for dia, n in dias.items()}
+        if 'Individuos' in df.columns and df['Individuos'].notna().any():
+            agregados.individuo_max = int(pd.to_numeric(df['Individuos'], errors='coerce').max())
+        return agregados
+
+    def agregar(self, registro):
+        self.total += 1
+        clave = (registro.get('Edad'), registro.get('Sexo'))
+        self.conteos[clave] = self.conteos.get(clave, 0) + 1
+        peso = registro.get('Peso_Kg')
+        if peso is not None:
+            self.n_peso += 1
+            delta = peso - self.media
+            self.media += delta / self.n_peso
+            self.m2 += delta * (peso - self.media)
+            self.peso_min = min(self.peso_min, peso)
+            self.peso_max = max(self.peso_max, peso)
+            self.mediana.agregar(peso)
+        dia = registro.get('Fecha_entrga_CAV')
+        if dia:
+            self.por_dia[dia] = self.por_dia.get(dia, 0) + 1
+        if registro.get('Individuos'):
+            self.individuo_max = max(self.individuo_max, registro['Individuos'])
+
+    @property
+    def varianza(self):
+        return self.m2 / (self.n_peso - 1) if self.n_peso > 1 else 0.0
+
+    # Mismo resumen que calcular_kpis(df), sin recorrer el dataset
+    def a_kpis(self):
+        sin_pesos = self.n_peso == 0
+        return resumen_kpis(
+            self.total, self.conteos,
+            peso_promedio=math.nan if sin_pesos else self.media,
+            peso_max=math.nan if sin_pesos else self.peso_max,
+            peso_min=math.nan if sin_pesos else self.peso_min
+        )
+
+    def resumen_peso(self):
+        if self.n_peso == 0:
+            return {'n': 0}
+        return {
+            'n': self.n_peso,
+            'media': round(self.media, 4),
+            'varianza': round(self.varianza, 4),
+            'desviacion': round(math.sqrt(self.varianza), 4),
+            'mediana_estimada': round(self.mediana.valor, 4),
+            'min': self.peso_min,
+            'max': self.peso_max,
+        }
+
+# Agregados parciales de un libro que se combinan sin volver a las filas:
+# conteos Edad x Sexo, pesos válidos ordenados de cada grupo (la media, la
+# mediana y los cuartiles de la unión salen exactos de fusionarlos), orden de
+# aparición de las edades y capturas por día. Los KPIs y las figuras ligeras
+# de cualquier subconjunto de libros del catálogo se calculan a partir de la
+# combinación de los suyos.
+class ResumenParcial:
+    def __init__(self):
+        self.total = 0
+        self.conteos = {}
+        self.pesos = {}
+        self.edades = []
+        self.dias = np.array([], dtype='datetime64[D]')
+        self.capturas_dia = np.array([], dtype='int64')
+
+    def __len__(self):
+        return self.total
+
+    @classmethod
+    def desde_df(cls, df):
+        resumen = cls()
+        resumen.total = len(df)
+        pesos = valores_float64(df['Peso_Kg'])
+        grupos = df.groupby(['Edad', 'Sexo'], dropna=False, sort=False, observed=True).indices
+        for clave, posiciones in grupos.items():
+            clave = tuple(None if pd.isna(v) else v for v in clave)
+            resumen.conteos[clave] = len(posiciones)
+            tramo = pesos[posiciones]
+            resumen.pesos[clave] = np.sort(tramo[~np.isnan(tramo)])
+        resumen.edades = [None if pd.isna(e) else e for e in df['Edad'].unique()]
+        indice = IndiceTemporal(df)
+        resumen.dias, resumen.capturas_dia = indice.dias, np.diff(indice.acumulado)
+        return resumen
+
+    @classmethod
+    def combinar(cls, resumenes):
+        combinado = cls()
+        pesos = {}
+        for resumen in resumenes:
+            combinado.total += resumen.total
+            for clave, n in resumen.conteos.items():
+                combinado.conteos[clave] = combinado.conteos.get(clave, 0) + n
+            for clave, tramo in resumen.pesos.items():
+                pesos.setdefault(clave, []).append(tramo)
+            combinado.edades.extend(e for e in resumen.edades if e not in combinado.edades)
+        combinado.pesos = {clave: np.sort(np.concatenate(tramos)) for clave, tramos in pesos.items()}
+        dias = [r.dias for r in resumenes if len(r.dias)]
+        if dias:
+            combinado.dias, posiciones = np.unique(np.concatenate(dias), return_inverse=True)
+            combinado.capturas_dia = np.bincount(
+                posiciones, weights=np.concatenate([r.capturas_dia for r in resumenes if len(r.dias)]),
+                minlength=len(combinado.dias)).astype('int64')
+        return combinado
+
+    # Conteos de Edad o Sexo en el orden de value_counts (más frecuentes
+    # primero y, a igualdad, por categoría)
+    def conteo(self, columna):
+        posicion = ('Edad', 'Sexo').index(columna)
+        totales = {}
+        for clave, n in self.conteos.items():
+            if clave[posicion] is not None:
+                totales[clave[posicion]] = totales.get(clave[posicion], 0) + n
+        orden = sorted(totales, key=lambda valor: (-totales[valor], valor))
+        return pd.Series([totales[valor] for valor in orden], index=pd.Index(orden, name=columna),
+                         name='count', dtype='int64')
+
+    def pesos_ordenados(self):
+        if not self.pesos:
+            return np.array([], dtype='float64')
+        return np.sort(np.concatenate(list(self.pesos.values())))
+
+    def a_kpis(self):
+        pesos = self.pesos_ordenados()
+        if not len(pesos):
+            return resumen_kpis(self.total, self.conteos, math.nan, math.nan, math.nan)
+        return resumen_kpis(self.total, self.conteos, peso_promedio=pesos.mean(),
+                            peso_max=pesos[-1], peso_min=pesos[0])
+
+# Fuentes de datos. CacheDatos les pide una firma barata (en cada petición),
+# la versión de contenido (solo si la firma cambió) y el DataFrame de esa
+# versión. Las de un único archivo exponen su copia local (`ruta`); las
+# remotas la mantienen al día desde un hilo en segundo plano con peticiones
+# condicionales (ETag / If-Modified-Since). Las peticiones HTTP se sirven
+# siempre de la última copia buena y solo esperan a la red en el primer
+# arranque, cuando todavía no hay copia local.
+class FuenteLocal:
+    nombre = 'local'
+
+    def __init__(self, ruta):
+        self.ruta = ruta
+
+    def preparar(self):
+        pass
+
+    def firma(self):
+        st = os.stat(self.ruta)
+        return (st.st_mtime_ns, st.st_size)
+
+    def version(self, firma):
+        return calcular_hash_archivo(self.ruta)
+
+    def cargar(self, version):
+        return cargar_version(self.ruta, version)
+
+class FuenteCSVRemota(FuenteLocal):
+    nombre = 'csv'
+
+    def __init__(self, url, directorio=DIR_DATOS_REMOTOS, intervalo=INTERVALO_ACTUALIZACION,
+                 timeout=TIMEOUT_DESCARGA):
+        self.url = url
+        self.intervalo = intervalo
+        self.timeout = timeout
+        clave = hashlib.sha1(url.encode('utf-8')).hexdigest()[:12]
+        self.ruta = os.path.join(directorio, f'{self.nombre}-{clave}.csv')
+        self._ruta_meta = self.ruta + '.meta.json'
+        self._ruta_bloqueo = self.ruta + '.lock'
+        self._lock = threading.Lock()
+        self._hilo = None
+        self._pid = None
+        self._parar = threading.Event()
+
+    def url_descarga(self):
+        return self.url
+
+    def _activo(self):
+        return self._hilo is not None and self._pid == os.getpid() and self._hilo.is_alive()
+
+    # Arrancar el hilo de actualización (también en cada worker tras el fork)
+    # y, si aún no hay copia local, descargarla antes de responder
+    def preparar(self):
+        if self._activo():
+            return
+        with self._lock:
+            if self._activo():
+                return
+            if not os.path.exists(self.ruta):
+                self.actualizar()
+            self._pid = os.getpid()
+            self._parar = threading.Event()
+            self._hilo = threading.Thread(target=self._bucle, name=f'fuente-{self.nombre}', daemon=True)
+            self._hilo.start()
+
+    def detener(self):
+        self._parar.set()
+
+    def _bucle(self):
+        # Sin copia local se reintenta más a menudo
+        while not self._parar.wait(self.intervalo if os.path.exists(self.ruta) else min(self.intervalo, 30)):
+            try:
+                self.actualizar()
+            except Exception as e:
+                logger.exception("Error actualizando la fuente %s: %s", self.nombre, e)
+
+    def _leer_meta(self):
+        try:
+            with open(self._ruta_meta, encoding='utf-8') as f:
+                return json.load(f)
+        except (OSError, ValueError):
+            return {}
+
+    def _escribir_meta(self, meta):
+        tmp = self._ruta_meta + f'.{os.getpid()}'
+        with open(tmp, 'w', encoding='utf-8') as f:
+            json.dump(meta, f)
+        os.replace(tmp, self._ruta_meta)
+
+    # Consultar la fuente una vez. Solo un proceso consulta a la vez y los
+    # metadatos (ETag, Last-Modified, última consulta) se comparten entre
+    # workers, de modo que N workers no multiplican las descargas.
+    def actualizar(self):
+        os.makedirs(os.path.dirname(self.ruta), exist_ok=True)
+        with open(self._ruta_bloqueo, 'a') as bloqueo:
+            if fcntl is not None:
+                try:
+                    fcntl.flock(bloqueo, fcntl.LOCK_EX | fcntl.LOCK_NB)
+                except BlockingIOError:
+                    return 'ocupado'
+            resultado = self._consultar()
+        metricas.incrementar('iguanas_fuente_consultas_total', 'Consultas a la fuente de datos remota',
+                             fuente=self.nombre, resultado=resultado)
+        return resultado
+
+    def _consultar(self):
+        meta = self._leer_meta()
+        hay_copia = os.path.exists(self.ruta)
+        if hay_copia and time.time() - meta.get('consultado', 0) < self.intervalo / 2:
+            return 'reciente'
+
+        peticion = urllib.request.Request(self.url_descarga(), headers={'User-Agent': 'dash-iguanas'})
+        if hay_copia and meta.get('etag'):
+            peticion.add_header('If-None-Match', meta['etag'])
+        if hay_copia and meta.get('last_modified'):
+            peticion.add_header('If-Modified-Since', meta['last_modified'])
+        try:
+            with urllib.request.urlopen(peticion, timeout=self.timeout) as respuesta:
+                contenido = respuesta.read()
+                cabeceras = respuesta.headers
+        except urllib.error.HTTPError as e:
+            if e.code == 304:
+                meta['consultado'] = time.time()
+                self._escribir_meta(meta)
+                return 'sin_cambios'
+            logger.warning("Fuente %s: HTTP %s; se mantiene la última copia", self.nombre, e.code)
+            return 'error'
+        except (urllib.error.URLError, OSError) as e:
+            logger.warning("Fuente %s no disponible (%s); se mantiene la última copia", self.nombre, e)
+            return 'error'
+
+        huella = hashlib.sha1(contenido).hexdigest()
+        meta.update(etag=cabeceras.get('ETag'), last_modified=cabeceras.get('Last-Modified'),
+                    consultado=time.time())
+        if hay_copia and huella == meta.get('sha1'):
+            self._escribir_meta(meta)
+            return 'sin_cambios'
+
+        # Validar antes de publicar: una descarga inválida no sustituye a la última copia buena
+        descriptor, tmp = tempfile.mkstemp(suffix=os.path.splitext(self.ruta)[1], dir=os.path.dirname(self.ruta))
+        with os.fdopen(descriptor, 'wb') as f:
+            f.write(contenido)
+        if leer_archivo(tmp) is None:
+            os.unlink(tmp)
+            logger.error("Fuente %s: el contenido descargado no es válido; se mantiene la última copia", self.nombre)
+            return 'error'
+        os.replace(tmp, self.ruta)
+        meta['sha1'] = huella
+        self._escribir_meta(meta)
+        metricas.fijar('iguanas_fuente_actualizada_timestamp', time.time(),
+                       'Última descarga de la fuente remota', fuente=self.nombre)
+        logger.info("Fuente %s actualizada (%d bytes)", self.nombre, len(contenido))
+        return 'actualizado'
+
+# Hoja de Google Sheets: enlaces de edición o de compartir se convierten en
+# la URL de exportación CSV; las URLs publicadas (output=csv) se usan tal cual
+class FuenteGoogleSheets(FuenteCSVRemota):
+    nombre = 'sheets'
+    _ID_HOJA = re.compile(r'/spreadsheets/d/([\w-]+)')
+
+    def url_descarga(self):
+        coincidencia = self._ID_HOJA.search(self.url)
+        if not coincidencia or '/export' in self.url or 'output=csv' in self.url:
+            return self.url
+        partes = urllib.parse.urlsplit(self.url)
+        gid = urllib.parse.parse_qs(partes.query).get('gid') or urllib.parse.parse_qs(partes.fragment).get('gid')
+        url = f'https://docs.google.com/spreadsheets/d/{coincidencia.group(1)}/export?format=csv'
+        return url + (f'&gid={gid[0]}' if gid else '')
+
+# Catálogo de libros de captura, uno por sitio y temporada. La versión del
+# catálogo es la huella de las versiones de sus libros; cada libro se parsea
+# (y se guarda en su propio snapshot) solo cuando cambia su contenido, en un
+# pool de procesos si hay varios pendientes. El DataFrame publicado es la
+# unión de todos con las columnas Sitio y Temporada; los agregados parciales
+# de cada libro se conservan para resolver subconjuntos sin tocar las filas.
+EXTENSIONES_CATALOGO = ('.xlsx', '.xlsm', '.xls', '.csv')
+COLUMNAS_CATALOGO = ('Sitio', 'Temporada')
+
+@dataclass(frozen=True)
+class LibroCatalogo:
+    sitio: str
+    temporada: object
+    version: str
+    df: object
+    resumen: object
+
+# Sitio y temporada de un libro según su ruta dentro del catálogo
+# (<sitio>/<temporada>.xlsx); un libro en la raíz es un sitio sin temporada
+def sitio_temporada(relativa):
+    partes = relativa.replace(os.sep, '/').split('/')
+    nombre = os.path.splitext(partes[-1])[0]
+    if len(partes) == 1:
+        return nombre, None
+    return partes[0], '/'.join(partes[1:-1] + [nombre])
+
+def version_catalogo(versiones):
+    h = hashlib.sha1()
+    for relativa, version in sorted(versiones.items()):
+        h.update(f'{relativa}\0{version}\n'.encode('utf-8'))
+    return f'{h.hexdigest()[:16]}@{len(versiones)}'
+
+# Parsear un libro en un proceso del pool. Con snapshots el proceso los
+# escribe y el padre solo los mapea; sin ellos devuelve el DataFrame.
+def _parsear_libro_catalogo(ruta, version, directorio):
+    df = cargar_version(ruta, version, directorio)
+    if df is None:
+        return None, None
+    resumen = ResumenParcial.desde_df(df)
+    if SNAPSHOTS_ACTIVOS and os.path.isdir(os.path.join(directorio, _nombre_snapshot(version))):
+        df = None
+    return df, resumen
+
+# Unir los libros en un único DataFrame compacto: las categorías de cada
+# columna pasan a ser la unión de las de todos los libros
+def combinar_libros(libros):
+    partes = [libro.df.copy(deep=False) for libro in libros]
+    columnas = list(dict.fromkeys(c for parte in partes for c in parte.columns))
+    for columna in columnas:
+        tipos = [parte[columna].dtype for parte in partes if columna in parte.columns]
+        if all(isinstance(tipo, pd.CategoricalDtype) for tipo in tipos):
+            categorias = sorted({c for tipo in tipos for c in tipo.categories})
+            for parte in partes:
+                if columna in parte.columns:
+                    parte[columna] = parte[columna].cat.set_categories(categorias)
+    df = pd.concat(partes, ignore_index=True)
+    filas = [len(parte) for parte in partes]
+    for columna, valores in (('Sitio', [l.sitio for l in libros]), ('Temporada', [l.temporada for l in libros])):
+        categorias = sorted({v for v in valores if v is not None})
+        codigos = [-1 if v is None else categorias.index(v) for v in valores]
+        df[columna] = pd.Categorical.from_codes(np.repeat(np.array(codigos, dtype='int64'), filas),
+                                                categories=categorias)
+    return df
+
+class FuenteCatalogo:
+    nombre = 'catalogo'
+
+    def __init__(self, directorio, workers=WORKERS_CATALOGO, dir_snapshots=DIR_SNAPSHOTS,
+                 intervalo=INTERVALO_COMPROBACION):
+        self.ruta = directorio
+        self.workers = max(1, workers)
+        self.dir_snapshots = os.path.join(dir_snapshots, 'catalogo')
+        self.intervalo = intervalo
+        # (firma, instante) de la última comprobación del directorio
+        self._comprobada = (None, -math.inf)
+        # Ruta relativa -> ((mtime, tamaño), versión) de los libros vistos
+        self._archivos = {}
+        # Ruta relativa -> LibroCatalogo de la versión publicada
+        self._libros = {}
+
+    def preparar(self):
+        pass
+
+    def descubrir(self):
+        relativas = []
+        for raiz, directorios, archivos in os.walk(self.ruta):
+            directorios[:] = [d for d in directorios if not d.startswith('.')]
+            for nombre in archivos:
+                # Se omiten ocultos y los bloqueos de Excel (~$libro.xlsx)
+                if nombre.startswith(('.', '~$')) or not nombre.lower().endswith(EXTENSIONES_CATALOGO):
+                    continue
+                relativas.append(os.path.relpath(os.path.join(raiz, nombre), self.ruta))
+        return sorted(relativas)
+
+    # Ruta, mtime y tamaño de cada libro. Recorrer el directorio y hacer
+    # stat de cada libro cuesta más que servir la petición, así que durante
+    # `intervalo` segundos se devuelve la última firma
+    def firma(self):
+        firma, instante = self._comprobada
+        ahora = time.monotonic()
+        if firma is not None and ahora - instante < self.intervalo:
+            return firma
+        if not os.path.isdir(self.ruta):
+            raise FileNotFoundError(f'No existe el catálogo {self.ruta}')
+        firma = []
+        for relativa in self.descubrir():
+            st = os.stat(os.path.join(self.ruta, relativa))
+            firma.append((relativa, st.st_mtime_ns, st.st_size))
+        firma = tuple(firma)
+        self._comprobada = (firma, ahora)
+        return firma
+
+    # Solo se vuelve a calcular el hash de los libros cuya firma cambió
+    def version(self, firma):
+        archivos = {}
+        for relativa, mtime, tamano in firma:
+            anterior = self._archivos.get(relativa)
+            if anterior is not None and anterior[0] == (mtime, tamano):
+                archivos[relativa] = anterior
+            else:
+                archivos[relativa] = ((mtime, tamano), calcular_hash_archivo(os.path.join(self.ruta, relativa)))
+        self._archivos = archivos
+        return version_catalogo({relativa: version for relativa, (_, version) in archivos.items()})
+
+    def _directorio_snapshots(self, relativa):
+        return os.path.join(self.dir_snapshots, hashlib.sha1(relativa.encode('utf-8')).hexdigest()[:12])
+
+    # Parsear los libros nuevos o modificados, en paralelo si son varios
+    def _parsear(self, pendientes):
+        tareas = {relativa: (os.path.join(self.ruta, relativa), version, self._directorio_snapshots(relativa))
+                  for relativa, version in pendientes.items()}
+        workers = min(self.workers, len(tareas))
+        if workers > 1:
+            # 'spawn' evita heredar locks de hilos del proceso padre
+            with ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context('spawn')) as pool:
+                futuros = {relativa: pool.submit(_parsear_libro_catalogo, *tarea) for relativa, tarea in tareas.items()}
+                resultados = {}
+                for relativa, futuro in futuros.items():
+                    try:
+                        resultados[relativa] = futuro.result()
+                    except Exception as e:
+                        logger.error("Error parseando %s del catálogo: %s", relativa, e)
+                        resultados[relativa] = (None, None)
+        else:
+            resultados = {relativa: _parsear_libro_catalogo(*tarea) for relativa, tarea in tareas.items()}
+
+        libros = {}
+        for relativa, (df, resumen) in resultados.items():
+            ruta, version, directorio = tareas[relativa]
+            if resumen is not None and df is None:
+                df = abrir_snapshot(version, directorio)
+            if df is None:
+                logger.error("No se pudo leer %s del catálogo", relativa)
+                continue
+            libros[relativa] = LibroCatalogo(*sitio_temporada(relativa), version, df, resumen)
+        return libros
+
+    # Si algún libro falla se conserva la última versión válida del catálogo
+    def cargar(self, version):
+        pendientes = {relativa: v for relativa, (_, v) in self._archivos.items()
+                      if relativa not in self._libros or self._libros[relativa].version != v}
+        if not self._archivos:
+            logger.error("El catálogo %s no tiene libros", self.ruta)
+            return None
+        nuevos = self._parsear(pendientes) if pendientes else {}
+        if len(nuevos) < len(pendientes):
+            return None
+        self._libros = {relativa: nuevos.get(relativa) or self._libros[relativa] for relativa in self._archivos}
+        metricas.incrementar('iguanas_catalogo_libros_parseados_total', 'Libros del catálogo parseados',
+                             len(nuevos))
+        logger.info("Catálogo: %d libros (%d parseados)", len(self._libros), len(nuevos))
+        self._limpiar_snapshots()
+        return combinar_libros(list(self._libros.values()))
+
+    # Borrar los snapshots de libros que ya no están en el catálogo
+    def _limpiar_snapshots(self):
+        vigentes = {os.path.basename(self._directorio_snapshots(relativa)) for relativa in self._libros}
+        try:
+            entradas = os.listdir(self.dir_snapshots)
+        except OSError:
+            return
+        for nombre in entradas:
+            if nombre not in vigentes and not nombre.startswith('.'):
+                shutil.rmtree(os.path.join(self.dir_snapshots, nombre), ignore_errors=True)
+
+    # Sitios y temporadas de la versión publicada
+    def dimensiones(self):
+        libros = list(self._libros.values())
+        return (tuple(sorted({l.sitio for l in libros})),
+                tuple(sorted({l.temporada for l in libros if l.temporada is not None})))
+
+    # Agregados combinados de los libros de esos sitios y temporadas (vacío = todos)
+    def resumen(self, sitios=(), temporadas=()):
+        return ResumenParcial.combinar([
+            libro.resumen for libro in self._libros.values()
+            if (not sitios or libro.sitio in sitios) and (not temporadas or libro.temporada in temporadas)
+        ])
+
+def crear_fuente_datos():
+    tipo = FUENTE_DATOS or ('sheets' if GOOGLE_SHEETS_URL else 'csv' if URL_DATOS_CSV else 'local')
+    if tipo == 'sheets' and GOOGLE_SHEETS_URL:
+        return FuenteGoogleSheets(GOOGLE_SHEETS_URL)
+    if tipo == 'csv' and URL_DATOS_CSV:
+        return FuenteCSVRemota(URL_DATOS_CSV)
+    if tipo == 'catalogo':
+        return FuenteCatalogo(DIR_CATALOGO)
+    if tipo != 'local':
+        logger.error("FUENTE_DATOS=%s sin URL configurada; se usa %s", tipo, RUTA_DATOS)
+    return FuenteLocal(RUTA_DATOS)
+
+# Caché de proceso del dataset.
+# El libro se parsea una sola vez y se vuelve a leer únicamente cuando cambia
+# el archivo: la comprobación barata (mtime/tamaño) se hace en cada petición y
+# el hash de contenido solo cuando esa firma cambia. Todas las peticiones
+# comparten el mismo DataFrame, que debe tratarse como de solo lectura.
+# Las capturas del registro de anexado se leen de forma incremental y se
+# suman al libro; los agregados de KPIs se actualizan captura a captura.
+class CacheDatos:
+    def __init__(self, fuente, ruta_capturas=RUTA_CAPTURAS):
+        self.fuente = FuenteLocal(fuente) if isinstance(fuente, str) else fuente
+        self.ruta = self.fuente.ruta
+        self._lock = threading.Lock()
+        # (DataFrame, versión) se publica como una única tupla para que los
+        # lectores nunca vean un DataFrame de una versión con el id de otra
+        self._actual = (None, None)
+        self._firma = None
+        # (instante del próximo reintento, espera) tras una lectura fallida
+        self._reintento = None
+        self.recargas = 0
+        # Libro sin capturas y estado del registro de capturas
+        self._libro = (None, None)
+        self.capturas = RegistroCapturas(ruta_capturas)
+        self._firma_capturas = None
+        self._desplazamiento = 0
+        self._n_anexadas = 0
+        self._agregados = None
+
+    @property
+    def version(self):
+        return self._actual[1]
+
+    # Devuelve (df, version) verificando antes si el archivo cambió
+    def instantanea(self):
+        self.fuente.preparar()
+        try:
+            firma = self.fuente.firma()
+        except OSError as e:
+            logger.warning("Error accediendo a %s: %s", self.ruta, e)
+            # Servir la última versión válida si el archivo desaparece temporalmente
+            return self._actual
+
+        firma_capturas = self.capturas.firma()
+        if firma == self._firma and firma_capturas == self._firma_capturas and not self._toca_reintentar():
+            metricas.incrementar('iguanas_cache_total', 'Consultas a las cachés', cache='dataset', resultado='acierto')
+            return self._actual
+
+        metricas.incrementar('iguanas_cache_total', 'Consultas a las cachés', cache='dataset', resultado='fallo')
+        # Solo un hilo recarga; el resto espera y reutiliza el resultado
+        with self._lock:
+            if firma != self._firma or self._toca_reintentar():
+                self._recargar_libro(firma)
+            self._sincronizar_capturas()
+            return self._actual
+
+    def _toca_reintentar(self):
+        return self._reintento is not None and time.monotonic() >= self._reintento[0]
+
+    def _recargar_libro(self, firma):
+        version = self.fuente.version(firma)
+        if version != self._libro[1]:
+            with medir('carga'):
+                df = self.fuente.cargar(version)
+            if df is not None:
+                self._libro = (df, version)
+                # Las capturas se vuelven a aplicar sobre el libro nuevo
+                self._firma_capturas = None
+                self._desplazamiento = 0
+                self._n_anexadas = 0
+                self._agregados = AgregadosIncrementales.desde_df(df)
+                self._publicar()
+                self.recargas += 1
+                metricas.incrementar('iguanas_recargas_dataset_total', 'Recargas del dataset')
+                logger.info("Dataset cargado: versión %s (%d registros)", version, len(df))
+            else:
+                # Se conserva la última versión válida y la firma fallida se
+                # reintenta con espera creciente (p. ej. un libro a medio
+                # escribir); si el archivo cambia se relee en la siguiente
+                # consulta
+                metricas.incrementar('iguanas_errores_carga_total', 'Lecturas del dataset fallidas')
+                espera = REINTENTO_CARGA
+                if firma == self._firma and self._reintento is not None:
+                    espera = min(self._reintento[1] * 2, REINTENTO_CARGA_MAXIMO)
+                self._reintento = (time.monotonic() + espera, espera)
+                self._firma = firma
+                logger.warning("Lectura de %s fallida; nuevo intento en %.0f s", self.ruta, espera)
+                return
+        self._reintento = None
+        self._firma = firma
+
+    # Leer las capturas anexadas desde la última lectura (de este u otro worker)
+    def _sincronizar_capturas(self):
+        df_libro = self._libro[0]
+        firma = self.capturas.firma()
+        if df_libro is None or firma == self._firma_capturas:
+            return
+        # Registro rotado o truncado: volver a aplicarlo desde el principio
+        reiniciar = bool(self._desplazamiento) and (
+            firma is None or firma[1] < self._desplazamiento
+            or (self._firma_capturas is not None and firma[0] != self._firma_capturas[0])
+        )
+        if reiniciar:
+            self._desplazamiento = 0
+            self._n_anexadas = 0
+            self._agregados = AgregadosIncrementales.desde_df(df_libro)
+        nuevas, self._desplazamiento = self.capturas.leer_desde(self._desplazamiento)
+        for registro in nuevas:
+            self._agregados.agregar(registro)
+        self._n_anexadas += len(nuevas)
+        # Con una línea a medio escribir se reintenta en la próxima consulta
+        self._firma_capturas = firma if firma is None or self._desplazamiento == firma[1] else None
+        if nuevas or reiniciar:
+            self._publicar(nuevas)
+
+    # Publicar libro + capturas como una nueva versión. Solo las capturas
+    # nuevas pasan a DataFrame y se concatenan a lo ya publicado (que lleva
+    # el libro y las anteriores); si todas son nuevas se parte del libro
+    def _publicar(self, nuevas=()):
+        df_libro, version_libro = self._libro
+        df = self._actual[0] if self._n_anexadas > len(nuevas) else df_libro
+        if nuevas:
+            anexadas = pd.DataFrame.from_records(
+                [{c: r.get(c) for c in df_libro.columns} for r in nuevas], columns=df_libro.columns
+            )
+            if 'Fecha_entrga_CAV' in anexadas.columns:
+                anexadas['Fecha_entrga_CAV'] = pd.to_datetime(anexadas['Fecha_entrga_CAV'], errors='coerce')
+            df = concatenar_compacto(df, anexadas)
+        self._actual = (df, componer_version(version_libro, self._n_anexadas))
+        metricas.fijar('iguanas_dataset_registros', len(df), 'Registros del dataset en memoria')
+        metricas.fijar('iguanas_capturas_anexadas', self._n_anexadas, 'Capturas anexadas sobre el libro')
+
+    # Validar y anexar capturas de forma atómica para todos los workers.
+    # Devuelve la nueva instantánea y los registros tal como se guardaron.
+    def anexar_capturas(self, registros):
+        self.instantanea()
+        with self._lock:
+            if self._libro[0] is None:
+                raise RuntimeError('No hay dataset cargado')
+            with self.capturas.bloqueo() as archivo:
+                # Ponerse al día con lo que hayan escrito otros workers
+                self._sincronizar_capturas()
+                siguiente = self._agregados.individuo_max + 1
+                registrada = datetime.now().isoformat(timespec='seconds')
+                guardados = []
+                for registro in registros:
+                    registro = dict(registro)
+                    if registro.get('Individuos') is None:
+                        registro['Individuos'] = siguiente
+                    siguiente = max(siguiente, registro['Individuos']) + 1
+                    registro['_registrada'] = registrada
+                    guardados.append(registro)
+                self.capturas.anexar(archivo, guardados)
+                self._sincronizar_capturas()
+            metricas.incrementar('iguanas_capturas_recibidas_total', 'Capturas recibidas por la API', len(guardados))
+            return self._actual, guardados
+
+    # KPIs a partir de los agregados incrementales, si son de esa versión
+    def kpis_incrementales(self, version):
+        with self._lock:
+            if self._agregados is None or version != self._actual[1]:
+                return None
+            return self._agregados.a_kpis()
+
+    # Agregados del catálogo combinados para unos sitios y temporadas, si
+    # la fuente es un catálogo y la versión sigue publicada
+    def resumen_catalogo(self, version, sitios=(), temporadas=()):
+        if not isinstance(self.fuente, FuenteCatalogo):
+            return None
+        with self._lock:
+            if version != self._actual[1]:
+                return None
+            return self.fuente.resumen(sitios, temporadas)
+
+    def dimensiones_catalogo(self):
+        if not isinstance(self.fuente, FuenteCatalogo):
+            return (), ()
+        with self._lock:
+            return self.fuente.dimensiones()
+
+    def resumen_capturas(self):
+        with self._lock:
+            agregados = self._agregados
+            return {
+                'version': self._actual[1],
+                'total': agregados.total if agregados else 0,
+                'anexadas': self._n_anexadas,
+                'peso': agregados.resumen_peso() if agregados else {'n': 0},
+                'capturas_por_dia': dict(sorted(agregados.por_dia.items())) if agregados else {},
+            }
+
+    def obtener(self):
+        return self.instantanea()[0]
+
+    def invalidar(self):
+        with self._lock:
+            self._firma = None
+            self._reintento = None
+            self._actual = (None, None)
+            self._libro = (None, None)
+            self._firma_capturas = None
+            self._desplazamiento = 0
+            self._n_anexadas = 0
+            self._agregados = None
+
+_cache_datos = CacheDatos(crear_fuente_datos())
+
+# Cargar datos (servidos desde la caché del proceso)
+def cargar_datos():
+    return _cache_datos.obtener()
+
+# Identificador de la versión del dataset actualmente en caché
+def version_datos():
+    return _cache_datos.instantanea()[1]
+
+# Notificador compartido de cambios de versión del dataset. Un solo hilo por
+# worker (vivo mientras haya suscriptores) comprueba la versión y despierta a
+# todos los suscriptores a la vez; un suscriptor inactivo solo espera en la
+# condición. Guarda además los últimos KPIs enviados por (versión, filtros)
+# para responder con un delta a quien reconecta con Last-Event-ID.
+class NotificadorCambios:
+    def __init__(self, obtener_version, intervalo=INTERVALO_NOTIFICACION):
+        self.obtener_version = obtener_version
+        self.intervalo = intervalo
+        self._condicion = threading.Condition()
+        self.version = None
+        self.secuencia = 0
+        self.suscriptores = 0
+        self._hilo = None
+        self._pid = None
+        self._historial = OrderedDict()
+
+    def avisar(self, version):
+        with self._condicion:
+            if version == self.version:
+                return
+            self.version = version
+            self.secuencia += 1
+            self._condicion.notify_all()
+
+    # Esperar a un cambio posterior a `secuencia`; devuelve la secuencia actual
+    def esperar(self, secuencia, timeout):
+        with self._condicion:
+            self._condicion.wait_for(lambda: self.secuencia != secuencia, timeout)
+            return self.secuencia
+
+    @contextlib.contextmanager
+    def suscripcion(self):
+        with self._condicion:
+            self.suscriptores += 1
+            if self._hilo is None or self._pid != os.getpid():
+                self._pid = os.getpid()
+                self._hilo = threading.Thread(target=self._vigilar, name='notificador', daemon=True)
+                self._hilo.start()
+        metricas.incrementar('iguanas_sse_conexiones_total', 'Conexiones SSE abiertas')
+        metricas.fijar('iguanas_sse_suscriptores', self.suscriptores, 'Suscriptores SSE conectados')
+        try:
+            yield
+        finally:
+            with self._condicion:
+                self.suscriptores -= 1
+            metricas.fijar('iguanas_sse_suscriptores', self.suscriptores, 'Suscriptores SSE conectados')
+
+    def _vigilar(self):
+        while True:
+            with self._condicion:
+                if self.suscriptores == 0:
+                    self._hilo = None
+                    return
+            try:
+                self.avisar(self.obtener_version())
+            except Exception as e:
+                logger.exception("Error comprobando la versión del dataset: %s", e)
+            time.sleep(self.intervalo)
+
+    def recordar(self, clave, kpis):
+        with self._condicion:
+            self._historial[clave] = kpis
+            self._historial.move_to_end(clave)
+            while len(self._historial) > LIMITE_HISTORIAL_KPIS:
+                self._historial.popitem(last=False)
+
+    def recordados(self, clave):
+        with self._condicion:
+            return self._historial.get(clave)
+
+_notificador = NotificadorCambios(version_datos)
+
+# Resultados derivados del dataset (KPIs, figuras, ...) memoizados por versión.
+# Al cambiar la versión se descartan los de versiones anteriores. Los
+# resultados `acotados` (los de cada combinación de filtros, que no tienen
+# límite) van a una LRU aparte para que no desplacen a los del dataset completo.
+class CacheDerivados:
+    def __init__(self, limite_acotados=LIMITE_CACHE_FILTROS):
+        self._lock = threading.Lock()
+        self._version = None
+        self._valores = {}
+        self._acotados = OrderedDict()
+        self._limite_acotados = limite_acotados
+
+    def consultar(self, clave, version, acotado=False):
+        with self._lock:
+            if version != self._version:
+                valor = None
+            elif acotado:
+                valor = self._acotados.get(clave)
+                if valor is not None:
+                    self._acotados.move_to_end(clave)
+            else:
+                valor = self._valores.get(clave)
+        metricas.incrementar('iguanas_cache_total', 'Consultas a las cachés', cache=clave[0],
+                             resultado='fallo' if valor is None else 'acierto')
+        return valor
+
+    def guardar(self, clave, version, valor, acotado=False):
+        with self._lock:
+            if version != self._version:
+                self._version = version
+                self._valores = {}
+                self._acotados = OrderedDict()
+            if not acotado:
+                self._valores[clave] = valor
+                return
+            self._acotados[clave] = valor
+            self._acotados.move_to_end(clave)
+            while len(self._acotados) > self._limite_acotados:
+                descartada, _ = self._acotados.popitem(last=False)
+                metricas.incrementar('iguanas_cache_descartes_total', 'Entradas descartadas por la LRU de filtros',
+                                     cache=descartada[0])
+
+    def obtener(self, clave, version, constructor, acotado=False):
+        valor = self.consultar(clave, version, acotado)
+        if valor is not None:
+            return valor
+
+        # Se construye fuera del lock para no serializar cálculos independientes
+        valor = constructor()
+        if valor is None:
+            # Los fallos no se memoizan: se reintentan en la siguiente petición
+            return None
+
+        self.guardar(clave, version, valor, acotado)
+        return valor
+
+_derivados = CacheDerivados()
+
+# Resumen tipado de los KPIs del dashboard
+@dataclass(frozen=True)
+class ResumenKPIs:
+    total_iguanas: int
+    total_adultos: int
+    total_subadultos: int
+    total_juveniles: int
+    machos: int
+    hembras: int
+    peso_promedio: float
+    peso_max: float
+    peso_min: float
+    # Conteos Edad x Sexo: {edad: {sexo: cantidad}}
+    conteos_edad_sexo: dict = field(default_factory=dict)
+
+    def _porcentaje(self, cantidad, decimales=1):
+        return round((cantidad / self.total_iguanas * 100), decimales) if self.total_iguanas > 0 else 0
+
+    @property
+    def porcentaje_adultos(self):
+        return self._porcentaje(self.total_adultos)
+
+    @property
+    def porcentaje_subadultos(self):
+        return self._porcentaje(self.total_subadultos)
+
+    @property
+    def porcentaje_juveniles(self):
+        return self._porcentaje(self.total_juveniles)
+
+    @property
+    def porcentaje_machos(self):
+        return self._porcentaje(self.machos)
+
+    @property
+    def porcentaje_hembras(self):
+        return self._porcentaje(self.hembras)
+
+    @property
+    def proporcion_machos(self):
+        return self._porcentaje(self.machos, 2)
+
+    @property
+    def proporcion_hembras(self):
+        return self._porcentaje(self.hembras, 2)
+
+    @property
+    def ratio_mh(self):
+        return round(self.machos / self.hembras, 2) if self.hembras > 0 else 0
+
+    # Variables para dashboard.html
+    def a_plantilla(self):
+        return {
+            'total_iguanas': self.total_iguanas,
+            'total_adultos': self.total_adultos,
+            'total_subadultos': self.total_subadultos,
+            'total_juveniles': self.total_juveniles,
+            'porcentaje_adultos': self.porcentaje_adultos,
+            'porcentaje_subadultos': self.porcentaje_subadultos,
+            'porcentaje_juveniles': self.porcentaje_juveniles,
+            'machos': self.machos,
+            'hembras': self.hembras,
+            'porcentaje_machos': self.porcentaje_machos,
+            'porcentaje_hembras': self.porcentaje_hembras,
+            'proporcion_machos': self.proporcion_machos,
+            'peso_promedio': self.peso_promedio,
+            'peso_max': self.peso_max,
+            'peso_min': self.peso_min,
+            'ratio_mh': self.ratio_mh
+        }
+
+    # Respuesta de /api/kpis
+    def a_api(self):
+        return {
+            'total_iguanas': self.total_iguanas,
+            'total_adultos': self.total_adultos,
+            'total_subadultos': self.total_subadultos,
+            'total_juveniles': self.total_juveniles,
+            'machos': self.machos,
+            'hembras': self.hembras,
+            'proporcion_machos': self.proporcion_machos,
+            'proporcion_hembras': self.proporcion_hembras,
+            # Sin pesos (p. ej. un filtro sin resultados) no hay NaN en el JSON
+            'peso_promedio': None if math.isnan(self.peso_promedio) else self.peso_promedio,
+            'peso_max': None if math.isnan(self.peso_max) else self.peso_max,
+            'peso_min': None if math.isnan(self.peso_min) else self.peso_min
+        }
+
+# ResumenKPIs a partir de conteos {(edad, sexo): n} (nulos como None) y de
+# los estadísticos del peso sin redondear
+def resumen_kpis(total, conteos, peso_promedio, peso_max, peso_min):
+    por_edad, por_sexo, conteos_edad_sexo = {}, {}, {}
+    for (edad, sexo), n in conteos.items():
+        por_edad[edad] = por_edad.get(edad, 0) + n
+        por_sexo[sexo] = por_sexo.get(sexo, 0) + n
+        if isinstance(edad, str) and n:
+            conteos_edad_sexo.setdefault(edad, {})[sexo] = n
+    return ResumenKPIs(
+        total_iguanas=total,
+        total_adultos=por_edad.get('Adulto', 0),
+        total_subadultos=por_edad.get('Subadulto', 0),
+        total_juveniles=por_edad.get('Juvenil', 0),
+        machos=por_sexo.get('Macho', 0),
+        hembras=por_sexo.get('Hembra', 0),
+        peso_promedio=round(float(peso_promedio), 2),
+        peso_max=round(float(peso_max), 2),
+        peso_min=round(float(peso_min), 2),
+        conteos_edad_sexo=conteos_edad_sexo
+    )
+
+# Calcular todos los KPIs en una sola pasada: una tabla cruzada Edad x Sexo
+# (incluyendo nulos, para que los totales por sexo no dependan de la edad)
+# y min/max/media del peso
+def calcular_kpis(df):
+    conteos = df.groupby(['Edad', 'Sexo'], dropna=False, sort=False, observed=True).size()
+    tabla = conteos.unstack(fill_value=0)
+    por_edad = tabla.sum(axis=1)
+    por_sexo = tabla.sum(axis=0)
+    pesos = pd.Series(valores_float64(df['Peso_Kg'])).agg(['min', 'max', 'mean'])
+
+    conteos_edad_sexo = {
+        edad: {sexo: int(n) for sexo, n in fila.items() if n}
+        for edad, fila in tabla.iterrows()
+        if isinstance(edad, str)
+    }
+
+    return ResumenKPIs(
+        total_iguanas=len(df),
+        total_adultos=int(por_edad.get('Adulto', 0)),
+        total_subadultos=int(por_edad.get('Subadulto', 0)),
+        total_juveniles=int(por_edad.get('Juvenil', 0)),
+        machos=int(por_sexo.get('Macho', 0)),
+        hembras=int(por_sexo.get('Hembra', 0)),
+        peso_promedio=round(float(pesos['mean']), 2),
+        peso_max=round(float(pesos['max']), 2),
+        peso_min=round(float(pesos['min']), 2),
+        conteos_edad_sexo=conteos_edad_sexo
+    )
+
+# KPIs memoizados por versión del dataset
+def obtener_kpis(df, version):
+    def construir():
+        with medir('kpis'):
+            kpis = _cache_datos.kpis_incrementales(version)
+            return kpis if kpis is not None else calcular_kpis(df)
+    return _derivados.obtener(('kpis',), version, construir)
 
 # Función para generar gráfico de composición por edad
 def generar_grafico_composicion(df):
     try:
-        print("=== GENERANDO GRÁFICO COMPOSICIÓN ===")
+        # Las categorías sin individuos (p. ej. en un subconjunto filtrado) no se muestran
         composicion = df['Edad'].value_counts()
-        print(f"Composición: {composicion.to_dict()}")
-        
+        composicion = composicion[composicion > 0]
         total = composicion.sum()
-        print(f"Total: {total}")
+        logger.debug("Composición: %s (total %s)", composicion.to_dict(), total)
         
         # Calcular porcentajes
         porcentajes = (composicion.values / total * 100)
         porcentajes_redondeados = [round(p, 1) for p in porcentajes]
-        print(f"Porcentajes: {porcentajes_redondeados}")
         
         # Crear figura con subplots
         fig = make_subplots(
@@ -130,28 +2063,24 @@ def generar_grafico_composicion(df):
             ]
         )
         
-        return fig.to_json()
+        with medir('serializacion', grafico='composicion'):
+            return fig.to_json()
         
     except Exception as e:
-        print(f"Error generando gráfico de composición: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error generando gráfico de composición: %s", e)
         return None
 
 # Función para generar gráfico de distribución por sexo
 def generar_grafico_sexo(df):
     try:
-        print("=== GENERANDO GRÁFICO SEXO ===")
         distribucion = df['Sexo'].value_counts()
-        print(f"Distribución sexo: {distribucion.to_dict()}")
-        
+        distribucion = distribucion[distribucion > 0]
         total = len(df)
-        print(f"Total para sexo: {total}")
+        logger.debug("Distribución sexo: %s (total %s)", distribucion.to_dict(), total)
         
         # Calcular porcentajes redondeados
         porcentajes = [(count / total * 100) for count in distribucion.values]
         porcentajes_redondeados = [round(p, 1) for p in porcentajes]
-        print(f"Porcentajes sexo: {porcentajes_redondeados}")
         
         fig = go.Figure()
         
@@ -175,35 +2104,33 @@ def generar_grafico_sexo(df):
             height=400
         )
         
-        return fig.to_json()
+        with medir('serializacion', grafico='sexo'):
+            return fig.to_json()
         
     except Exception as e:
-        print(f"Error generando gráfico de sexo: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error generando gráfico de sexo: %s", e)
         return None
 
 # Función para generar gráfico de distribución de pesos
 def generar_grafico_pesos(df):
     try:
-        print("=== GENERANDO GRÁFICO PESOS ===")
-        print(f"Peso mínimo: {df['Peso_Kg'].min()}")
-        print(f"Peso máximo: {df['Peso_Kg'].max()}")
-        print(f"Peso promedio: {df['Peso_Kg'].mean()}")
-        
         fig = go.Figure()
         
-        fig.add_trace(go.Histogram(
-            x=df['Peso_Kg'].tolist(),
-            nbinsx=30,
-            marker_color='#2E8B57',
-            opacity=0.7,
-            name='Distribución de pesos'
-        ))
+        if usar_agregados(df):
+            fig.add_trace(histograma_agregado(df['Peso_Kg'], 30))
+        else:
+            fig.add_trace(go.Histogram(
+                x=valores_float64(df['Peso_Kg']).tolist(),
+                nbinsx=30,
+                marker_color='#2E8B57',
+                opacity=0.7,
+                name='Distribución de pesos'
+            ))
         
         # Añadir líneas para estadísticas
-        peso_promedio = float(df['Peso_Kg'].mean())
-        peso_mediana = float(df['Peso_Kg'].median())
+        pesos = pd.Series(valores_float64(df['Peso_Kg']))
+        peso_promedio = float(pesos.mean())
+        peso_mediana = float(pesos.median())
         
         fig.add_vline(
             x=peso_promedio, 
@@ -230,40 +2157,187 @@ def generar_grafico_pesos(df):
             height=400
         )
         
-        return fig.to_json()
+        with medir('serializacion', grafico='pesos'):
+            return fig.to_json()
         
     except Exception as e:
-        print(f"Error generando gráfico de pesos: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error generando gráfico de pesos: %s", e)
         return None
 
+# Las figuras ligeras aceptan un DataFrame o un ResumenParcial (un
+# subconjunto de libros del catálogo); estas funciones extraen de ambos lo
+# que necesitan
+def conteo_valores(datos, columna):
+    if isinstance(datos, ResumenParcial):
+        return datos.conteo(columna)
+    return datos[columna].value_counts()
+
+def pesos_de(datos):
+    if isinstance(datos, ResumenParcial):
+        return datos.pesos_ordenados()
+    return valores_float64(datos['Peso_Kg'])
+
+def edades_en_orden(datos):
+    if isinstance(datos, ResumenParcial):
+        return datos.edades
+    return datos['Edad'].unique()
+
+def capturas_por_dia(datos):
+    if isinstance(datos, ResumenParcial):
+        return datos.dias, datos.capturas_dia
+    indice = IndiceTemporal(datos)
+    return indice.dias, np.diff(indice.acumulado)
+
+# Decidir si el histograma y el boxplot se envían agregados
+def usar_agregados(df):
+    if GRAFICOS_AGREGADOS == 'auto':
+        return len(df) > UMBRAL_AGREGACION
+    return GRAFICOS_AGREGADOS == '1'
+
+# Histograma calculado con NumPy: una barra por intervalo en vez de un valor por fila
+def histograma_agregado(valores, intervalos):
+    if isinstance(valores, pd.Series):
+        valores = valores_float64(valores)
+    valores = valores[~np.isnan(valores)]
+    conteos, bordes = np.histogram(valores, bins=intervalos)
+    centros = (bordes[:-1] + bordes[1:]) / 2
+    return dict(
+        type='bar',
+        x=centros.round(6).tolist(),
+        y=conteos.tolist(),
+        customdata=np.column_stack([bordes[:-1], bordes[1:]]).round(3).tolist(),
+        hovertemplate='%{customdata[0]} - %{customdata[1]} kg<br>%{y} individuos<extra></extra>',
+        marker=dict(color='#2E8B57'),
+        opacity=0.7,
+        name='Distribución de pesos'
+    )
+
+# Estadísticas de caja (cuartiles, bigotes a 1.5 IQR, media y atípicos) de
+# cada combinación de claves, con un único ordenamiento de todo el dataset
+def estadisticas_caja(df, claves, columna):
+    valores = valores_float64(df[columna])
+    validos = ~np.isnan(valores)
+    # Código combinado de las claves (código de cada columna en base mixta)
+    codigos = np.zeros(len(df), dtype='int64')
+    niveles = []
+    for clave in claves:
+        codigos_clave, unicos = pd.factorize(df[clave])
+        validos &= codigos_clave >= 0
+        codigos = codigos * len(unicos) + codigos_clave
+        niveles.append(list(unicos))
+    codigos, valores = codigos[validos], valores[validos]
+
+    orden = np.lexsort((valores, codigos))
+    ordenados = valores[orden]
+    presentes, inicios, conteos = np.unique(codigos[orden], return_index=True, return_counts=True)
+    sumas = np.add.reduceat(ordenados, inicios) if len(ordenados) else np.zeros(0)
+
+    estadisticas = {}
+    for i, codigo in enumerate(presentes):
+        grupo = []
+        for unicos in reversed(niveles):
+            codigo, resto = divmod(int(codigo), len(unicos))
+            grupo.append(unicos[resto])
+        grupo = tuple(reversed(grupo))
+        estadisticas[grupo] = estadisticas_tramo(ordenados[inicios[i]:inicios[i] + conteos[i]], sumas[i])
+    return estadisticas
+
+# Estadísticas de caja de un tramo de valores ya ordenados
+def estadisticas_tramo(tramo, suma):
+    # Cuartiles con interpolación lineal sobre el tramo ya ordenado
+    q1, mediana, q3 = np.quantile(tramo, [0.25, 0.5, 0.75], method='linear')
+    iqr = q3 - q1
+    desde = np.searchsorted(tramo, q1 - 1.5 * iqr, side='left')
+    hasta = np.searchsorted(tramo, q3 + 1.5 * iqr, side='right')
+    atipicos = np.unique(np.concatenate([tramo[:desde], tramo[hasta:]]))
+    if len(atipicos) > LIMITE_ATIPICOS:
+        atipicos = atipicos[np.linspace(0, len(atipicos) - 1, LIMITE_ATIPICOS).astype(int)]
+    return {
+        'n': len(tramo),
+        'q1': float(q1),
+        'mediana': float(mediana),
+        'q3': float(q3),
+        'bigote_inferior': float(tramo[desde]),
+        'bigote_superior': float(tramo[hasta - 1]),
+        'media': float(suma / len(tramo)),
+        'atipicos': atipicos.tolist(),
+    }
+
+# Cajas precalculadas (y atípicos como puntos) con el mismo orden y leyenda
+# que el boxplot con datos crudos
+def trazas_cajas_agregadas(df, edades_unicas):
+    if isinstance(df, ResumenParcial):
+        estadisticas = {(sexo, edad): estadisticas_tramo(tramo, tramo.sum())
+                        for (edad, sexo), tramo in df.pesos.items()
+                        if edad is not None and sexo is not None and len(tramo)}
+        sexos_unicos = {sexo for (_, sexo), n in df.conteos.items() if sexo is not None and n}
+    else:
+        estadisticas = estadisticas_caja(df, ['Sexo', 'Edad'], 'Peso_Kg')
+        sexos_unicos = set(df['Sexo'].dropna().unique())
+    trazas = []
+    for sexo, color in zip(['Macho', 'Hembra'], ['#2E8B57', '#FF8C00']):
+        if sexo not in sexos_unicos:
+            continue
+        for edad in edades_unicas:
+            caja = estadisticas.get((sexo, edad))
+            if caja is None:
+                continue
+            nombre = f'{sexo} - {edad}'
+            trazas.append(dict(
+                type='box',
+                x=[nombre],
+                q1=[caja['q1']],
+                median=[caja['mediana']],
+                q3=[caja['q3']],
+                lowerfence=[caja['bigote_inferior']],
+                upperfence=[caja['bigote_superior']],
+                mean=[caja['media']],
+                name=nombre,
+                marker=dict(color=color),
+                boxmean=True,
+                showlegend=True if edad == edades_unicas[0] else False,
+                legendgroup=sexo
+            ))
+            if caja['atipicos']:
+                trazas.append(dict(
+                    type='scatter',
+                    x=[nombre] * len(caja['atipicos']),
+                    y=caja['atipicos'],
+                    mode='markers',
+                    marker=dict(color=color, size=4, opacity=0.6),
+                    name=nombre,
+                    showlegend=False,
+                    legendgroup=sexo,
+                    hovertemplate='%{y} kg<extra>%{x}</extra>'
+                ))
+    return trazas
+
 # Función para generar gráfico de boxplot
 def generar_grafico_boxplot(df):
     try:
-        print("=== GENERANDO GRÁFICO BOXPLOT ===")
-        
         fig = go.Figure()
         
         # Verificar valores únicos
         sexos_unicos = df['Sexo'].unique()
         edades_unicas = df['Edad'].unique()
         
-        print(f"Sexos únicos: {sexos_unicos}")
-        print(f"Edades únicas: {edades_unicas}")
+        logger.debug("Sexos únicos: %s, edades únicas: %s", list(sexos_unicos), list(edades_unicas))
+        
+        agregado = usar_agregados(df)
+        if agregado:
+            fig.add_traces(trazas_cajas_agregadas(df, edades_unicas))
         
         # Separar por sexo
         for sexo, color in zip(['Macho', 'Hembra'], ['#2E8B57', '#FF8C00']):
-            if sexo in sexos_unicos:
+            if not agregado and sexo in sexos_unicos:
                 df_sexo = df[df['Sexo'] == sexo]
                 
                 # Para cada categoría de edad
                 for edad in edades_unicas:
                     df_filtrado = df_sexo[df_sexo['Edad'] == edad]
                     if len(df_filtrado) > 0:
-                        print(f"{sexo} - {edad}: {len(df_filtrado)} individuos")
                         fig.add_trace(go.Box(
-                            y=df_filtrado['Peso_Kg'].tolist(),
+                            y=valores_float64(df_filtrado['Peso_Kg']).tolist(),
                             name=f'{sexo} - {edad}',
                             marker_color=color,
                             boxmean=True,
@@ -278,52 +2352,42 @@ def generar_grafico_boxplot(df):
             ),
             yaxis_title='Peso (kg)',
             xaxis_title='Categoría',
-            boxmode='group',
+            # Las cajas agregadas van centradas para alinear sus atípicos
+            boxmode='overlay' if agregado else 'group',
             height=500
         )
         
-        return fig.to_json()
+        with medir('serializacion', grafico='boxplot'):
+            return fig.to_json()
         
     except Exception as e:
-        print(f"Error generando gráfico boxplot: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error generando gráfico boxplot: %s", e)
         return None
 
 
 # Función para generar gráfico de series de tiempo
 def generar_grafico_temporal(df):
     try:
-        print("\n=== GENERANDO GRÁFICO TEMPORAL PARA FLASK ===")
-        
-        # 1. Procesar datos (igual que antes)
-        df_temp = df.copy()
-        df_temp['Fecha_entrga_CAV'] = pd.to_datetime(
-            df_temp['Fecha_entrga_CAV'], 
-            errors='coerce',
-            dayfirst=True
-        )
-        df_temp = df_temp.dropna(subset=['Fecha_entrga_CAV'])
+        # 1. Conteos diarios desde el índice de fechas (ya parseadas al cargar)
+        indice = IndiceTemporal(df)
         
-        if len(df_temp) == 0:
-            print("No hay fechas válidas")
+        if indice.total == 0:
+            logger.warning("Gráfico temporal: no hay fechas válidas")
             return json.dumps({})  # JSON vacío
         
-        # 2. Agrupar por día
-        df_temp['Fecha_Dia'] = df_temp['Fecha_entrga_CAV'].dt.normalize()
-        capturas_por_dia = df_temp.groupby('Fecha_Dia').size().reset_index(name='Numero_Capturas')
-        capturas_por_dia.columns = ['Fecha', 'Numero_Capturas']
-        capturas_por_dia = capturas_por_dia.sort_values('Fecha')
+        # 2. Días con capturas
+        fechas = np.datetime_as_string(indice.dias, unit='D').tolist()
+        capturas = np.diff(indice.acumulado).tolist()
         
-        print("Datos para gráfico temporal:")
-        print(capturas_por_dia.to_string())
+        if logger.isEnabledFor(logging.DEBUG):
+            logger.debug("Gráfico temporal: %d días con capturas (%s a %s)", len(fechas), fechas[0], fechas[-1])
         
         # 3. Crear figura
         fig = go.Figure()
         
         fig.add_trace(go.Scatter(
-            x=capturas_por_dia['Fecha'].dt.strftime('%Y-%m-%d').tolist(),  # Convertir a string
-            y=capturas_por_dia['Numero_Capturas'].tolist(),
+            x=fechas,  # Fechas como texto
+            y=capturas,
             mode='lines+markers',
             name='Capturas de Iguanas',
             line=dict(color='#2E8B57', width=3),
@@ -364,110 +2428,1198 @@ def generar_grafico_temporal(df):
         )
         
         # 5. Convertir a JSON
-        graph_json = fig.to_json()
-        print("✓ Gráfico temporal convertido a JSON exitosamente")
-        return graph_json
+        with medir('serializacion', grafico='temporal'):
+            return fig.to_json()
         
     except Exception as e:
-        print(f"Error generando gráfico temporal: {e}")
-        import traceback
-        traceback.print_exc()
+        logger.exception("Error generando gráfico temporal: %s", e)
         return json.dumps({})
 
     
 
+# Figuras ligeras: el mismo JSON que producen los generar_grafico_* (el que
+# recibe Plotly.newPlot), construido como diccionarios a partir de arrays de
+# NumPy, sin los objetos de plotly ni su validación de propiedades. La
+# paridad con las figuras de plotly se comprueba con `benchmark.py --paridad`.
+
+# Plantilla de plotly tal como la incluye fig.to_json() (se calcula una vez)
+_plantillas_plotly = {}
+
+def plantilla_plotly(nombre=None):
+    nombre = nombre or pio.templates.default
+    plantilla = _plantillas_plotly.get(nombre)
+    if plantilla is None:
+        plantilla = _plantillas_plotly[nombre] = pio.templates[nombre].to_plotly_json()
+    return plantilla
+
+def _json_numpy(valor):
+    if isinstance(valor, np.ndarray):
+        if valor.dtype.kind == 'f' and np.isnan(valor).any():
+            return np.where(np.isnan(valor), None, valor).tolist()
+        return valor.tolist()
+    if isinstance(valor, np.generic):
+        return valor.item()
+    raise TypeError(f'No serializable: {type(valor).__name__}')
+
+# Serializar una figura ligera; orjson escribe los arrays de NumPy directamente
+def serializar_figura(figura):
+    if orjson is not None:
+        return orjson.dumps(figura, option=orjson.OPT_SERIALIZE_NUMPY).decode('utf-8')
+    return json.dumps(figura, default=_json_numpy, ensure_ascii=False, separators=(',', ':'))
+
+# Línea vertical con su anotación, como fig.add_vline(annotation_text=...)
+def linea_vertical(x, color, texto):
+    forma = dict(type='line', x0=x, x1=x, xref='x', y0=0, y1=1, yref='y domain',
+                 line=dict(color=color, dash='dash'))
+    anotacion = dict(showarrow=False, text=texto, x=x, xanchor='left', xref='x',
+                     y=1, yanchor='top', yref='y domain')
+    return forma, anotacion
+
+def figura_composicion(df):
+    composicion = conteo_valores(df, 'Edad')
+    composicion = composicion[composicion > 0]
+    cantidades = composicion.to_numpy()
+    total = cantidades.sum()
+    etiquetas = composicion.index.tolist()
+    porcentajes_redondeados = [round(p, 1) for p in cantidades / total * 100]
+    return {
+        'data': [
+            # Dominios de make_subplots(cols=2, column_widths=[0.6, 0.4])
+            dict(type='pie', domain=dict(x=[0.0, 0.54], y=[0.0, 1.0]), hole=0.4,
+                 hoverinfo='label+value+percent', labels=etiquetas,
+                 marker=dict(colors=PALETA_ECOLOGICA[:len(etiquetas)]),
+                 textinfo='label+percent', textposition='outside', values=cantidades),
+            dict(type='table', domain=dict(x=[0.64, 1.0], y=[0.0, 1.0]),
+                 header=dict(values=['Categoría', 'Cantidad', 'Porcentaje (%)'], fill=dict(color='#2E8B57'),
+                             font=dict(color='white', size=12), align='center'),
+                 cells=dict(values=[etiquetas, cantidades, [f'{p}%' for p in porcentajes_redondeados]],
+                            fill=dict(color='white'), align='center', font=dict(color='black', size=11))),
+        ],
+        'layout': {
+            'template': plantilla_plotly(),
+            'title': dict(text='COMPOSICIÓN POR EDAD<br>Los adultos dominan la población',
+                          font=dict(size=16, weight='bold'), x=0.5),
+            'showlegend': True,
+            'height': 500,
+            'annotations': [dict(text=f'TOTAL<br>{total}<br>INDIVIDUOS', x=0.12, y=0.5,
+                                 font=dict(size=16, weight='bold', style='italic'), showarrow=False)],
+        },
+    }
+
+def figura_sexo(df):
+    distribucion = conteo_valores(df, 'Sexo')
+    distribucion = distribucion[distribucion > 0]
+    cantidades = distribucion.to_numpy()
+    porcentajes_redondeados = [round(p, 1) for p in cantidades / len(df) * 100]
+    return {
+        'data': [dict(
+            type='bar', x=distribucion.index.tolist(), y=cantidades,
+            marker=dict(color=['#2E8B57', '#FF8C00']),
+            text=[f'{n} ({p}%)' for n, p in zip(cantidades, porcentajes_redondeados)],
+            textposition='auto', hoverinfo='x+y'
+        )],
+        'layout': {
+            'template': plantilla_plotly(),
+            'title': dict(text='DISTRIBUCIÓN POR SEXO<br>Predominio de machos', font=dict(size=16, weight='bold')),
+            'xaxis': dict(title=dict(text='Sexo')),
+            'yaxis': dict(title=dict(text='Cantidad de individuos')),
+            'showlegend': False,
+            'height': 400,
+        },
+    }
+
+def figura_pesos(df):
+    pesos = pesos_de(df)
+    if usar_agregados(df):
+        traza = histograma_agregado(pesos, 30)
+    else:
+        traza = dict(type='histogram', x=pesos, nbinsx=30, marker=dict(color='#2E8B57'),
+                     opacity=0.7, name='Distribución de pesos')
+    serie = pd.Series(pesos)
+    peso_promedio = float(serie.mean())
+    peso_mediana = float(serie.median())
+    promedio = linea_vertical(peso_promedio, 'red', f"Promedio: {peso_promedio:.2f} kg")
+    mediana = linea_vertical(peso_mediana, 'blue', f"Mediana: {peso_mediana:.2f} kg")
+    return {
+        'data': [traza],
+        'layout': {
+            'template': plantilla_plotly(),
+            'shapes': [promedio[0], mediana[0]],
+            'annotations': [promedio[1], mediana[1]],
+            'title': dict(text='DISTRIBUCIÓN DE PESOS<br>Alta variabilidad (0.235 - 6.5 kg)',
+                          font=dict(size=16, weight='bold')),
+            'xaxis': dict(title=dict(text='Peso (kg)')),
+            'yaxis': dict(title=dict(text='Frecuencia')),
+            'bargap': 0.1,
+            'height': 400,
+        },
+    }
+
+def figura_boxplot(df):
+    edades_unicas = edades_en_orden(df)
+    agregado = usar_agregados(df)
+    if agregado:
+        trazas = trazas_cajas_agregadas(df, edades_unicas)
+    else:
+        if isinstance(df, ResumenParcial):
+            grupos = {(sexo, edad): tramo for (edad, sexo), tramo in df.pesos.items()}
+        else:
+            # Posiciones de cada grupo en el orden de las filas, de una sola pasada
+            pesos = valores_float64(df['Peso_Kg'])
+            grupos = {clave: pesos[posiciones] for clave, posiciones
+                      in df.groupby(['Sexo', 'Edad'], sort=False, observed=True).indices.items()}
+        trazas = []
+        for sexo, color in zip(['Macho', 'Hembra'], ['#2E8B57', '#FF8C00']):
+            for edad in edades_unicas:
+                valores = grupos.get((sexo, edad))
+                if valores is None or len(valores) == 0:
+                    continue
+                trazas.append(dict(
+                    type='box', y=valores, name=f'{sexo} - {edad}',
+                    marker=dict(color=color), boxmean=True,
+                    showlegend=True if edad == edades_unicas[0] else False, legendgroup=sexo
+                ))
+    return {
+        'data': trazas,
+        'layout': {
+            'template': plantilla_plotly(),
+            'title': dict(text='PESO POR EDAD Y SEXO<br>Análisis de dimorfismo sexual',
+                          font=dict(size=16, weight='bold')),
+            'yaxis': dict(title=dict(text='Peso (kg)')),
+            'xaxis': dict(title=dict(text='Categoría')),
+            'boxmode': 'overlay' if agregado else 'group',
+            'height': 500,
+        },
+    }
+
+def figura_temporal(df):
+    dias, capturas = capturas_por_dia(df)
+    if not len(dias):
+        logger.warning("Gráfico temporal: no hay fechas válidas")
+        return {}
+    return {
+        'data': [dict(
+            type='scatter', x=np.datetime_as_string(dias, unit='D').tolist(),
+            y=capturas, mode='lines+markers', name='Capturas de Iguanas',
+            line=dict(color='#2E8B57', width=3), marker=dict(size=8, color='#3CB371'),
+            hovertemplate='<b>Fecha:</b> %{x}<br><b>Capturas:</b> %{y}<br><extra></extra>'
+        )],
+        'layout': {
+            'template': plantilla_plotly('plotly_white'),
+            'title': dict(text='Tendencia de Capturas Diarias de Iguanas', font=dict(size=18, family='Arial'), x=0.5),
+            'xaxis': dict(title=dict(text='Fecha de Captura'), tickformat='%d/%m/%Y', tickangle=45,
+                          type='category', showgrid=True, gridcolor='lightgray'),
+            'yaxis': dict(title=dict(text='Número de Capturas'), rangemode='tozero', showgrid=True,
+                          gridcolor='lightgray'),
+            'margin': dict(l=60, r=30, t=80, b=100),
+            'height': 500,
+            'hovermode': 'x unified',
+            'showlegend': False,
+        },
+    }
+
+# Generador (df -> JSON) a partir de una figura ligera, con el mismo manejo
+# de errores que su equivalente generar_grafico_*
+def generador_ligero(nombre, constructor, si_falla=None):
+    def generar(df):
+        try:
+            figura = constructor(df)
+            with medir('serializacion', grafico=nombre):
+                return serializar_figura(figura)
+        except Exception as e:
+            logger.exception("Error generando gráfico %s: %s", nombre, e)
+            return si_falla
+    return generar
+
+# Registro de gráficos disponibles: nombre -> generador. Por defecto se usan
+# las figuras ligeras; FIGURAS_LIGERAS=0 vuelve a los objetos de plotly.
+GRAFICOS_PLOTLY = {
+    'composicion': generar_grafico_composicion,
+    'sexo': generar_grafico_sexo,
+    'pesos': generar_grafico_pesos,
+    'boxplot': generar_grafico_boxplot,
+    'temporal': generar_grafico_temporal
+}
+
+GRAFICOS_LIGEROS = {
+    'composicion': generador_ligero('composicion', figura_composicion),
+    'sexo': generador_ligero('sexo', figura_sexo),
+    'pesos': generador_ligero('pesos', figura_pesos),
+    'boxplot': generador_ligero('boxplot', figura_boxplot),
+    'temporal': generador_ligero('temporal', figura_temporal, si_falla=json.dumps({}))
+}
+
+GRAFICOS = GRAFICOS_LIGEROS if FIGURAS_LIGERAS else GRAFICOS_PLOTLY
+
+# Figura serializada junto con su ETag (huella del JSON)
+@dataclass(frozen=True)
+class FiguraCacheada:
+    json: str
+    etag: str
+
+def _figura_cacheada(figura_json):
+    if figura_json is None:
+        return None
+    etag = hashlib.sha1(figura_json.encode('utf-8')).hexdigest()[:20]
+    return FiguraCacheada(figura_json, etag)
+
+# Construir una figura midiendo su duración (incluye la serialización)
+def construir_figura(nombre, df):
+    with medir('grafico', grafico=nombre):
+        return GRAFICOS[nombre](df)
+
+# Figura memoizada por (nombre, versión del dataset, filtros). `df` puede ser
+# una función sin argumentos que devuelva el DataFrame (p. ej. el subconjunto
+# filtrado), para construirlo solo si la figura no está en caché.
+def obtener_figura(nombre, df, version, filtros=()):
+    filtros = tuple(filtros)
+    return _derivados.obtener(('grafico', nombre, filtros), version,
+                              lambda: _figura_cacheada(construir_figura(nombre, df() if callable(df) else df)),
+                              acotado=bool(filtros))
+
+# Pool compartido para generar gráficos en paralelo (se crea al primer uso)
+_ejecutor_graficos = None
+_ejecutor_lock = threading.Lock()
+
+def ejecutor_graficos():
+    global _ejecutor_graficos
+    if _ejecutor_graficos is None:
+        with _ejecutor_lock:
+            if _ejecutor_graficos is None:
+                if GRAFICOS_EJECUTOR == 'procesos':
+                    # 'spawn' evita heredar locks de hilos del proceso padre
+                    _ejecutor_graficos = ProcessPoolExecutor(
+                        max_workers=GRAFICOS_WORKERS,
+                        mp_context=multiprocessing.get_context('spawn')
+                    )
+                else:
+                    _ejecutor_graficos = ThreadPoolExecutor(
+                        max_workers=GRAFICOS_WORKERS,
+                        thread_name_prefix='graficos'
+                    )
+    return _ejecutor_graficos
+
+# Dataset de solo lectura dentro de los procesos del pool: se abre el mismo
+# snapshot mapeado en memoria que usa el proceso web (sin copiar ni parsear)
+_snapshots_proceso = {}
+
+def _generar_en_proceso(nombre, version, df=None):
+    if df is None:
+        df = _snapshots_proceso.get(version)
+        if df is None:
+            df = abrir_snapshot(version)
+            if df is None:
+                return None
+            _snapshots_proceso.clear()
+            _snapshots_proceso[version] = df
+    return GRAFICOS[nombre](df)
+
+# Generar varias figuras a la vez. Las que ya están en caché se devuelven
+# directamente; el resto se construye en el pool con un límite de tiempo
+# común. Una figura que falla o no termina a tiempo queda en None (la
+# página la pedirá después a la API) y, si termina más tarde, se guarda en
+# la caché igualmente. `df` admite lo mismo que en obtener_figura.
+def obtener_figuras(nombres, df, version, filtros=(), timeout=None):
+    filtros = tuple(filtros)
+    timeout = GRAFICOS_TIMEOUT if timeout is None else timeout
+    figuras = {}
+    pendientes = {}
+
+    for nombre in nombres:
+        figura = _derivados.consultar(('grafico', nombre, filtros), version, acotado=bool(filtros))
+        if figura is not None:
+            figuras[nombre] = figura
+            continue
+        if callable(df):
+            df = df()
+        if GRAFICOS_EJECUTOR == 'secuencial':
+            figuras[nombre] = obtener_figura(nombre, df, version, filtros)
+        elif GRAFICOS_EJECUTOR == 'procesos':
+            # Sin snapshot en disco hay que enviar el DataFrame al proceso
+            df_envio = None if (SNAPSHOTS_ACTIVOS and not filtros and version_con_snapshot(version)) else df
+            pendientes[nombre] = ejecutor_graficos().submit(_generar_en_proceso, nombre, version, df_envio)
+        else:
+            pendientes[nombre] = ejecutor_graficos().submit(construir_figura, nombre, df)
+
+    def guardar_al_terminar(nombre):
+        def callback(futuro):
+            if futuro.cancelled() or futuro.exception() is not None:
+                return
+            figura = _figura_cacheada(futuro.result())
+            if figura is not None:
+                _derivados.guardar(('grafico', nombre, filtros), version, figura, acotado=bool(filtros))
+        return callback
+
+    limite = time.monotonic() + timeout
+    for nombre, futuro in pendientes.items():
+        futuro.add_done_callback(guardar_al_terminar(nombre))
+        try:
+            figuras[nombre] = _figura_cacheada(futuro.result(timeout=max(0, limite - time.monotonic())))
+        except TimeoutFuturo:
+            logger.warning("Gráfico %s: tiempo de espera agotado (%ss)", nombre, timeout)
+            metricas.incrementar('iguanas_graficos_timeout_total', 'Gráficos que no terminaron a tiempo', grafico=nombre)
+            figuras[nombre] = None
+        except Exception as e:
+            logger.error("Error generando gráfico %s: %s", nombre, e)
+            figuras[nombre] = None
+
+    return figuras
+
+# JSON de las figuras para la plantilla (None si fallaron o si se cargarán en diferido)
+def obtener_graficos(nombres, df, version, filtros=()):
+    if not GRAFICOS_EN_LINEA:
+        return {nombre: None for nombre in nombres}
+    figuras = obtener_figuras(nombres, df, version, filtros)
+    return {nombre: (figura.json if figura else None) for nombre, figura in figuras.items()}
+
+# Incrustar una figura JSON como literal JavaScript dentro de <script>
+@app.template_filter('figura_js')
+def figura_js(figura_json):
+    if not figura_json:
+        return Markup('null')
+    return Markup(figura_json.replace('</', '<\\/'))
+
+# Consulta de la tabla de datos (paginación, orden, filtros y búsqueda)
+@dataclass(frozen=True)
+class ConsultaTabla:
+    inicio: int = 0
+    limite: int = 25
+    # ((columna, descendente), ...) en orden de prioridad
+    orden: tuple = ()
+    # ((columna, valor), ...): coincidencia sin distinguir mayúsculas
+    filtros: tuple = ()
+    busqueda: str = ''
+    draw: int = None
+
+LIMITE_TABLA_DEFECTO = 25
+LIMITE_TABLA_MAXIMO = 1000
+
+_PARAM_DATATABLES = re.compile(r'^(columns|order)\[(\d+)\]\[(\w+)\](?:\[(\w+)\])?$')
+
+# Interpretar los parámetros de la petición. Acepta el protocolo server-side
+# de DataTables (draw/start/length/order[i][..]/columns[i][..]/search[value])
+# y una forma abreviada: offset, limit, orden=Peso_Kg,-Edad, buscar=texto y
+# un parámetro por columna para filtrar (?Sexo=Macho).
+def parsear_consulta_tabla(args, columnas):
+    columnas_dt = {}
+    orden_dt = {}
+    for clave, valor in args.items():
+        m = _PARAM_DATATABLES.match(clave)
+        if not m:
+            continue
+        grupo, indice, campo, subcampo = m.group(1), int(m.group(2)), m.group(3), m.group(4)
+        destino = columnas_dt if grupo == 'columns' else orden_dt
+        destino.setdefault(indice, {})[f'{campo}.{subcampo}' if subcampo else campo] = valor
+
+    def nombre_columna(indice):
+        nombre = columnas_dt.get(indice, {}).get('data')
+        if nombre in columnas:
+            return nombre
+        return columnas[indice] if 0 <= indice < len(columnas) else None
+
+    orden = []
+    for i in sorted(orden_dt):
+        try:
+            columna = nombre_columna(int(orden_dt[i].get('column', -1)))
+        except ValueError:
+            continue
+        if columna:
+            orden.append((columna, orden_dt[i].get('dir') == 'desc'))
+    for parte in args.get('orden', '').split(','):
+        parte = parte.strip()
+        columna = parte.lstrip('-')
+        if columna in columnas:
+            orden.append((columna, parte.startswith('-')))
+
+    filtros = []
+    for i, info in sorted(columnas_dt.items()):
+        valor = (info.get('search.value') or '').strip()
+        columna = nombre_columna(i)
+        if valor and columna:
+            filtros.append((columna, valor))
+    for columna in columnas:
+        valor = (args.get(columna) or '').strip()
+        if valor:
+            filtros.append((columna, valor))
+
+    def entero(*nombres, defecto):
+        for nombre in nombres:
+            try:
+                return int(args[nombre])
+            except (KeyError, ValueError):
+                continue
+        return defecto
+
+    limite = entero('length', 'limit', defecto=LIMITE_TABLA_DEFECTO)
+    # length=-1 (DataTables: "todos") queda acotado al máximo permitido
+    if limite < 0 or limite > LIMITE_TABLA_MAXIMO:
+        limite = LIMITE_TABLA_MAXIMO
+
+    return ConsultaTabla(
+        inicio=max(0, entero('start', 'offset', defecto=0)),
+        limite=limite,
+        orden=tuple(orden),
+        filtros=tuple(filtros),
+        busqueda=(args.get('search[value]') or args.get('buscar') or '').strip().lower(),
+        draw=entero('draw', defecto=None)
+    )
+
+# Texto de valores tal como se muestran en la tabla
+def textos_valores(valores, columna):
+    if pd.api.types.is_datetime64_any_dtype(valores):
+        return pd.Index(valores).strftime('%d/%m/%Y').to_numpy(dtype=object)
+    if columna == 'Peso_Kg':
+        return np.array([f'{v:.3f}' for v in valores], dtype=object)
+    return np.array([str(v) for v in valores], dtype=object)
+
+# Índices de la tabla precomputados por versión. Cada columna se factoriza
+# una sola vez (sort=True): los códigos son un rango denso para ordenar con
+# np.lexsort sin comparar valores, y los filtros y la búsqueda se evalúan
+# sobre los valores únicos y se proyectan a las filas a través de los códigos.
+class IndiceTabla:
+    def __init__(self, df):
+        self.df = df
+        self.columnas = list(df.columns)
+        self._lock = threading.Lock()
+        self._factores = {}
+        self._ordenes = {}
+
+    # (códigos por fila, texto en minúsculas de cada valor único)
+    def factores(self, columna):
+        with self._lock:
+            factores = self._factores.get(columna)
+        if factores is None:
+            codigos, unicos = pd.factorize(self.df[columna], sort=True)
+            # Los nulos (-1) pasan al final del rango y se muestran vacíos
+            codigos = np.where(codigos < 0, len(unicos), codigos).astype(np.int32)
+            textos = np.append(textos_valores(unicos, columna), '')
+            textos = pd.Series(textos, dtype=object).str.lower().to_numpy(dtype=object)
+            factores = (codigos, textos)
+            with self._lock:
+                self._factores[columna] = factores
+        return factores
+
+    def orden(self, criterios):
+        criterios = tuple(criterios)
+        with self._lock:
+            orden = self._ordenes.get(criterios)
+        if orden is not None:
+            return orden
+
+        if not criterios:
+            orden = np.arange(len(self.df))
+        else:
+            claves = []
+            # lexsort usa la última clave como principal
+            for columna, descendente in reversed(criterios):
+                rango = self.factores(columna)[0]
+                claves.append(rango.max() - rango if descendente else rango)
+            orden = np.lexsort(claves)
+
+        with self._lock:
+            # Se conservan los órdenes simples y un número acotado de combinados
+            if len(criterios) <= 1 or len(self._ordenes) < 64:
+                self._ordenes[criterios] = orden
+        return orden
+
+    # Filas cuya columna coincide con el valor: exacta si el valor es una
+    # categoría existente, si no por subcadena
+    def coincidencias(self, columna, valor, exacta=True):
+        codigos, textos = self.factores(columna)
+        coincide = textos == valor if exacta else np.zeros(len(textos), dtype=bool)
+        if not coincide.any():
+            coincide = pd.Series(textos, dtype=object).str.contains(valor, regex=False).to_numpy(dtype=bool)
+        return coincide[codigos]
+
+    # Máscara booleana de filas que cumplen filtros y búsqueda (None = todas)
+    def mascara(self, filtros, busqueda):
+        mascara = None
+        for columna, valor in filtros:
+            coincide = self.coincidencias(columna, valor.lower())
+            mascara = coincide if mascara is None else (mascara & coincide)
+        if busqueda:
+            coincide = np.zeros(len(self.df), dtype=bool)
+            for columna in self.columnas:
+                coincide |= self.coincidencias(columna, busqueda, exacta=False)
+            mascara = coincide if mascara is None else (mascara & coincide)
+        return mascara
+
+    # Posiciones de las filas filtradas y ordenadas
+    def resolver(self, consulta):
+        orden = self.orden(consulta.orden)
+        mascara = self.mascara(consulta.filtros, consulta.busqueda)
+        if mascara is not None:
+            orden = orden[mascara[orden]]
+        return orden
+
+    # Registros de una página listos para JSON
+    def registros(self, posiciones):
+        pagina = self.df.iloc[posiciones]
+        datos = {}
+        for columna in self.columnas:
+            serie = pagina[columna]
+            if pd.api.types.is_datetime64_any_dtype(serie):
+                serie = serie.dt.strftime('%d/%m/%Y')
+            elif serie.dtype == np.float32:
+                serie = pd.Series(valores_float64(serie))
+            datos[columna] = serie.astype(object).where(serie.notna(), None).tolist()
+        return [dict(zip(self.columnas, fila)) for fila in zip(*datos.values())]
+
+def obtener_indice_tabla(df, version):
+    return _derivados.obtener(('indice_tabla',), version, lambda: IndiceTabla(df))
+
+# Serie temporal de capturas: días con capturas ordenados y sumas
+# acumuladas, de modo que el conteo de cualquier rango es una diferencia
+# entre dos posiciones halladas por búsqueda binaria. Los desgloses por
+# columna (Sexo, Edad) se calculan al primer uso.
+FRECUENCIAS_TEMPORALES = ('D', 'W', 'M')
+COLUMNAS_DESGLOSE_TEMPORAL = ('Sexo', 'Edad')
+MAXIMO_PERIODOS_TEMPORAL = 20000
+
+class IndiceTemporal:
+    def __init__(self, df, columna='Fecha_entrga_CAV'):
+        self.df = df
+        fechas = df[columna].to_numpy(dtype='datetime64[ns]') if columna in df.columns \
+            else np.array([], dtype='datetime64[ns]')
+        validas = ~np.isnat(fechas)
+        self._validas = validas
+        dias_fila = fechas[validas].astype('datetime64[D]')
+        self.dias, self._dia_fila = np.unique(dias_fila, return_inverse=True)
+        self.acumulado = np.concatenate([[0], np.cumsum(np.bincount(self._dia_fila, minlength=len(self.dias)))])
+        self.total = int(self.acumulado[-1])
+        self._desgloses = {}
+        self._lock = threading.Lock()
+
+    # Sumas acumuladas por día y categoría de una columna
+    def desglose(self, columna):
+        with self._lock:
+            if columna not in self._desgloses:
+                serie = self.df[columna]
+                if isinstance(serie.dtype, pd.CategoricalDtype):
+                    # Códigos de la categoría, sin pasar por los textos
+                    codigos = serie.cat.codes.to_numpy()[self._validas]
+                    categorias = [str(c) for c in serie.cat.categories]
+                else:
+                    codigos, categorias = pd.factorize(serie.to_numpy()[self._validas], sort=True)
+                    categorias = [str(c) for c in categorias]
+                if (codigos < 0).any():
+                    codigos = np.where(codigos < 0, len(categorias), codigos)
+                    categorias.append('Sin dato')
+                conteos = np.bincount(self._dia_fila * len(categorias) + codigos,
+                                      minlength=len(self.dias) * len(categorias))
+                acumulado = np.vstack([np.zeros(len(categorias), dtype='int64'),
+                                       np.cumsum(conteos.reshape(len(self.dias), len(categorias)), axis=0)])
+                self._desgloses[columna] = (categorias, acumulado)
+            return self._desgloses[columna]
+
+    # Inicio de cada periodo (semanas desde el lunes, meses desde el día 1)
+    @staticmethod
+    def inicios_periodo(desde, hasta, freq):
+        if freq == 'M':
+            return np.arange(desde.astype('datetime64[M]'), hasta.astype('datetime64[M]') + 1).astype('datetime64[D]')
+        if freq == 'W':
+            # El 1970-01-01 fue jueves: desplazar 3 días para que la semana empiece en lunes
+            lunes = desde - (desde.astype('int64') + 3) % 7
+            return np.arange(lunes, hasta + 1, 7)
+        return np.arange(desde, hasta + 1)
+
+    # Capturas por periodo entre desde y hasta (ambos incluidos). Un extremo
+    # que falta toma el primer o último día con capturas, sin cruzarse con
+    # el otro: ?desde= posterior a los datos da una serie con ceros
+    def serie(self, desde=None, hasta=None, freq='D', por=None):
+        if desde is None:
+            desde = self.dias[0] if hasta is None else min(self.dias[0], hasta)
+        if hasta is None:
+            hasta = max(self.dias[-1], desde)
+        # Solo puede ocurrir si se pidieron ambos extremos
+        if desde > hasta:
+            raise ValueError("'desde' es posterior a 'hasta'")
+        inicios = self.inicios_periodo(desde, hasta, freq)
+        if len(inicios) > MAXIMO_PERIODOS_TEMPORAL:
+            raise ValueError(f'El rango pide {len(inicios)} periodos (máximo {MAXIMO_PERIODOS_TEMPORAL})')
+        # Límites de cada periodo recortados al rango pedido
+        limites = np.concatenate([[desde], inicios[1:], [hasta + 1]])
+        posiciones = np.searchsorted(self.dias, limites, side='left')
+
+        resultado = {
+            'desde': str(desde),
+            'hasta': str(hasta),
+            'freq': freq,
+            'periodos': np.datetime_as_string(inicios, unit='D').tolist(),
+            'capturas': np.diff(self.acumulado[posiciones]).tolist(),
+        }
+        resultado['total'] = int(sum(resultado['capturas']))
+        if por:
+            categorias, acumulado = self.desglose(por)
+            conteos = np.diff(acumulado[posiciones], axis=0)
+            resultado['por'] = por
+            resultado['series'] = {c: conteos[:, i].tolist() for i, c in enumerate(categorias)}
+        return resultado
+
+def obtener_indice_temporal(df, version):
+    return _derivados.obtener(('indice_temporal',), version, lambda: IndiceTemporal(df))
+
+# Leer una fecha ISO (AAAA-MM-DD) de la query string
+def _fecha_parametro(args, nombre):
+    valor = args.get(nombre, '').strip()
+    if not valor:
+        return None
+    try:
+        return np.datetime64(date.fromisoformat(valor), 'D')
+    except ValueError:
+        raise ValueError(f"Fecha inválida en '{nombre}': {valor} (formato AAAA-MM-DD)")
+
+# Filtros del dashboard y de /api/kpis: OR entre los valores de un mismo
+# campo (sexo=Macho,Hembra o sexo=Macho&sexo=Hembra) y AND entre campos.
+# Rangos cerrados de fecha (desde/hasta) y de peso (peso_min/peso_max).
+# Con un catálogo de libros, también sitio y temporada.
+@dataclass(frozen=True)
+class FiltrosDashboard:
+    sexo: tuple = ()
+    edad: tuple = ()
+    desde: object = None
+    hasta: object = None
+    peso_min: float = None
+    peso_max: float = None
+    sitio: tuple = ()
+    temporada: tuple = ()
+
+    # Clave canónica para las cachés (vacía = dataset completo)
+    def clave(self):
+        campos = (
+            ('sitio', self.sitio or None), ('temporada', self.temporada or None),
+            ('sexo', self.sexo or None), ('edad', self.edad or None),
+            ('desde', None if self.desde is None else str(self.desde)),
+            ('hasta', None if self.hasta is None else str(self.hasta)),
+            ('peso_min', self.peso_min), ('peso_max', self.peso_max)
+        )
+        return tuple((nombre, valor) for nombre, valor in campos if valor is not None)
+
+    # Solo se eligen libros del catálogo (se resuelve con sus agregados)
+    def solo_libros(self):
+        return bool(self.sitio or self.temporada) and not (
+            self.sexo or self.edad or self.desde is not None or self.hasta is not None
+            or self.peso_min is not None or self.peso_max is not None)
+
+    # Valores para rellenar el formulario de filtros
+    def a_formulario(self):
+        return {
+            'sitio': self.sitio,
+            'temporada': self.temporada,
+            'sexo': self.sexo,
+            'edad': self.edad,
+            'desde': '' if self.desde is None else str(self.desde),
+            'hasta': '' if self.hasta is None else str(self.hasta),
+            'peso_min': '' if self.peso_min is None else f'{self.peso_min:g}',
+            'peso_max': '' if self.peso_max is None else f'{self.peso_max:g}',
+        }
+
+# Valores de un filtro categórico (sin distinguir mayúsculas), en el orden
+# de `validos` para que la misma selección dé siempre la misma clave
+def _valores_filtro(args, nombre, validos):
+    pedidos = set()
+    for valor in args.getlist(nombre):
+        for parte in valor.split(','):
+            parte = parte.strip()
+            if not parte:
+                continue
+            coincidencias = [v for v in validos if v.lower() == parte.lower()]
+            if not coincidencias:
+                raise ValueError(f"Valor inválido en '{nombre}': {parte} (use {', '.join(validos)})")
+            pedidos.add(coincidencias[0])
+    return tuple(v for v in validos if v in pedidos)
+
+def _peso_parametro(args, nombre):
+    valor = args.get(nombre, '').strip()
+    if not valor:
+        return None
+    try:
+        peso = float(valor.replace(',', '.'))
+    except ValueError:
+        raise ValueError(f"Peso inválido en '{nombre}': {valor}")
+    if not math.isfinite(peso) or peso < 0:
+        raise ValueError(f"Peso inválido en '{nombre}': {valor}")
+    return peso
+
+def parsear_filtros_dashboard(args):
+    sitios, temporadas = _cache_datos.dimensiones_catalogo()
+    filtros = FiltrosDashboard(
+        sitio=_valores_filtro(args, 'sitio', sitios),
+        temporada=_valores_filtro(args, 'temporada', temporadas),
+        sexo=_valores_filtro(args, 'sexo', SEXOS_VALIDOS),
+        edad=_valores_filtro(args, 'edad', EDADES_VALIDAS),
+        desde=_fecha_parametro(args, 'desde'),
+        hasta=_fecha_parametro(args, 'hasta'),
+        peso_min=_peso_parametro(args, 'peso_min'),
+        peso_max=_peso_parametro(args, 'peso_max'),
+    )
+    if filtros.desde is not None and filtros.hasta is not None and filtros.desde > filtros.hasta:
+        raise ValueError("'desde' no puede ser posterior a 'hasta'")
+    if filtros.peso_min is not None and filtros.peso_max is not None and filtros.peso_min > filtros.peso_max:
+        raise ValueError("'peso_min' no puede ser mayor que 'peso_max'")
+    return filtros
+
+# Número de bits a 1 de un bitset empaquetado
+def contar_bits(bits):
+    if hasattr(np, 'bitwise_count'):
+        return int(np.bitwise_count(bits).sum(dtype='int64'))
+    return int(np.unpackbits(bits).sum(dtype='int64'))
+
+# Bitset (np.packbits, un bit por fila) con las filas indicadas a 1
+def bits_de_posiciones(posiciones, n):
+    mascara = np.zeros(n, dtype=bool)
+    mascara[posiciones] = True
+    return np.packbits(mascara)
+
+# Bitsets por intervalo de una columna numérica (meses de fecha, tramos de
+# peso) más las filas ordenadas por valor. Un rango se resuelve con el OR de
+# los intervalos que caen enteros dentro; los de los extremos se completan
+# con las filas del tramo ordenado que cumplen la comparación exacta.
+class IntervalosBitmap:
+    def __init__(self, valores, intervalo_de, n):
+        self.n = n
+        validos = np.flatnonzero(~np.isnan(valores))
+        self.orden = validos[np.argsort(valores[validos], kind='stable')]
+        self.ordenados = valores[self.orden]
+        intervalos = intervalo_de(self.ordenados)
+        cortes = np.flatnonzero(np.diff(intervalos)) + 1
+        self.inicios = np.concatenate([[0], cortes]) if len(intervalos) else np.zeros(0, dtype='int64')
+        self.fines = np.concatenate([cortes, [len(intervalos)]]) if len(intervalos) else np.zeros(0, dtype='int64')
+        self.bits = np.zeros((len(self.inicios), (n + 7) // 8), dtype='uint8')
+        for i, (inicio, fin) in enumerate(zip(self.inicios, self.fines)):
+            self.bits[i] = bits_de_posiciones(self.orden[inicio:fin], n)
+
+    def rango(self, minimo=None, maximo=None):
+        desde = 0 if minimo is None else np.searchsorted(self.ordenados, minimo, side='left')
+        hasta = len(self.ordenados) if maximo is None else np.searchsorted(self.ordenados, maximo, side='right')
+        if desde >= hasta:
+            return np.zeros(self.bits.shape[1], dtype='uint8')
+        # Intervalos completos dentro de [desde, hasta)
+        primero = np.searchsorted(self.inicios, desde, side='left')
+        ultimo = np.searchsorted(self.fines, hasta, side='right')
+        if primero >= ultimo:
+            return bits_de_posiciones(self.orden[desde:hasta], self.n)
+        bits = np.bitwise_or.reduce(self.bits[primero:ultimo], axis=0)
+        bordes = np.concatenate([self.orden[desde:self.inicios[primero]],
+                                 self.orden[self.fines[ultimo - 1]:hasta]])
+        if len(bordes):
+            bits |= bits_de_posiciones(bordes, self.n)
+        return bits
+
+COLUMNAS_BITMAP = ('Sexo', 'Edad') + COLUMNAS_CATALOGO
+ANCHO_INTERVALO_PESO = 0.5
+
+# Índice de bitsets para filtrar el dashboard sin recorrer el DataFrame: uno
+# por valor de Sexo y de Edad (nulos incluidos, como None) e intervalos por
+# mes de captura y por tramo de peso. Se construye una vez por versión.
+class IndiceBitmap:
+    def __init__(self, df):
+        self.n = len(df)
+        self.todos = np.packbits(np.ones(self.n, dtype=bool))
+        self.categorias = {}
+        for columna in COLUMNAS_BITMAP:
+            if columna not in df.columns:
+                continue
+            serie = df[columna]
+            if isinstance(serie.dtype, pd.CategoricalDtype):
+                codigos, unicos = serie.cat.codes.to_numpy(), list(serie.cat.categories)
+            else:
+                codigos, unicos = pd.factorize(serie)
+                unicos = list(unicos)
+            valores = {}
+            for codigo, valor in enumerate(unicos):
+                valores[valor] = np.packbits(codigos == codigo)
+            if (codigos < 0).any():
+                valores[None] = np.packbits(codigos < 0)
+            self.categorias[columna] = valores
+
+        self.pesos = valores_float64(df['Peso_Kg'])
+        self.intervalos_peso = IntervalosBitmap(
+            self.pesos, lambda v: np.floor(v / ANCHO_INTERVALO_PESO).astype('int64'), self.n)
+
+        dias = np.full(self.n, np.nan)
+        if 'Fecha_entrga_CAV' in df.columns:
+            fechas = df['Fecha_entrga_CAV'].to_numpy(dtype='datetime64[D]')
+            validas = ~np.isnat(fechas)
+            dias[validas] = fechas[validas].astype('int64')
+        self.intervalos_fecha = IntervalosBitmap(
+            dias, lambda v: v.astype('int64').astype('datetime64[D]').astype('datetime64[M]').astype('int64'),
+            self.n)
+
+    # Bitset de las filas que cumplen los filtros
+    def resolver(self, filtros):
+        partes = []
+        for columna, pedidos in (('Sexo', filtros.sexo), ('Edad', filtros.edad),
+                                 ('Sitio', filtros.sitio), ('Temporada', filtros.temporada)):
+            if pedidos:
+                valores = self.categorias.get(columna, {})
+                presentes = [valores[v] for v in pedidos if v in valores]
+                partes.append(np.bitwise_or.reduce(presentes) if presentes
+                              else np.zeros_like(self.todos))
+        if filtros.desde is not None or filtros.hasta is not None:
+            partes.append(self.intervalos_fecha.rango(
+                None if filtros.desde is None else filtros.desde.astype('int64'),
+                None if filtros.hasta is None else filtros.hasta.astype('int64')))
+        if filtros.peso_min is not None or filtros.peso_max is not None:
+            partes.append(self.intervalos_peso.rango(filtros.peso_min, filtros.peso_max))
+        return np.bitwise_and.reduce(partes) if partes else self.todos
+
+    def posiciones(self, bits):
+        return np.flatnonzero(np.unpackbits(bits, count=self.n))
+
+    # Mismo resumen que calcular_kpis(df.take(posiciones)): conteos Edad x
+    # Sexo por popcount de bitsets y pesos de las filas seleccionadas
+    def kpis(self, bits, posiciones):
+        conteos = {}
+        for edad, bits_edad in self.categorias['Edad'].items():
+            bits_edad = bits & bits_edad
+            for sexo, bits_sexo in self.categorias['Sexo'].items():
+                n = contar_bits(bits_edad & bits_sexo)
+                if n:
+                    conteos[(edad, sexo)] = n
+        pesos = pd.Series(self.pesos[posiciones]).agg(['min', 'max', 'mean'])
+        return resumen_kpis(len(posiciones), conteos, peso_promedio=pesos['mean'],
+                            peso_max=pesos['max'], peso_min=pesos['min'])
+
+def obtener_indice_bitmap(df, version):
+    def construir():
+        with medir('indice_bitmap'):
+            return IndiceBitmap(df)
+    return _derivados.obtener(('indice_bitmap',), version, construir)
+
+# Filas seleccionadas por una combinación de filtros
+@dataclass(frozen=True, eq=False)
+class SeleccionFiltrada:
+    bits: object
+    posiciones: object
+
+def obtener_seleccion(df, version, filtros):
+    def construir():
+        indice = obtener_indice_bitmap(df, version)
+        bits = indice.resolver(filtros)
+        return SeleccionFiltrada(bits, indice.posiciones(bits))
+    return _derivados.obtener(('seleccion', filtros.clave()), version, construir, acotado=True)
+
+# Agregados de los libros elegidos cuando solo se filtra por sitio y
+# temporada (None si hay más filtros o la fuente no es un catálogo)
+def obtener_resumen_libros(version, filtros):
+    if not filtros.solo_libros():
+        return None
+    def construir():
+        with medir('resumen_libros'):
+            return _cache_datos.resumen_catalogo(version, filtros.sitio, filtros.temporada)
+    return _derivados.obtener(('resumen_libros', filtros.clave()), version, construir, acotado=True)
+
+# Datos de las figuras de una combinación de filtros: los agregados de los
+# libros elegidos si bastan (figuras ligeras) o, si no, una función que
+# materializa las filas seleccionadas. None si no queda ningún registro.
+def datos_filtrados(df, version, filtros):
+    resumen = obtener_resumen_libros(version, filtros) if FIGURAS_LIGERAS else None
+    if resumen is not None:
+        return resumen if len(resumen) else None
+    seleccion = obtener_seleccion(df, version, filtros)
+    if len(seleccion.posiciones) == 0:
+        return None
+    return lambda: df.take(seleccion.posiciones)
+
+# KPIs de una combinación de filtros (sin filtros, los del dataset completo)
+def obtener_kpis_filtrados(df, version, filtros):
+    clave = filtros.clave()
+    if not clave:
+        return obtener_kpis(df, version)
+
+    def construir():
+        with medir('kpis', filtrado='1'):
+            resumen = obtener_resumen_libros(version, filtros)
+            if resumen is not None:
+                return resumen.a_kpis()
+            seleccion = obtener_seleccion(df, version, filtros)
+            return obtener_indice_bitmap(df, version).kpis(seleccion.bits, seleccion.posiciones)
+    return _derivados.obtener(('kpis', clave), version, construir, acotado=True)
+
+# Valores de un grupo como valores únicos con su frecuencia, en bloques de
+# valores consecutivos (unos √m bloques de √m valores si hay más de
+# HOJAS_EXACTAS distintos; si no, un valor por bloque). Un remuestreo sortea
+# cuántos valores caen en cada bloque y solo baja al reparto dentro del
+# bloque donde hace falta un estadístico de orden, así que cuesta O(√m) y
+# no O(n). Con un valor por bloque el remuestreo es exacto. Con bloques más
+# anchos, lo que aporta cada bloque a las sumas por dentro se aproxima con
+# una normal de su varianza exacta, así que la media y la permutación dejan
+# de ser un bootstrap puro; `metodo` lo declara en la respuesta.
+HOJAS_EXACTAS = 256
+
+class BloquesValores:
+    def __init__(self, ordenados):
+        valores, conteos = np.unique(ordenados, return_counts=True)
+        self.n = int(conteos.sum())
+        self.suma = float((valores * conteos).sum())
+        self.ancho = 1 if len(valores) <= HOJAS_EXACTAS else math.isqrt(len(valores))
+        relleno = -len(valores) % self.ancho
+        self.valores = np.append(valores, np.full(relleno, valores[-1])).reshape(-1, self.ancho)
+        self.conteos = np.append(conteos, np.zeros(relleno, dtype=conteos.dtype)).reshape(-1, self.ancho)
+        self.conteos_bloque = self.conteos.sum(axis=1)
+        self.media_bloque = (self.valores * self.conteos).sum(axis=1) / self.conteos_bloque
+        self.varianza_bloque = ((self.valores - self.media_bloque[:, None]) ** 2 * self.conteos).sum(axis=1) \
+            / self.conteos_bloque
+        self.p_hoja = self.conteos / self.conteos_bloque[:, None]
+
+    @property
+    def exacto(self):
+        return self.ancho == 1
+
+    # Nombre del método de las sumas: exacto o con la aproximación normal
+    def metodo(self, base):
+        return base if self.exacto else f'{base} por bloques (aproximación normal dentro de cada bloque)'
+
+    # Remuestreos por lote para no pasar de MEMORIA_REMUESTREO
+    def lotes(self, remuestreos):
+        por_lote = max(1, MEMORIA_REMUESTREO // (8 * 6 * (len(self.valores) + self.ancho)))
+        for inicio in range(0, remuestreos, por_lote):
+            yield min(por_lote, remuestreos - inicio)
+
+    # Suma de los valores elegidos dados los conteos por bloque; `sin_reposicion`
+    # aplica la corrección de población finita de la hipergeométrica
+    def _sumas(self, rng, k, sin_reposicion=False):
+        sumas = k @ self.media_bloque
+        if not self.exacto:
+            varianza = k * self.varianza_bloque
+            if sin_reposicion:
+                varianza = varianza * (self.conteos_bloque - k) / np.maximum(self.conteos_bloque - 1, 1)
+            sumas += (np.sqrt(varianza) * rng.standard_normal(k.shape)).sum(axis=1)
+        return sumas
+
+    # Mediana de cada remuestreo: los estadísticos de orden centrales,
+    # sorteando el reparto dentro de su bloque (compartido si es el mismo)
+    def _medianas(self, rng, k):
+        acumulado = np.cumsum(k, axis=1)
+        filas = np.arange(len(k))
+        centrales, anterior = [], None
+        for posicion in sorted({(self.n - 1) // 2, self.n // 2}):
+            bloque = (acumulado > posicion).argmax(axis=1)
+            if self.exacto:
+                centrales.append(self.valores[bloque, 0])
+                continue
+            en_bloque = k[filas, bloque]
+            desplazamiento = posicion - (acumulado[filas, bloque] - en_bloque)
+            hojas = rng.multinomial(en_bloque, self.p_hoja[bloque])
+            if anterior is not None:
+                mismo = bloque == anterior[0]
+                hojas[mismo] = anterior[1][mismo]
+            anterior = (bloque, hojas)
+            hoja = (np.cumsum(hojas, axis=1) > desplazamiento[:, None]).argmax(axis=1)
+            centrales.append(self.valores[bloque, hoja])
+        return sum(centrales) / len(centrales)
+
+    # Media y mediana de remuestreos con reemplazo del mismo tamaño
+    def bootstrap(self, rng, remuestreos):
+        medias, medianas = [], []
+        for tamano in self.lotes(remuestreos):
+            k = rng.multinomial(self.n, self.conteos_bloque / self.n, size=tamano)
+            medias.append(self._sumas(rng, k) / self.n)
+            medianas.append(self._medianas(rng, k))
+        return np.concatenate(medias), np.concatenate(medianas)
+
+    # Suma de `elegidos` valores tomados sin reemplazo en cada permutación
+    def sumas_permutadas(self, rng, elegidos, permutaciones):
+        sumas = []
+        for tamano in self.lotes(permutaciones):
+            k = rng.multivariate_hypergeometric(self.conteos_bloque, elegidos, size=tamano)
+            sumas.append(self._sumas(rng, k, sin_reposicion=True))
+        return np.concatenate(sumas)
+
+def _redondear(valor, decimales=4):
+    valor = float(valor)
+    return round(valor, decimales) if math.isfinite(valor) else None
+
+# Estimación puntual e intervalo de percentiles de una muestra bootstrap
+def intervalo_bootstrap(estimacion, muestra, nivel):
+    alfa = (1 - nivel) / 2
+    with np.errstate(invalid='ignore'):
+        inferior, superior = np.quantile(muestra, [alfa, 1 - alfa])
+    return {'estimacion': _redondear(estimacion), 'ic': [_redondear(inferior), _redondear(superior)]}
+
+# Intervalos bootstrap de la proporción de sexos, la composición por edad y
+# la media y mediana del peso de cada grupo Sexo x Edad, y prueba de
+# permutación del dimorfismo sexual en el peso (diferencia de medias
+# Macho - Hembra permutando el sexo dentro de cada edad). Todo sale de un
+# ResumenParcial: conteos Edad x Sexo y pesos ordenados por grupo. Cada
+# bloque de resultados usa su propio generador derivado de la semilla.
+def calcular_estadisticas(resumen, remuestreos, nivel, semilla):
+    generadores = iter(np.random.default_rng(semilla).spawn(1 + (len(SEXOS_VALIDOS) + 1) * len(EDADES_VALIDAS)))
+    resultado = {'total': resumen.total, 'remuestreos': remuestreos, 'nivel': nivel, 'semilla': semilla}
+
+    # Individuos remuestreados como un multinomial sobre las celdas Edad x Sexo
+    claves = list(resumen.conteos)
+    observados = np.array([resumen.conteos[c] for c in claves], dtype='int64')
+    muestra = next(generadores).multinomial(resumen.total, observados / max(resumen.total, 1), size=remuestreos)
+
+    def columnas(posicion, valor):
+        return [i for i, clave in enumerate(claves) if clave[posicion] == valor]
+
+    machos, hembras = (muestra[:, columnas(1, s)].sum(axis=1) for s in ('Macho', 'Hembra'))
+    n_machos, n_hembras = (int(observados[columnas(1, s)].sum()) for s in ('Macho', 'Hembra'))
+    with np.errstate(divide='ignore', invalid='ignore'):
+        resultado['sexo'] = {
+            'machos': n_machos,
+            'hembras': n_hembras,
+            'ratio_mh': intervalo_bootstrap(n_machos / n_hembras if n_hembras else math.nan,
+                                            machos / hembras, nivel),
+            'porcentaje_machos': intervalo_bootstrap(100 * n_machos / resumen.total,
+                                                     100 * machos / resumen.total, nivel),
+            'porcentaje_hembras': intervalo_bootstrap(100 * n_hembras / resumen.total,
+                                                      100 * hembras / resumen.total, nivel),
+        }
+    resultado['edad'] = {
+        edad: intervalo_bootstrap(100 * observados[columnas(0, edad)].sum() / resumen.total,
+                                  100 * muestra[:, columnas(0, edad)].sum(axis=1) / resumen.total, nivel)
+        for edad in EDADES_VALIDAS if columnas(0, edad)
+    }
+
+    # Media y mediana del peso por grupo (remuestreo dentro de cada grupo)
+    resultado['peso'] = []
+    for sexo in SEXOS_VALIDOS[::-1]:
+        for edad in EDADES_VALIDAS:
+            pesos = resumen.pesos.get((edad, sexo))
+            rng = next(generadores)
+            if pesos is None or not len(pesos):
+                continue
+            bloques = BloquesValores(pesos)
+            medias, medianas = bloques.bootstrap(rng, remuestreos)
+            resultado['peso'].append({
+                'sexo': sexo, 'edad': edad, 'n': len(pesos),
+                'media': dict(intervalo_bootstrap(pesos.mean(), medias, nivel), metodo=bloques.metodo('bootstrap')),
+                'mediana': dict(intervalo_bootstrap(np.median(pesos), medianas, nivel), metodo='bootstrap'),
+            })
+
+    # Dimorfismo: bajo la hipótesis nula el sexo es intercambiable dentro de
+    # cada edad, así que los machos de una edad son una muestra sin reemplazo
+    # de los pesos de esa edad
+    # La prueba global combina las diferencias por edad con peso
+    # n_m·n_h/(n_m+n_h), el mismo estadístico en lo observado y en cada
+    # permutación, para que la nula quede centrada en 0 aunque la proporción
+    # de sexos cambie entre edades
+    por_edad = {}
+    permutada_total = np.zeros(remuestreos)
+    observado = peso_total = 0.0
+    exacto = True
+    n_sexo = np.zeros(2)
+    for edad in EDADES_VALIDAS:
+        pesos_m, pesos_h = (resumen.pesos.get((edad, s), np.array([])) for s in ('Macho', 'Hembra'))
+        rng = next(generadores)
+        if not len(pesos_m) or not len(pesos_h):
+            continue
+        bloques = BloquesValores(np.concatenate([pesos_m, pesos_h]))
+        sumas_m = bloques.sumas_permutadas(rng, len(pesos_m), remuestreos)
+        sumas_h = bloques.suma - sumas_m
+        diferencia = pesos_m.mean() - pesos_h.mean()
+        permutadas = sumas_m / len(pesos_m) - sumas_h / len(pesos_h)
+        por_edad[edad] = {
+            'n_machos': len(pesos_m), 'n_hembras': len(pesos_h),
+            'diferencia': _redondear(diferencia),
+            'p_valor': _redondear(valor_p_permutacion(diferencia, permutadas), 6),
+            'metodo': bloques.metodo('permutación'),
+        }
+        exacto = exacto and bloques.exacto
+        peso = len(pesos_m) * len(pesos_h) / (len(pesos_m) + len(pesos_h))
+        observado += peso * diferencia
+        permutada_total += peso * permutadas
+        peso_total += peso
+        n_sexo += [len(pesos_m), len(pesos_h)]
+    dimorfismo = {'estadistico': 'media Macho - media Hembra (kg)', 'por_edad': por_edad}
+    if por_edad:
+        diferencia = observado / peso_total
+        dimorfismo.update(n_machos=int(n_sexo[0]), n_hembras=int(n_sexo[1]), diferencia=_redondear(diferencia),
+                          estadistico_global='media ponderada de las diferencias por edad (kg)',
+                          metodo='permutación' if exacto else
+                          'permutación por bloques (aproximación normal dentro de cada bloque)',
+                          p_valor=_redondear(valor_p_permutacion(diferencia, permutada_total / peso_total), 6))
+    resultado['dimorfismo'] = dimorfismo
+    return resultado
+
+# p-valor bilateral de una prueba de permutación (incluye la observada)
+def valor_p_permutacion(observada, permutadas):
+    extremas = np.abs(permutadas) >= abs(observada) - 1e-12
+    return (1 + int(extremas.sum())) / (1 + len(permutadas))
+
+# Estadísticas memoizadas por versión, filtros y parámetros del remuestreo
+def obtener_estadisticas(df, version, filtros, remuestreos, nivel, semilla):
+    def construir():
+        with medir('estadisticas'):
+            resumen = obtener_resumen_libros(version, filtros)
+            if resumen is None:
+                datos = df
+                if filtros.clave():
+                    datos = df.take(obtener_seleccion(df, version, filtros).posiciones)
+                resumen = ResumenParcial.desde_df(datos)
+            return calcular_estadisticas(resumen, remuestreos, nivel, semilla)
+    return _derivados.obtener(('estadisticas', filtros.clave(), remuestreos, nivel, semilla), version,
+                              construir, acotado=True)
+
+# Renderizar una plantilla midiendo el tiempo de render
+def renderizar(plantilla, **contexto):
+    with medir('plantilla', plantilla=plantilla):
+        return render_template(plantilla, **contexto)
+
+# Latencia y conteo de peticiones por ruta
+@app.before_request
+def _iniciar_peticion():
+    g.inicio_peticion = time.perf_counter()
+
+@app.after_request
+def _registrar_peticion(respuesta):
+    inicio = g.pop('inicio_peticion', None)
+    if inicio is not None:
+        ruta = request.url_rule.rule if request.url_rule else 'sin_ruta'
+        metricas.observar('iguanas_peticion_duracion_segundos', time.perf_counter() - inicio,
+                          'Duración de las peticiones HTTP', ruta=ruta, metodo=request.method)
+        metricas.incrementar('iguanas_peticiones_total', 'Peticiones HTTP atendidas',
+                             ruta=ruta, metodo=request.method, estado=respuesta.status_code)
+    return respuesta
+
 @app.route('/')
 def index():
     return render_template('index.html')
 
 @app.route('/dashboard')
 def dashboard():
-    print("\n" + "="*50)
-    print("ACCEDIENDO A /dashboard")
-    print("="*50)
-    
-    df = cargar_datos()
+    df, version = _cache_datos.instantanea()
     
     if df is None or df.empty:
-        print("ERROR: No se pudieron cargar los datos")
+        logger.error("No se pudieron cargar los datos")
         return render_template('dashboard.html', error="Error cargando datos")
     
-    print(f"\nTotal de registros cargados: {len(df)}")
-    
-    # Calcular KPIs (ya redondeados)
-    total_iguanas = len(df)
-    total_adultos = len(df[df['Edad'] == 'Adulto'])
-    total_subadultos = len(df[df['Edad'] == 'Subadulto'])
-    total_juveniles = len(df[df['Edad'] == 'Juvenil'])
+    try:
+        filtros = parsear_filtros_dashboard(request.args)
+    except ValueError as e:
+        return render_template('dashboard.html', error=str(e), filtros=FiltrosDashboard().a_formulario(),
+                               edades=EDADES_VALIDAS, sexos=SEXOS_VALIDOS), 400
     
-    print(f"Total adultos: {total_adultos}")
-    print(f"Total subadultos: {total_subadultos}")
-    print(f"Total juveniles: {total_juveniles}")
+    # KPIs (ya redondeados), calculados una vez por versión del dataset y
+    # combinación de filtros
+    kpis = obtener_kpis_filtrados(df, version, filtros)
+    sitios, temporadas = _cache_datos.dimensiones_catalogo()
+    contexto_filtros = dict(filtros=filtros.a_formulario(), filtrado=bool(filtros.clave()),
+                            total_dataset=len(df), edades=EDADES_VALIDAS, sexos=SEXOS_VALIDOS,
+                            sitios=sitios, temporadas=temporadas)
+    if kpis.total_iguanas == 0:
+        return renderizar('dashboard.html', sin_resultados=True, **contexto_filtros)
     
-    # Porcentajes redondeados
-    porcentaje_adultos = round((total_adultos / total_iguanas * 100), 1) if total_iguanas > 0 else 0
-    porcentaje_subadultos = round((total_subadultos / total_iguanas * 100), 1) if total_iguanas > 0 else 0
-    porcentaje_juveniles = round((total_juveniles / total_iguanas * 100), 1) if total_iguanas > 0 else 0
+    # Generar gráficos (el subconjunto filtrado solo se materializa si falta
+    # alguna figura en caché)
+    datos = datos_filtrados(df, version, filtros) if filtros.clave() else df
+    graficos_data = obtener_graficos(GRAFICOS, datos, version, filtros.clave())
+    grafico_composicion = graficos_data['composicion']
+    grafico_sexo = graficos_data['sexo']
+    grafico_pesos = graficos_data['pesos']
+    grafico_boxplot = graficos_data['boxplot']
+    grafico_temporal = graficos_data['temporal']
     
-    print(f"Porcentaje adultos: {porcentaje_adultos}%")
-    print(f"Porcentaje subadultos: {porcentaje_subadultos}%")
-    print(f"Porcentaje juveniles: {porcentaje_juveniles}%")
+    logger.debug("Gráficos no disponibles en línea: %s",
+                 [nombre for nombre, figura in graficos_data.items() if not figura])
     
-    # Distribución por sexo
-    machos = len(df[df['Sexo'] == 'Macho'])
-    hembras = len(df[df['Sexo'] == 'Hembra'])
-    proporcion_machos = round((machos / total_iguanas * 100), 2) if total_iguanas > 0 else 0
-    porcentaje_machos = round((machos / total_iguanas * 100), 1) if total_iguanas > 0 else 0
-    porcentaje_hembras = round((hembras / total_iguanas * 100), 1) if total_iguanas > 0 else 0
-    
-    print(f"Machos: {machos} ({porcentaje_machos}%)")
-    print(f"Hembras: {hembras} ({porcentaje_hembras}%)")
-    
-    # Estadísticas de peso
-    peso_promedio = round(float(df['Peso_Kg'].mean()), 2)
-    peso_max = round(float(df['Peso_Kg'].max()), 2)
-    peso_min = round(float(df['Peso_Kg'].min()), 2)
-    
-    print(f"Peso promedio: {peso_promedio} kg")
-    print(f"Peso mínimo: {peso_min} kg")
-    print(f"Peso máximo: {peso_max} kg")
-    
-    # Ratio M:H
-    ratio_mh = round(machos / hembras, 2) if hembras > 0 else 0
-    print(f"Ratio M:H: {ratio_mh}")
-    
-    # Generar gráficos
-    print("\nGenerando gráficos...")
-    grafico_composicion = generar_grafico_composicion(df)
-    grafico_sexo = generar_grafico_sexo(df)
-    grafico_pesos = generar_grafico_pesos(df)
-    grafico_boxplot = generar_grafico_boxplot(df)
-    grafico_temporal = generar_grafico_temporal(df)
-    
-    print(f"\n¿Gráfico composición generado? {'SÍ' if grafico_composicion else 'NO'}")
-    print(f"¿Gráfico sexo generado? {'SÍ' if grafico_sexo else 'NO'}")
-    print(f"¿Gráfico pesos generado? {'SÍ' if grafico_pesos else 'NO'}")
-    print(f"¿Gráfico boxplot generado? {'SÍ' if grafico_boxplot else 'NO'}")
-    print(f"¿Gráfico temporal generado? {'SÍ' if grafico_temporal else 'NO'}")
-  
-    
-    return render_template('dashboard.html',
-                         total_iguanas=total_iguanas,
-                         total_adultos=total_adultos,
-                         total_subadultos=total_subadultos,
-                         total_juveniles=total_juveniles,
-                         porcentaje_adultos=porcentaje_adultos,
-                         porcentaje_subadultos=porcentaje_subadultos,
-                         porcentaje_juveniles=porcentaje_juveniles,
-                         machos=machos,
-                         hembras=hembras,
-                         porcentaje_machos=porcentaje_machos,
-                         porcentaje_hembras=porcentaje_hembras,
-                         proporcion_machos=proporcion_machos,
-                         peso_promedio=peso_promedio,
-                         peso_max=peso_max,
-                         peso_min=peso_min,
-                         ratio_mh=ratio_mh,
+    return renderizar('dashboard.html',
+                         **kpis.a_plantilla(),
+                         **contexto_filtros,
                          grafico_composicion=grafico_composicion,
                          grafico_sexo=grafico_sexo,
                          grafico_pesos=grafico_pesos,
@@ -476,67 +3628,381 @@ def dashboard():
 
 @app.route('/graficos')
 def graficos():
-    df = cargar_datos()
+    df, version = _cache_datos.instantanea()
     
     if df is None or df.empty:
         return render_template('graficos.html', error="Error cargando datos")
     
-    # Generar todos los gráficos
-    graficos_data = {
-        'composicion': generar_grafico_composicion(df),
-        'sexo': generar_grafico_sexo(df),
-        'pesos': generar_grafico_pesos(df),
-        'boxplot': generar_grafico_boxplot(df),
-        'temporal': generar_grafico_temporal(df)
-    }
+    # Todos los gráficos (caché de figuras + generación en paralelo)
+    graficos_data = obtener_graficos(GRAFICOS, df, version)
     
-    return render_template('graficos.html', graficos_data=graficos_data)
+    return renderizar('graficos.html', graficos_data=graficos_data)
 
 # API para KPIs
 @app.route('/api/kpis')
 def api_kpis():
-    df = cargar_datos()
+    df, version = _cache_datos.instantanea()
     
     if df is None or df.empty:
         return jsonify({'error': 'No se pudieron cargar los datos'})
     
-    # Calcular KPIs
-    total_iguanas = len(df)
-    total_adultos = len(df[df['Edad'] == 'Adulto'])
-    total_subadultos = len(df[df['Edad'] == 'Subadulto'])
-    total_juveniles = len(df[df['Edad'] == 'Juvenil'])
-    
-    machos = len(df[df['Sexo'] == 'Macho'])
-    hembras = len(df[df['Sexo'] == 'Hembra'])
-    
-    kpis = {
-        'total_iguanas': total_iguanas,
-        'total_adultos': total_adultos,
-        'total_subadultos': total_subadultos,
-        'total_juveniles': total_juveniles,
-        'machos': machos,
-        'hembras': hembras,
-        'proporcion_machos': round((machos / total_iguanas * 100), 2) if total_iguanas > 0 else 0,
-        'proporcion_hembras': round((hembras / total_iguanas * 100), 2) if total_iguanas > 0 else 0,
-        'peso_promedio': round(float(df['Peso_Kg'].mean()), 2),
-        'peso_max': round(float(df['Peso_Kg'].max()), 2),
-        'peso_min': round(float(df['Peso_Kg'].min()), 2)
-    }
+    # Mismos filtros que el dashboard: /api/kpis?sexo=Macho&desde=2025-10-01
+    try:
+        filtros = parsear_filtros_dashboard(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
     
-    return jsonify(kpis)
+    kpis = obtener_kpis_filtrados(df, version, filtros)
+    
+    return jsonify(kpis.a_api())
 
-@app.route('/tabla-datos')
-def tabla_datos():
-    df = cargar_datos()
+# Mensaje Server-Sent Events
+def evento_sse(evento, identificador, datos):
+    return f'id: {identificador}\nevent: {evento}\ndata: {json.dumps(datos, separators=(",", ":"))}\n\n'
+
+# KPIs empujados por SSE: al conectar se envían completos (evento `kpis`) y
+# después solo los campos que cambian con cada versión del dataset (evento
+# `delta`). El id de cada evento es la versión; al reconectar con
+# Last-Event-ID se envía el delta desde esa versión si aún se recuerda, o
+# los KPIs completos si no. Admite los mismos filtros que /api/kpis. La
+# conexión termina a los DURACION_MAXIMA_SSE segundos y EventSource reconecta.
+@app.route('/api/kpis/stream')
+def api_kpis_stream():
+    try:
+        filtros = parsear_filtros_dashboard(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    clave = filtros.clave()
+    ultima = request.headers.get('Last-Event-ID') or None
+    
+    def eventos():
+        with _notificador.suscripcion():
+            yield f'retry: {REINTENTO_SSE_MS}\n\n'
+            enviada, enviados = ultima, _notificador.recordados((ultima, clave))
+            secuencia = _notificador.secuencia
+            fin = time.monotonic() + DURACION_MAXIMA_SSE
+            while True:
+                df, version = _cache_datos.instantanea()
+                _notificador.avisar(version)
+                if version != enviada and df is not None and not df.empty:
+                    kpis = obtener_kpis_filtrados(df, version, filtros).a_api()
+                    _notificador.recordar((version, clave), kpis)
+                    if enviados is None:
+                        yield evento_sse('kpis', version, {'version': version, 'kpis': kpis})
+                    else:
+                        cambios = {nombre: valor for nombre, valor in kpis.items() if enviados.get(nombre) != valor}
+                        if cambios:
+                            yield evento_sse('delta', version, {'version': version, 'desde': enviada, 'cambios': cambios})
+                        else:
+                            # Solo avanza el Last-Event-ID del cliente
+                            yield f'id: {version}\n\n'
+                    enviada, enviados = version, kpis
+                
+                restante = fin - time.monotonic()
+                if restante <= 0:
+                    return
+                nueva = _notificador.esperar(secuencia, min(LATIDO_SSE, restante))
+                if nueva == secuencia:
+                    yield ': latido\n\n'
+                secuencia = nueva
+    
+    respuesta = Response(eventos(), mimetype='text/event-stream')
+    respuesta.headers['Cache-Control'] = 'no-cache'
+    # Sin búfer en proxies como nginx
+    respuesta.headers['X-Accel-Buffering'] = 'no'
+    return respuesta
+
+# API de figuras individuales con ETag: el navegador revalida y recibe 304
+# mientras no cambie la versión del dataset. Admite los filtros del dashboard.
+@app.route('/api/graficos/<nombre>')
+def api_grafico(nombre):
+    if nombre not in GRAFICOS:
+        return jsonify({'error': f'Gráfico desconocido: {nombre}'}), 404
+    
+    df, version = _cache_datos.instantanea()
     
     if df is None or df.empty:
-        return render_template('tabla_datos.html', error="Error cargando datos", datos=[], columnas=[])
+        return jsonify({'error': 'No se pudieron cargar los datos'}), 503
+    
+    try:
+        filtros = parsear_filtros_dashboard(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    
+    if filtros.clave():
+        datos = datos_filtrados(df, version, filtros)
+        if datos is None:
+            return jsonify({'error': 'Ningún registro cumple los filtros'}), 404
+        figura = obtener_figura(nombre, datos, version, filtros.clave())
+    else:
+        figura = obtener_figura(nombre, df, version)
+    if figura is None:
+        return jsonify({'error': f'No se pudo generar el gráfico {nombre}'}), 500
+    
+    respuesta = app.response_class(figura.json, mimetype='application/json')
+    respuesta.set_etag(figura.etag)
+    respuesta.headers['Cache-Control'] = 'public, no-cache'
+    return respuesta.make_conditional(request)
+
+# API de registros paginados, ordenados y filtrados en el servidor
+@app.route('/api/datos')
+def api_datos():
+    df, version = _cache_datos.instantanea()
+    
+    if df is None or df.empty:
+        return jsonify({'error': 'No se pudieron cargar los datos'}), 503
+    
+    indice = obtener_indice_tabla(df, version)
+    consulta = parsear_consulta_tabla(request.args, indice.columnas)
+    posiciones = indice.resolver(consulta)
+    pagina = posiciones[consulta.inicio:consulta.inicio + consulta.limite]
+    datos = indice.registros(pagina)
+    
+    # Respuesta del protocolo server-side de DataTables
+    if consulta.draw is not None:
+        return jsonify({
+            'draw': consulta.draw,
+            'recordsTotal': len(df),
+            'recordsFiltered': len(posiciones),
+            'data': datos
+        })
+    
+    return jsonify({
+        'total': len(df),
+        'filtrados': len(posiciones),
+        'offset': consulta.inicio,
+        'limit': consulta.limite,
+        'columnas': indice.columnas,
+        'datos': datos
+    })
+
+# Estadísticas poblacionales con incertidumbre: intervalos de confianza
+# bootstrap (percentiles) de la proporción de sexos, la composición por edad
+# y la media y mediana del peso por Sexo x Edad, y prueba de permutación del
+# dimorfismo sexual en el peso. Admite los filtros del dashboard y
+# ?remuestreos=10000&nivel=0.95&semilla=0
+@app.route('/api/estadisticas')
+def api_estadisticas():
+    df, version = _cache_datos.instantanea()
+    
+    if df is None or df.empty:
+        return jsonify({'error': 'No se pudieron cargar los datos'}), 503
+    
+    try:
+        filtros = parsear_filtros_dashboard(request.args)
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+    parametros = {}
+    for nombre, tipo, defecto in (('remuestreos', int, REMUESTREOS_BOOTSTRAP), ('nivel', float, 0.95),
+                                  ('semilla', int, 0)):
+        valor = request.args.get(nombre, '').strip()
+        try:
+            parametros[nombre] = tipo(valor) if valor else defecto
+        except ValueError:
+            return jsonify({'error': f"Valor inválido en '{nombre}': {valor}"}), 400
+    remuestreos, nivel, semilla = parametros['remuestreos'], parametros['nivel'], parametros['semilla']
+    if not autorizado(TOKEN_ESTADISTICAS):
+        if remuestreos not in REMUESTREOS_PUBLICOS:
+            return jsonify({'error': "'remuestreos' debe ser uno de "
+                                     f"{', '.join(map(str, REMUESTREOS_PUBLICOS))}"}), 400
+        if nivel not in NIVELES_PUBLICOS:
+            return jsonify({'error': f"'nivel' debe ser uno de {', '.join(map(str, NIVELES_PUBLICOS))}"}), 400
+        if semilla != 0:
+            return jsonify({'error': "Otra 'semilla' requiere Authorization: Bearer <TOKEN_ESTADISTICAS>"}), 403
+    if not 100 <= remuestreos <= MAXIMO_REMUESTREOS:
+        return jsonify({'error': f"'remuestreos' debe estar entre 100 y {MAXIMO_REMUESTREOS}"}), 400
+    if not 0.5 <= nivel < 1:
+        return jsonify({'error': "'nivel' debe estar entre 0.5 y 1 (p. ej. 0.95)"}), 400
+    if semilla < 0:
+        return jsonify({'error': "'semilla' no puede ser negativa"}), 400
+    
+    if filtros.clave() and obtener_kpis_filtrados(df, version, filtros).total_iguanas == 0:
+        return jsonify({'error': 'Ningún registro cumple los filtros'}), 404
+    
+    estadisticas = obtener_estadisticas(df, version, filtros, remuestreos, nivel, semilla)
+    return jsonify({'version': version, **estadisticas})
+
+# Serie temporal de capturas para cualquier rango y resolución:
+# /api/temporal?desde=2025-10-01&hasta=2025-10-31&freq=W&por=Sexo
+@app.route('/api/temporal')
+def api_temporal():
+    df, version = _cache_datos.instantanea()
+    
+    if df is None or df.empty:
+        return jsonify({'error': 'No se pudieron cargar los datos'}), 503
+    
+    freq = request.args.get('freq', 'D').upper()
+    por = request.args.get('por') or None
+    if freq not in FRECUENCIAS_TEMPORALES:
+        return jsonify({'error': f'Frecuencia no soportada: {freq} (use D, W o M)'}), 400
+    if por is not None and por not in COLUMNAS_DESGLOSE_TEMPORAL:
+        return jsonify({'error': f'Desglose no soportado: {por} (use Sexo o Edad)'}), 400
+    
+    indice = obtener_indice_temporal(df, version)
+    if indice.total == 0:
+        return jsonify({'error': 'No hay fechas de captura válidas'}), 404
+    
+    try:
+        desde = _fecha_parametro(request.args, 'desde')
+        hasta = _fecha_parametro(request.args, 'hasta')
+        return jsonify(indice.serie(desde, hasta, freq, por))
+    except ValueError as e:
+        return jsonify({'error': str(e)}), 400
+
+# ¿Trae la petición "Authorization: Bearer <token>"? Sin token configurado,
+# nadie está autorizado
+def autorizado(token):
+    return bool(token) and hmac.compare_digest(request.headers.get('Authorization', '').encode(),
+                                               f'Bearer {token}'.encode())
+
+# Alta de capturas: un objeto, una lista o {"capturas": [...]}. El lote se
+# valida completo antes de escribir nada; si alguna captura es inválida no
+# se guarda ninguna.
+@app.route('/api/capturas', methods=['POST'])
+def api_anexar_capturas():
+    if not TOKEN_CAPTURAS:
+        return jsonify({'error': 'Alta de capturas deshabilitada: defina TOKEN_CAPTURAS'}), 403
+    if not autorizado(TOKEN_CAPTURAS):
+        return jsonify({'error': 'No autorizado'}), 401
+    
+    df, version = _cache_datos.instantanea()
+    if df is None:
+        return jsonify({'error': 'No se pudieron cargar los datos'}), 503
+    
+    cuerpo = request.get_json(silent=True)
+    if isinstance(cuerpo, dict) and isinstance(cuerpo.get('capturas'), list):
+        cuerpo = cuerpo['capturas']
+    registros = cuerpo if isinstance(cuerpo, list) else [cuerpo] if isinstance(cuerpo, dict) else None
+    if not registros:
+        return jsonify({'error': 'Se esperaba una captura o una lista de capturas en JSON'}), 400
+    if len(registros) > MAXIMO_LOTE_CAPTURAS:
+        return jsonify({'error': f'Máximo {MAXIMO_LOTE_CAPTURAS} capturas por petición'}), 413
     
-    # Convertir datos a formato para tabla
-    datos = df.to_dict('records')
     columnas = list(df.columns)
+    validas, errores = [], []
+    for posicion, registro in enumerate(registros):
+        try:
+            validas.append(validar_captura(registro, columnas))
+        except ValueError as e:
+            errores.append({'posicion': posicion, 'error': str(e)})
+    if errores:
+        return jsonify({'error': 'Capturas inválidas', 'detalles': errores}), 400
+    
+    (df, version), guardadas = _cache_datos.anexar_capturas(validas)
+    logger.info("%d capturas anexadas (versión %s)", len(guardadas), version)
+    # Los suscriptores SSE de este worker se enteran sin esperar al sondeo
+    _notificador.avisar(version)
+    return jsonify({
+        'aceptadas': len(guardadas),
+        'individuos': [r['Individuos'] for r in guardadas],
+        'version': version,
+        'kpis': obtener_kpis(df, version).a_api()
+    }), 201
+
+# Agregados incrementales del dataset (libro + capturas anexadas)
+@app.route('/api/capturas')
+def api_resumen_capturas():
+    df, version = _cache_datos.instantanea()
+    if df is None:
+        return jsonify({'error': 'No se pudieron cargar los datos'}), 503
+    return jsonify(_cache_datos.resumen_capturas())
+
+# Exportación en streaming de los registros filtrados. Se recorren las
+# posiciones por bloques, de modo que la memoria usada no depende del número
+# de filas; CSV y NDJSON se comprimen al vuelo si el cliente acepta gzip.
+FORMATOS_EXPORTACION = {
+    'csv': ('text/csv; charset=utf-8', 'csv'),
+    'ndjson': ('application/x-ndjson; charset=utf-8', 'ndjson'),
+    'xlsx': ('application/vnd.openxmlformats-officedocument.spreadsheetml.sheet', 'xlsx')
+}
+TAMANO_BLOQUE_EXPORTACION = 5000
+
+def _bloques(posiciones, tamano=TAMANO_BLOQUE_EXPORTACION):
+    for inicio in range(0, len(posiciones), tamano):
+        yield posiciones[inicio:inicio + tamano]
+
+def exportar_csv(indice, posiciones):
+    # BOM para que Excel reconozca UTF-8
+    yield '\ufeff'
+    yield indice.df.iloc[:0].to_csv(index=False)
+    for bloque in _bloques(posiciones):
+        pagina = indice.df.iloc[bloque]
+        for columna in pagina.columns:
+            if pd.api.types.is_datetime64_any_dtype(pagina[columna]):
+                pagina = pagina.assign(**{columna: pagina[columna].dt.strftime('%d/%m/%Y')})
+            elif pagina[columna].dtype == np.float32:
+                pagina = pagina.assign(**{columna: valores_float64(pagina[columna])})
+        yield pagina.to_csv(index=False, header=False)
+
+def exportar_ndjson(indice, posiciones):
+    for bloque in _bloques(posiciones):
+        yield ''.join(json.dumps(registro, ensure_ascii=False) + '\n' for registro in indice.registros(bloque))
+
+# XLSX en modo write_only: openpyxl vuelca las filas a disco a medida que se
+# escriben; el archivo resultante se envía por trozos y se borra al terminar
+def exportar_xlsx(indice, posiciones, tamano_trozo=1 << 16):
+    from openpyxl import Workbook
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet('Datos')
+    hoja.append(indice.columnas)
+    for bloque in _bloques(posiciones):
+        for registro in indice.registros(bloque):
+            hoja.append(list(registro.values()))
+
+    with tempfile.TemporaryFile(suffix='.xlsx') as archivo:
+        libro.save(archivo)
+        archivo.seek(0)
+        for trozo in iter(lambda: archivo.read(tamano_trozo), b''):
+            yield trozo
+
+def _comprimir_gzip(trozos, nivel=6):
+    compresor = zlib.compressobj(nivel, zlib.DEFLATED, 31)
+    for trozo in trozos:
+        if isinstance(trozo, str):
+            trozo = trozo.encode('utf-8')
+        comprimido = compresor.compress(trozo)
+        if comprimido:
+            yield comprimido
+    yield compresor.flush()
+
+@app.route('/api/exportar/<formato>')
+def api_exportar(formato):
+    if formato not in FORMATOS_EXPORTACION:
+        return jsonify({'error': f'Formato no soportado: {formato}'}), 404
     
-    # Calcular estadísticas para mostrar
+    df, version = _cache_datos.instantanea()
+    
+    if df is None or df.empty:
+        return jsonify({'error': 'No se pudieron cargar los datos'}), 503
+    
+    # Mismos filtros, búsqueda y orden que la tabla; sin paginar
+    indice = obtener_indice_tabla(df, version)
+    consulta = parsear_consulta_tabla(request.args, indice.columnas)
+    posiciones = indice.resolver(consulta)
+    
+    mimetype, extension = FORMATOS_EXPORTACION[formato]
+    generador = {
+        'csv': exportar_csv,
+        'ndjson': exportar_ndjson,
+        'xlsx': exportar_xlsx
+    }[formato](indice, posiciones)
+    
+    cabeceras = {
+        'Content-Disposition': f'attachment; filename=iguana_datos_{date.today().isoformat()}.{extension}',
+        'X-Total-Registros': str(len(posiciones)),
+        'Vary': 'Accept-Encoding'
+    }
+    # XLSX ya es un zip: no se vuelve a comprimir
+    if formato != 'xlsx' and request.accept_encodings['gzip'] > 0:
+        generador = _comprimir_gzip(generador)
+        cabeceras['Content-Encoding'] = 'gzip'
+    
+    return Response(generador, mimetype=mimetype, headers=cabeceras)
+
+# Resumen de la tabla (distribuciones por edad y sexo)
+def calcular_resumen_tabla(df):
     total_registros = len(df)
     
     # Distribución por edad
@@ -555,13 +4021,436 @@ def tabla_datos():
             porcentaje = round((count / total_registros) * 100, 1)
             distribucion_sexo[sexo] = {'cantidad': int(count), 'porcentaje': porcentaje}
     
-    return render_template('tabla_datos.html',
-                          datos=datos,
-                          columnas=columnas,
-                          total_registros=total_registros,
-                          distribucion_edad=distribucion_edad,
-                          distribucion_sexo=distribucion_sexo)
+    return {
+        'columnas': list(df.columns),
+        'total_registros': total_registros,
+        'distribucion_edad': distribucion_edad,
+        'distribucion_sexo': distribucion_sexo
+    }
+
+@app.route('/tabla-datos')
+def tabla_datos():
+    df, version = _cache_datos.instantanea()
+    
+    if df is None or df.empty:
+        return render_template('tabla_datos.html', error="Error cargando datos", columnas=[])
+    
+    # Las filas se piden paginadas a /api/datos; la página solo lleva el resumen
+    resumen = _derivados.obtener(('resumen_tabla',), version, lambda: calcular_resumen_tabla(df))
+    
+    return renderizar('tabla_datos.html', **resumen)
+
+# Métricas en formato de exposición de Prometheus
+@app.route('/metrics')
+def metrics():
+    return Response(metricas.exponer(), mimetype='text/plain; version=0.0.4; charset=utf-8')
+
+# Exportación del sitio a archivos estáticos (`flask export-static`): las
+# páginas, los KPIs, las figuras y los datos de la tabla se escriben en un
+# directorio que puede servir nginx o un CDN sin Python. Los estáticos llevan
+# la huella de su contenido en el nombre y los archivos de texto van además
+# precomprimidos (.gz y, si está instalado brotli, .br). manifiesto.json
+# guarda la huella de las entradas de cada artefacto (versión del dataset,
+# código, plantillas, estáticos) para regenerar solo los que cambian.
+PAGINAS_ESTATICAS = (
+    ('/', 'index.html'),
+    ('/dashboard', 'dashboard/index.html'),
+    ('/graficos', 'graficos/index.html'),
+    ('/tabla-datos', 'tabla-datos/index.html'),
+)
+EXTENSIONES_COMPRIMIBLES = ('.html', '.css', '.js', '.json', '.csv', '.ndjson', '.svg', '.txt')
+
+# {estático: estático con huella} mientras se exporta (None en el servidor)
+_activos_exportados = None
+
+def huella_bytes(datos):
+    return hashlib.sha1(datos).hexdigest()[:16]
+
+def nombre_con_huella(nombre, huella):
+    base, extension = os.path.splitext(nombre)
+    return f'{base}.{huella[:12]}{extension}'
+
+# Archivos de static/ con su nombre con huella ('css/style.css' -> 'css/style.<huella>.css')
+def activos_estaticos(directorio=None):
+    directorio = directorio or app.static_folder
+    activos = {}
+    for raiz, _, archivos in os.walk(directorio):
+        for archivo in sorted(archivos):
+            ruta = os.path.join(raiz, archivo)
+            nombre = os.path.relpath(ruta, directorio).replace(os.sep, '/')
+            activos[nombre] = nombre_con_huella(nombre, calcular_hash_archivo(ruta))
+    return dict(sorted(activos.items()))
+
+# Huella conjunta de los archivos de un directorio
+def huella_directorio(directorio):
+    h = hashlib.sha1()
+    for nombre, ruta in sorted(
+            (os.path.relpath(os.path.join(raiz, a), directorio), os.path.join(raiz, a))
+            for raiz, _, archivos in os.walk(directorio) for a in archivos):
+        h.update(nombre.encode('utf-8') + b'\0' + calcular_hash_archivo(ruta).encode('ascii'))
+    return h.hexdigest()[:16]
+
+# URL con huella de un archivo de static/ en las plantillas
+@app.template_global()
+def url_estatico(nombre):
+    activos = _activos_exportados if _activos_exportados is not None else obtener_activos().nombres
+    return url_for('static', filename=activos.get(nombre, nombre))
+
+@app.context_processor
+def _contexto_sitio_estatico():
+    return {'sitio_estatico': _activos_exportados is not None}
+
+# Filas de la tabla para el sitio estático: los registros más los códigos de
+# orden y los textos en minúsculas de cada columna, para que el navegador
+# filtre, busque y ordene igual que /api/datos
+def tabla_estatica(df, version):
+    indice = obtener_indice_tabla(df, version)
+    codigos, textos = {}, {}
+    for columna in indice.columnas:
+        codigos[columna], textos[columna] = indice.factores(columna)
+    return json.dumps({
+        'columnas': indice.columnas,
+        'datos': indice.registros(np.arange(len(df))),
+        'codigos': {columna: valores.tolist() for columna, valores in codigos.items()},
+        'textos': {columna: valores.tolist() for columna, valores in textos.items()},
+    }, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+def _leer_bytes(ruta):
+    with open(ruta, 'rb') as f:
+        return f.read()
+
+def _escribir_atomico(ruta, datos):
+    os.makedirs(os.path.dirname(ruta), exist_ok=True)
+    tmp = f'{ruta}.tmp{os.getpid()}'
+    with open(tmp, 'wb') as f:
+        f.write(datos)
+    os.replace(tmp, ruta)
+
+class ExportadorEstatico:
+    def __init__(self, destino, forzar=False):
+        self.destino = destino
+        self.ruta_manifiesto = os.path.join(destino, 'manifiesto.json')
+        self.anterior = {} if forzar else self._leer_manifiesto()
+        self.artefactos = {}
+        self.reporte = {'generados': 0, 'sin_cambios': 0, 'omitidos': 0, 'eliminados': 0}
+
+    def _leer_manifiesto(self):
+        try:
+            with open(self.ruta_manifiesto, encoding='utf-8') as f:
+                return json.load(f).get('artefactos', {})
+        except (OSError, ValueError):
+            return {}
+
+    # Producir un artefacto solo si cambiaron sus entradas, y escribirlo solo
+    # si cambió su contenido (así no cambian fechas ni ETags sin motivo)
+    def artefacto(self, ruta, entradas, producir, comprimir=None):
+        destino = os.path.join(self.destino, ruta)
+        anterior = self.anterior.get(ruta)
+        if anterior and anterior['entradas'] == entradas and os.path.exists(destino):
+            self.artefactos[ruta] = anterior
+            self.reporte['omitidos'] += 1
+            return
+        datos = producir()
+        huella = huella_bytes(datos)
+        if anterior and anterior['huella'] == huella and os.path.exists(destino):
+            self.reporte['sin_cambios'] += 1
+        else:
+            if comprimir is None:
+                comprimir = ruta.endswith(EXTENSIONES_COMPRIMIBLES) or '.' not in os.path.basename(ruta)
+            self._escribir(destino, datos, comprimir)
+            self.reporte['generados'] += 1
+        self.artefactos[ruta] = {'entradas': entradas, 'huella': huella, 'bytes': len(datos)}
+
+    def _escribir(self, destino, datos, comprimir):
+        _escribir_atomico(destino, datos)
+        for extension, codificacion in (('.gz', 'gzip'), ('.br', 'br')):
+            if comprimir and codificacion in codificaciones_disponibles():
+                _escribir_atomico(destino + extension, comprimir_cuerpo(datos, codificacion, maxima=True))
+            elif os.path.exists(destino + extension):
+                os.remove(destino + extension)
+
+    # Borrar los artefactos que ya no se generan (p. ej. estáticos con una
+    # huella anterior) y guardar el manifiesto
+    def finalizar(self, **datos):
+        for ruta in self.anterior.keys() - self.artefactos.keys():
+            for extension in ('', '.gz', '.br'):
+                with contextlib.suppress(FileNotFoundError):
+                    os.remove(os.path.join(self.destino, ruta + extension))
+            self.reporte['eliminados'] += 1
+        manifiesto = dict(datos, artefactos=dict(sorted(self.artefactos.items())))
+        _escribir_atomico(self.ruta_manifiesto,
+                          json.dumps(manifiesto, indent=2, ensure_ascii=False).encode('utf-8'))
+        return self.reporte
+
+def exportar_sitio_estatico(destino=DIR_SITIO_ESTATICO, forzar=False):
+    global _activos_exportados
+    df, version = _cache_datos.instantanea()
+    if df is None or df.empty:
+        raise RuntimeError('No se pudieron cargar los datos')
+
+    exportador = ExportadorEstatico(destino, forzar)
+    activos = activos_estaticos()
+    for nombre, con_huella in activos.items():
+        origen = os.path.join(app.static_folder, nombre)
+        exportador.artefacto(f'static/{con_huella}', con_huella,
+                             lambda origen=origen: _leer_bytes(origen),
+                             comprimir=nombre.endswith(EXTENSIONES_COMPRIMIBLES))
+
+    codigo = calcular_hash_archivo(os.path.abspath(__file__))
+    entradas_datos = f'{version}:{codigo}'
+    entradas_paginas = huella_bytes(json.dumps(
+        [version, codigo, huella_directorio(app.template_folder), activos]).encode('utf-8'))
+
+    cliente = app.test_client()
+    def respuesta(url):
+        r = cliente.get(url)
+        if r.status_code != 200:
+            raise RuntimeError(f'{url} respondió {r.status_code}')
+        return r.get_data()
+
+    _activos_exportados = activos
+    try:
+        for url, archivo in PAGINAS_ESTATICAS:
+            exportador.artefacto(archivo, entradas_paginas, lambda url=url: respuesta(url))
+    finally:
+        _activos_exportados = None
+
+    exportador.artefacto('api/kpis', entradas_datos, lambda: respuesta('/api/kpis'))
+    for nombre in GRAFICOS:
+        exportador.artefacto(f'api/graficos/{nombre}', entradas_datos,
+                             lambda nombre=nombre: respuesta(f'/api/graficos/{nombre}'))
+    exportador.artefacto('api/datos.json', entradas_datos, lambda: tabla_estatica(df, version))
+    for formato, (_, extension) in FORMATOS_EXPORTACION.items():
+        exportador.artefacto(f'api/exportar/iguana_datos.{extension}', entradas_datos,
+                             lambda formato=formato: respuesta(f'/api/exportar/{formato}'))
+
+    reporte = exportador.finalizar(version=version, generado=datetime.now().isoformat(timespec='seconds'))
+    reporte['version'] = version
+    return reporte
+
+@app.cli.command('export-static', help='Exportar el dashboard a archivos estáticos para nginx o un CDN.')
+@click.option('--destino', default=DIR_SITIO_ESTATICO, show_default=True, help='Directorio de salida')
+@click.option('--forzar', is_flag=True, help='Regenerar todos los artefactos aunque no hayan cambiado')
+def comando_exportar_estatico(destino, forzar):
+    inicio = time.perf_counter()
+    reporte = exportar_sitio_estatico(destino, forzar)
+    click.echo(f"Sitio estático en {destino} (versión {reporte['version']}): "
+               f"{reporte['generados']} generados, {reporte['sin_cambios']} sin cambios, "
+               f"{reporte['omitidos']} omitidos, {reporte['eliminados']} eliminados "
+               f"en {time.perf_counter() - inicio:.1f} s")
+
+# Compresión de respuestas según Accept-Encoding: brotli si está instalado y
+# el cliente lo acepta, si no gzip. Las respuestas dinámicas se comprimen una
+# vez por cuerpo: el comprimido se guarda en una caché LRU propia indexada
+# por (codificación, huella del cuerpo sin comprimir), sin consultar la
+# versión del dataset (la huella ya cambia con los datos) ni competir con
+# las selecciones, KPIs y figuras de la caché de filtros. Los estáticos se leen
+# y comprimen una sola vez por proceso y se sirven desde memoria con la
+# huella en la URL y caché inmutable.
+TIPOS_COMPRIMIBLES = frozenset({
+    'text/html', 'text/css', 'text/plain', 'text/csv', 'text/javascript',
+    'application/javascript', 'application/json', 'application/x-ndjson', 'image/svg+xml',
+})
+# Respuestas que cambian en cada petición: se comprimen sin pasar por la caché
+ENDPOINTS_SIN_CACHE_COMPRESION = frozenset({'metrics'})
+
+# LRU de cuerpos comprimidos acotada por bytes; un cuerpo mayor que la mitad
+# del límite no se guarda
+class CacheCompresion:
+    def __init__(self, limite_bytes=LIMITE_CACHE_COMPRESION):
+        self._lock = threading.Lock()
+        self._cuerpos = OrderedDict()
+        self._bytes = 0
+        self._limite = limite_bytes
+
+    def obtener(self, cuerpo, codificacion):
+        clave = (codificacion, huella_bytes(cuerpo))
+        with self._lock:
+            comprimido = self._cuerpos.get(clave)
+            if comprimido is not None:
+                self._cuerpos.move_to_end(clave)
+        metricas.incrementar('iguanas_cache_total', 'Consultas a las cachés', cache='compresion',
+                             resultado='fallo' if comprimido is None else 'acierto')
+        if comprimido is not None:
+            return comprimido
+
+        comprimido = comprimir_cuerpo(cuerpo, codificacion)
+        if len(comprimido) * 2 > self._limite:
+            return comprimido
+        with self._lock:
+            if clave not in self._cuerpos:
+                self._cuerpos[clave] = comprimido
+                self._bytes += len(comprimido)
+            while self._bytes > self._limite:
+                _, descartado = self._cuerpos.popitem(last=False)
+                self._bytes -= len(descartado)
+        return comprimido
+
+_cache_compresion = CacheCompresion()
+
+def codificaciones_disponibles():
+    return ('br', 'gzip') if brotli is not None else ('gzip',)
+
+# Compresión máxima para lo que se comprime una sola vez (estáticos, sitio
+# exportado) y rápida para las respuestas dinámicas
+def comprimir_cuerpo(datos, codificacion, maxima=False):
+    if codificacion == 'br':
+        return brotli.compress(datos, quality=11 if maxima else 5)
+    return gzip.compress(datos, compresslevel=9 if maxima else 6, mtime=0)
+
+# Archivos de static/ en memoria: {nombre con huella: (mimetype, huella,
+# {codificación: bytes})}, con la variante sin comprimir como 'identity'
+class ActivosEstaticos:
+    def __init__(self, directorio):
+        self.nombres = activos_estaticos(directorio)
+        self.archivos = {}
+        for nombre, con_huella in self.nombres.items():
+            datos = _leer_bytes(os.path.join(directorio, nombre))
+            variantes = {'identity': datos}
+            if nombre.endswith(EXTENSIONES_COMPRIMIBLES):
+                for codificacion in codificaciones_disponibles():
+                    comprimido = comprimir_cuerpo(datos, codificacion, maxima=True)
+                    if len(comprimido) < len(datos):
+                        variantes[codificacion] = comprimido
+            mimetype = mimetypes.guess_type(nombre)[0] or 'application/octet-stream'
+            self.archivos[con_huella] = (mimetype, huella_bytes(datos), variantes)
+
+    def bytes_en_memoria(self):
+        return sum(len(datos) for _, _, variantes in self.archivos.values() for datos in variantes.values())
+
+_activos = None
+_activos_lock = threading.Lock()
+
+def obtener_activos():
+    global _activos
+    if _activos is None:
+        with _activos_lock:
+            if _activos is None:
+                _activos = ActivosEstaticos(app.static_folder)
+    return _activos
+
+# Los estáticos con huella se sirven precomprimidos desde memoria; los
+# nombres sin huella (enlaces antiguos) siguen sirviéndose desde disco
+def servir_estatico(filename):
+    archivo = obtener_activos().archivos.get(filename)
+    if archivo is None:
+        return app.send_static_file(filename)
+    mimetype, huella, variantes = archivo
+    codificacion = request.accept_encodings.best_match(
+        [c for c in codificaciones_disponibles() if c in variantes])
+    
+    respuesta = app.response_class(variantes[codificacion or 'identity'], mimetype=mimetype)
+    if codificacion:
+        respuesta.headers['Content-Encoding'] = codificacion
+    if len(variantes) > 1:
+        respuesta.vary.add('Accept-Encoding')
+    respuesta.set_etag(f'{huella}-{codificacion}' if codificacion else huella)
+    respuesta.cache_control.public = True
+    respuesta.cache_control.max_age = CACHE_ESTATICOS_SEGUNDOS
+    respuesta.cache_control.immutable = True
+    return respuesta.make_conditional(request)
+
+app.view_functions['static'] = servir_estatico
+
+# Se registra después de _registrar_peticion, así que se ejecuta antes y su
+# tiempo cuenta en la latencia de la petición
+@app.after_request
+def _comprimir_respuesta(respuesta):
+    if (not COMPRESION_RESPUESTAS or respuesta.direct_passthrough or respuesta.is_streamed
+            or 'Content-Encoding' in respuesta.headers or respuesta.mimetype not in TIPOS_COMPRIMIBLES):
+        return respuesta
+    respuesta.vary.add('Accept-Encoding')
+    codificacion = request.accept_encodings.best_match(codificaciones_disponibles())
+    if (codificacion is None or respuesta.status_code != 200
+            or (respuesta.content_length or 0) < MIN_BYTES_COMPRESION):
+        return respuesta
+    
+    cuerpo = respuesta.get_data()
+    if request.endpoint in ENDPOINTS_SIN_CACHE_COMPRESION:
+        comprimido = comprimir_cuerpo(cuerpo, codificacion)
+    else:
+        comprimido = _cache_compresion.obtener(cuerpo, codificacion)
+    metricas.incrementar('iguanas_compresion_bytes_total', 'Bytes de las respuestas comprimidas',
+                         codificacion=codificacion, etapa='original', valor=len(cuerpo))
+    metricas.incrementar('iguanas_compresion_bytes_total', 'Bytes de las respuestas comprimidas',
+                         codificacion=codificacion, etapa='comprimido', valor=len(comprimido))
+    
+    respuesta.set_data(comprimido)
+    respuesta.headers['Content-Encoding'] = codificacion
+    # Con otra codificación el ETag fuerte deja de valer; el débil sigue
+    # sirviendo para las peticiones condicionales de la ruta
+    etag, debil = respuesta.get_etag()
+    if etag and not debil:
+        respuesta.set_etag(etag, weak=True)
+    return respuesta
+
+# Precalentar en el proceso maestro: importar los módulos pesados, cargar el
+# dataset y construir KPIs, figuras e índices de la tabla. Con gunicorn
+# --preload esto ocurre antes del fork y los workers heredan todo por
+# copy-on-write, de modo que ninguno paga una primera petición en frío.
+def precalentar():
+    reporte = {}
+    
+    inicio = time.perf_counter()
+    for modulo in MODULOS_PESADOS:
+        modulo.cargar()
+    reporte['importaciones_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+    
+    inicio = time.perf_counter()
+    df, version = _cache_datos.instantanea()
+    reporte['carga_datos_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+    
+    if df is None or df.empty:
+        reporte['error'] = 'No se pudieron cargar los datos'
+        return reporte
+    
+    inicio = time.perf_counter()
+    obtener_kpis(df, version)
+    # Secuencial a propósito: un pool de hilos creado antes del fork no
+    # sobrevive en los workers
+    for nombre in GRAFICOS:
+        obtener_figura(nombre, df, version)
+    obtener_indice_bitmap(df, version)
+    indice = obtener_indice_tabla(df, version)
+    for columna in indice.columnas:
+        indice.factores(columna)
+    _derivados.obtener(('resumen_tabla',), version, lambda: calcular_resumen_tabla(df))
+    obtener_activos()
+    reporte['calentamiento_ms'] = round((time.perf_counter() - inicio) * 1000, 1)
+    reporte['version'] = version
+    return reporte
+
+# Los workers creados por fork no heredan los hilos del pool de gráficos
+# ni el del notificador de cambios
+def _reiniciar_tras_fork():
+    global _ejecutor_graficos, _ejecutor_lock, _notificador, _activos_lock
+    _ejecutor_graficos = None
+    _ejecutor_lock = threading.Lock()
+    _activos_lock = threading.Lock()
+    _notificador = NotificadorCambios(version_datos)
+
+if hasattr(os, 'register_at_fork'):
+    os.register_at_fork(after_in_child=_reiniciar_tras_fork)
+
+# Arranque de la aplicación (fábrica para gunicorn):
+#   gunicorn --preload "app:crear_app()"
+# Con precargar=True (o PRECARGAR_DATOS=1) precalienta cachés antes de
+# servir y deja el reporte de tiempos en app.config['REPORTE_ARRANQUE'].
+def crear_app(precargar=None):
+    if precargar is None:
+        precargar = os.environ.get('PRECARGAR_DATOS', '1') == '1'
+    
+    reporte = {'importacion_app_ms': _TIEMPO_IMPORTACION_APP_MS}
+    if precargar:
+        reporte.update(precalentar())
+    reporte['modulos_ms'] = dict(TIEMPOS_IMPORTACION)
+    app.config['REPORTE_ARRANQUE'] = reporte
+    
+    logger.info("Reporte de arranque: %s", ' '.join(f'{clave}={valor}' for clave, valor in reporte.items()))
+    return app
+
+_TIEMPO_IMPORTACION_APP_MS = round((time.perf_counter() - _INICIO_IMPORTACION) * 1000, 1)
 
 # Para Despliegue en Railway
 if __name__ == '__main__':
-    app.run(host='0.0.0.0', port=PORT, debug=False)
+    crear_app().run(host='0.0.0.0', port=PORT, debug=False)
@@ -0,0 +1,583 @@
+# Benchmark del dashboard con datasets sintéticos escalados.
+#
+# Genera libros con el mismo esquema que data/especies.xlsx (1k, 100k y 1M
+# filas por defecto), y para cada tamaño mide en un subproceso aparte (para
+# que el pico de RSS sea el de ese tamaño):
+#   - cargar_datos: parseo del Excel, apertura del snapshot y acierto de caché
+#   - calcular_kpis y cada generar_grafico_*
+#   - cada ruta de Flask a través del test client (primera petición y estado
+#     estable: latencias p50/p95/p99, throughput y tamaño de respuesta)
+#
+# Con --memoria compara además los bytes por fila del esquema crudo (texto
+# como objetos, float64) con el esquema compacto del cargador (categorías,
+# float32) y el coste de un filtro y un groupby sobre cada uno.
+#
+# Uso:
+#   python benchmark.py --tamanos 1000,100000 --salida resultados.json
+#   python benchmark.py --salida nuevos.json --base resultados.json
+#   python benchmark.py --tamanos 1000,1000000 --memoria
+#
+# Con --base se comparan los tiempos contra una ejecución anterior y el
+# proceso termina con código 1 si alguna métrica empeora más del umbral.
+#
+# Con --paridad se comprueba que las figuras ligeras (GRAFICOS_LIGEROS)
+# producen el mismo JSON que las de plotly (GRAFICOS_PLOTLY) con el libro
+# real y con cada tamaño sintético (completo y filtrado), y se comparan sus
+# tiempos; termina con código 1 si alguna figura difiere:
+#   python benchmark.py --paridad --tamanos 1000,20000
+#
+# Con --ingesta se compara la lectura del libro con el lector por streaming
+# (leer_xlsx_streaming) frente a read_excel (leer_excel_pandas), con el libro
+# real y cada tamaño sintético, comprobando que el dataset preparado es el
+# mismo; termina con código 1 si alguno difiere:
+#   python benchmark.py --ingesta --tamanos 100000,250000
+#
+# Con --catalogo se reparte cada tamaño sintético en un catálogo de libros
+# (sitio/temporada) y se mide la carga inicial con uno y con todos los
+# procesos, la recarga tras modificar un único libro y los KPIs y figuras de
+# un sitio combinando los agregados de sus libros frente a seleccionar sus
+# filas; termina con código 1 si algún resultado difiere:
+#   python benchmark.py --catalogo --tamanos 100000,1000000
+#
+# Con --estadisticas se comprueban las pruebas de /api/estadisticas con casos
+# de respuesta conocida: el mismo efecto del sexo en cada edad (con distinta
+# proporción de sexos por edad) debe rechazar la nula global, y un peso que
+# solo depende de la edad no debe rechazarla; termina con código 1 si alguno
+# falla:
+#   python benchmark.py --estadisticas --tamanos 2000,20000
+import argparse
+import contextlib
+import io
+import json
+import os
+import platform
+import resource
+import shutil
+import subprocess
+import sys
+import tempfile
+import time
+
+import numpy as np
+import pandas as pd
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+DIR_DATOS_BENCH = os.path.join(BASE_DIR, 'data', '.benchmark')
+
+# Rutas medidas con el test client
+RUTAS = [
+    '/',
+    '/dashboard',
+    '/graficos',
+    '/api/kpis',
+    '/api/kpis?sexo=Macho&edad=Adulto,Juvenil&peso_min=1',
+    '/tabla-datos',
+    '/api/datos?length=25&orden=-Peso_Kg',
+    '/api/datos?length=25&Sexo=Macho&buscar=adulto',
+    '/api/graficos/pesos',
+    '/api/graficos/temporal',
+    '/api/temporal?freq=W&por=Sexo',
+    '/api/estadisticas',
+]
+
+EDADES = ['Adulto', 'Subadulto', 'Juvenil']
+SEXOS = ['Macho', 'Hembra']
+
+# Dataset sintético con el esquema (y los espacios en los encabezados) del
+# libro original
+def generar_dataset_sintetico(n, semilla=0):
+    rng = np.random.default_rng(semilla)
+    edad = rng.choice(EDADES, n, p=[0.6, 0.3, 0.1])
+    sexo = rng.choice(SEXOS, n, p=[0.58, 0.42])
+    # Pesos por edad en el rango observado (0.235 - 6.5 kg)
+    media = np.select([edad == 'Adulto', edad == 'Subadulto'], [2.6, 1.2], 0.6)
+    media = media * np.where(sexo == 'Macho', 1.25, 1.0)
+    peso = np.clip(rng.gamma(4.0, media / 4.0), 0.235, 6.5).round(3)
+    fechas = pd.Timestamp('2025-09-26') + pd.to_timedelta(rng.integers(0, 60, n), unit='D')
+    cni = np.array([f'37RE{252015 + i}' for i in range(n)], dtype=object)
+    # Algunos individuos sin CNI, como en el libro real
+    cni[rng.random(n) < 0.04] = None
+
+    return pd.DataFrame({
+        'Individuos': np.arange(1, n + 1),
+        'Fecha_entrga_CAV': fechas,
+        'Nombre_comun ': 'Iguana ',
+        'Nombre_científico ': 'Iguana iguana ',
+        'Peso_Kg': peso,
+        'Edad': edad,
+        'Sexo': sexo,
+        'CNI': cni,
+        'Estado_Conservación': 'Preocupación Menor  (LC)',
+    })
+
+# Escribir el libro en modo write_only (memoria constante)
+def escribir_xlsx(df, ruta):
+    from openpyxl import Workbook
+
+    libro = Workbook(write_only=True)
+    hoja = libro.create_sheet('Datos')
+    hoja.append(list(df.columns))
+    columnas = [df[c].to_numpy(dtype=object) for c in df.columns]
+    for fila in zip(*columnas):
+        hoja.append([None if (v is None or v != v) else v for v in fila])
+    tmp = ruta + '.tmp'
+    libro.save(tmp)
+    os.replace(tmp, ruta)
+
+# Libro sintético de n filas (se reutiliza entre ejecuciones)
+def libro_sintetico(n, semilla=0, directorio=DIR_DATOS_BENCH):
+    os.makedirs(directorio, exist_ok=True)
+    ruta = os.path.join(directorio, f'especies_{n}_{semilla}.xlsx')
+    if not os.path.exists(ruta):
+        inicio = time.perf_counter()
+        escribir_xlsx(generar_dataset_sintetico(n, semilla), ruta)
+        print(f'  libro de {n} filas generado en {time.perf_counter() - inicio:.1f}s', file=sys.stderr)
+    return ruta
+
+def percentiles(muestras_ms):
+    arr = np.asarray(muestras_ms, dtype=float)
+    return {
+        'p50_ms': round(float(np.percentile(arr, 50)), 3),
+        'p95_ms': round(float(np.percentile(arr, 95)), 3),
+        'p99_ms': round(float(np.percentile(arr, 99)), 3),
+        'media_ms': round(float(arr.mean()), 3),
+    }
+
+def cronometrar(funcion, repeticiones):
+    muestras = []
+    resultado = None
+    for _ in range(repeticiones):
+        inicio = time.perf_counter()
+        resultado = funcion()
+        muestras.append((time.perf_counter() - inicio) * 1000)
+    return muestras, resultado
+
+def rss_pico_mb():
+    # ru_maxrss está en KB en Linux y en bytes en macOS
+    pico = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    return round(pico / (1024 * 1024 if sys.platform == 'darwin' else 1024), 1)
+
+# Medición de un tamaño (se ejecuta en un subproceso)
+def medir_tamano(n, repeticiones, semilla=0):
+    ruta = libro_sintetico(n, semilla)
+    directorio_snapshots = tempfile.mkdtemp(prefix='snapshots-', dir=DIR_DATOS_BENCH)
+    os.environ['RUTA_DATOS'] = ruta
+    os.environ['DIR_SNAPSHOTS'] = directorio_snapshots
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    os.environ['PRECARGAR_DATOS'] = '0'
+    sys.path.insert(0, BASE_DIR)
+    import app as aplicacion
+
+    resultado = {'filas': n, 'etapas': {}, 'rutas': {}}
+    etapas = resultado['etapas']
+
+    # Carga: parseo completo, snapshot mapeado y acierto de caché
+    inicio = time.perf_counter()
+    df = aplicacion.leer_excel(ruta)
+    etapas['cargar_datos.parseo_excel'] = percentiles([(time.perf_counter() - inicio) * 1000])
+    version = aplicacion.calcular_hash_archivo(ruta)
+    aplicacion.escribir_snapshot(df, version, directorio_snapshots)
+    muestras, _ = cronometrar(lambda: aplicacion.abrir_snapshot(version, directorio_snapshots), max(3, repeticiones // 4))
+    etapas['cargar_datos.snapshot_mmap'] = percentiles(muestras)
+    aplicacion.cargar_datos()
+    muestras, df = cronometrar(aplicacion.cargar_datos, repeticiones)
+    etapas['cargar_datos.cache'] = percentiles(muestras)
+    resultado['bytes_por_fila'] = round(df.memory_usage(deep=True).sum() / n, 1)
+
+    muestras, _ = cronometrar(lambda: aplicacion.calcular_kpis(df), repeticiones)
+    etapas['calcular_kpis'] = percentiles(muestras)
+
+    for nombre, generador in aplicacion.GRAFICOS.items():
+        muestras, figura = cronometrar(lambda: generador(df), max(3, repeticiones // 4))
+        etapas[f'generar_grafico_{nombre}'] = percentiles(muestras)
+        etapas[f'generar_grafico_{nombre}']['bytes'] = len(figura or '')
+
+    # Rutas: primera petición (cachés derivadas vacías) y estado estable
+    cliente = aplicacion.app.test_client()
+    for ruta_http in RUTAS:
+        aplicacion._derivados = aplicacion.CacheDerivados()
+        inicio = time.perf_counter()
+        respuesta = cliente.get(ruta_http)
+        primera_ms = (time.perf_counter() - inicio) * 1000
+
+        inicio_total = time.perf_counter()
+        muestras, respuesta = cronometrar(lambda: cliente.get(ruta_http), repeticiones)
+        total_s = time.perf_counter() - inicio_total
+
+        metricas = percentiles(muestras)
+        metricas.update({
+            'estado': respuesta.status_code,
+            'primera_ms': round(primera_ms, 3),
+            'peticiones_por_s': round(repeticiones / total_s, 1),
+            'bytes': len(respuesta.get_data()),
+        })
+        resultado['rutas'][ruta_http] = metricas
+
+    resultado['rss_pico_mb'] = rss_pico_mb()
+    return resultado
+
+# Memoria del dataset antes y después de compactar el esquema
+def informe_memoria(n, repeticiones, semilla=0):
+    sys.path.insert(0, BASE_DIR)
+    import app as aplicacion
+
+    crudo = generar_dataset_sintetico(n, semilla)
+    crudo.columns = crudo.columns.str.strip()
+    inicio = time.perf_counter()
+    compacto = aplicacion.compactar_dataset(crudo.copy())
+    compactar_ms = (time.perf_counter() - inicio) * 1000
+
+    informe = {'filas': n, 'compactar_ms': round(compactar_ms, 1), 'columnas': {}}
+    for nombre, df in (('crudo', crudo), ('compacto', compacto)):
+        bytes_columnas = df.memory_usage(deep=True, index=False)
+        informe[nombre] = {
+            'bytes': int(bytes_columnas.sum()),
+            'bytes_por_fila': round(bytes_columnas.sum() / n, 1),
+            'filtro_sexo': percentiles(cronometrar(lambda: df[df['Sexo'] == 'Macho'], repeticiones)[0]),
+            'groupby_edad_sexo': percentiles(cronometrar(
+                lambda: df.groupby(['Edad', 'Sexo'], observed=True)['Peso_Kg'].mean(), repeticiones)[0]),
+        }
+        for columna, valor in bytes_columnas.items():
+            informe['columnas'].setdefault(columna, {})[nombre] = round(valor / n, 1)
+    return informe
+
+def imprimir_memoria(informes):
+    for tamano, informe in informes.items():
+        crudo, compacto = informe['crudo'], informe['compacto']
+        print(f'\n=== Memoria con {int(tamano):,} filas (compactar: {informe["compactar_ms"]} ms) ===')
+        print(f'  {"columna":24s} {"crudo B/fila":>13s} {"compacto B/fila":>16s}')
+        for columna, valores in informe['columnas'].items():
+            print(f'  {columna:24s} {valores["crudo"]:13.1f} {valores["compacto"]:16.1f}')
+        print(f'  {"TOTAL":24s} {crudo["bytes_por_fila"]:13.1f} {compacto["bytes_por_fila"]:16.1f}'
+              f'   ({crudo["bytes"] / max(compacto["bytes"], 1):.1f}x menos)')
+        for medida in ('filtro_sexo', 'groupby_edad_sexo'):
+            print(f'  {medida:24s} {crudo[medida]["p50_ms"]:10.2f} ms {compacto[medida]["p50_ms"]:13.2f} ms')
+
+# Rutas (p. ej. 'data[0].x[3]') en las que difieren dos JSON ya parseados;
+# los números se comparan con tolerancia relativa
+def diferencias_json(a, b, ruta='', tolerancia=1e-9):
+    if isinstance(a, dict) and isinstance(b, dict):
+        diferencias = [f'{ruta}.{clave}' for clave in a.keys() ^ b.keys()]
+        for clave in a.keys() & b.keys():
+            diferencias += diferencias_json(a[clave], b[clave], f'{ruta}.{clave}', tolerancia)
+        return diferencias
+    if isinstance(a, list) and isinstance(b, list):
+        if len(a) != len(b):
+            return [f'{ruta} (longitud {len(a)} != {len(b)})']
+        diferencias = []
+        for i, (x, y) in enumerate(zip(a, b)):
+            diferencias += diferencias_json(x, y, f'{ruta}[{i}]', tolerancia)
+        return diferencias
+    numeros = (int, float)
+    if isinstance(a, numeros) and isinstance(b, numeros) and not isinstance(a, bool) and not isinstance(b, bool):
+        return [] if abs(a - b) <= tolerancia * max(1.0, abs(a), abs(b)) else [ruta]
+    return [] if a == b else [ruta]
+
+# Paridad y tiempos de las figuras ligeras frente a las de plotly
+def comprobar_paridad(tamanos, repeticiones, semilla=0):
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    sys.path.insert(0, BASE_DIR)
+    import app as aplicacion
+
+    conjuntos = [('libro', aplicacion.leer_archivo(aplicacion.RUTA_DATOS))]
+    for n in tamanos:
+        df = aplicacion.preparar_dataset(generar_dataset_sintetico(n, semilla))
+        conjuntos.append((f'{n:,} filas', df))
+        conjuntos.append((f'{n:,} filas, Hembra', df[df['Sexo'] == 'Hembra']))
+
+    informe, fallos = [], 0
+    for etiqueta, df in conjuntos:
+        for nombre, ligero in aplicacion.GRAFICOS_LIGEROS.items():
+            plotly = aplicacion.GRAFICOS_PLOTLY[nombre]
+            muestras_plotly, esperado = cronometrar(lambda: plotly(df), max(3, repeticiones // 4))
+            muestras_ligero, obtenido = cronometrar(lambda: ligero(df), max(3, repeticiones // 4))
+            diferencias = diferencias_json(json.loads(esperado), json.loads(obtenido))
+            fallos += bool(diferencias)
+            informe.append((etiqueta, nombre, percentiles(muestras_plotly)['p50_ms'],
+                            percentiles(muestras_ligero)['p50_ms'], diferencias))
+
+    print(f'{"datos":24s} {"figura":12s} {"plotly":>10s} {"ligera":>10s}  paridad')
+    for etiqueta, nombre, ms_plotly, ms_ligero, diferencias in informe:
+        estado = 'ok' if not diferencias else f'DIFIERE en {len(diferencias)}: {", ".join(diferencias[:5])}'
+        print(f'{etiqueta:24s} {nombre:12s} {ms_plotly:8.2f}ms {ms_ligero:8.2f}ms  {estado}')
+    return fallos
+
+# Casos de respuesta conocida para la prueba global de dimorfismo: la
+# proporción de machos cambia mucho entre edades y el peso depende de la
+# edad, así que una diferencia de medias agregadas sería engañosa
+def comprobar_estadisticas(tamanos, repeticiones, semilla=0):
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    sys.path.insert(0, BASE_DIR)
+    import app as aplicacion
+
+    proporcion_machos = {'Adulto': 0.85, 'Subadulto': 0.5, 'Juvenil': 0.15}
+    media_edad = {'Adulto': 2.6, 'Subadulto': 1.2, 'Juvenil': 0.6}
+    # (nombre, efecto Macho - Hembra en kg dentro de cada edad, ¿debe rechazar?)
+    casos = [('sin efecto', 0.0, False), ('hembras +0.1 kg', -0.1, True), ('machos +0.1 kg', 0.1, True)]
+    remuestreos = max(1000, repeticiones * 100)
+
+    informe, fallos = [], 0
+    for n in tamanos:
+        for nombre, efecto, rechaza in casos:
+            # Sexo y peso con su propio generador, independiente del de las edades
+            rng = np.random.default_rng([semilla, n])
+            df = generar_dataset_sintetico(n, semilla)
+            edad = df['Edad'].to_numpy()
+            sexo = np.where(rng.random(n) < pd.Series(edad).map(proporcion_machos).to_numpy(), 'Macho', 'Hembra')
+            media = pd.Series(edad).map(media_edad).to_numpy() + np.where(sexo == 'Macho', efecto / 2, -efecto / 2)
+            df['Sexo'] = sexo
+            df['Peso_Kg'] = np.clip(rng.normal(media, 0.3), 0.235, 6.5).round(3)
+            resumen = aplicacion.ResumenParcial.desde_df(aplicacion.preparar_dataset(df))
+            dimorfismo = aplicacion.calcular_estadisticas(resumen, remuestreos, 0.95, semilla)['dimorfismo']
+            p_valor, diferencia = dimorfismo['p_valor'], dimorfismo['diferencia']
+            correcto = (p_valor < 0.01 and np.sign(diferencia) == np.sign(efecto)) if rechaza else p_valor > 0.01
+            fallos += not correcto
+            informe.append((f'{n:,} filas', nombre, diferencia, p_valor, correcto))
+
+    print(f'{"datos":16s} {"caso":18s} {"diferencia":>11s} {"p_valor":>9s}  resultado')
+    for etiqueta, nombre, diferencia, p_valor, correcto in informe:
+        print(f'{etiqueta:16s} {nombre:18s} {diferencia:11.4f} {p_valor:9.4f}  {"ok" if correcto else "FALLA"}')
+    return fallos
+
+# Lectura del libro con cada lector: tiempos y paridad del dataset preparado
+def comparar_ingesta(tamanos, repeticiones, semilla=0):
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    sys.path.insert(0, BASE_DIR)
+    import app as aplicacion
+
+    libros = [('libro', aplicacion.RUTA_DATOS, repeticiones)]
+    # read_excel tarda decenas de segundos con 100k filas: una sola medición
+    libros += [(f'{n:,} filas', libro_sintetico(n, semilla), max(1, repeticiones // 20)) for n in tamanos]
+
+    informe, fallos = [], 0
+    for etiqueta, ruta, veces in libros:
+        muestras_pandas, esperado = cronometrar(lambda: aplicacion.leer_excel_pandas(ruta), veces)
+        muestras_streaming, obtenido = cronometrar(lambda: aplicacion.leer_xlsx_streaming(ruta), veces)
+        try:
+            pd.testing.assert_frame_equal(aplicacion.preparar_dataset(esperado),
+                                          aplicacion.preparar_dataset(obtenido))
+            diferencia = None
+        except AssertionError as e:
+            diferencia = str(e).strip().splitlines()[0]
+            fallos += 1
+        informe.append((etiqueta, len(obtenido), os.path.getsize(ruta), percentiles(muestras_pandas)['p50_ms'],
+                        percentiles(muestras_streaming)['p50_ms'], diferencia))
+
+    print(f'{"libro":16s} {"filas":>9s} {"MB":>7s} {"read_excel":>12s} {"streaming":>12s} {"mejora":>7s}  paridad')
+    for etiqueta, filas, tamano, ms_pandas, ms_streaming, diferencia in informe:
+        print(f'{etiqueta:16s} {filas:9,d} {tamano / 2**20:7.1f} {ms_pandas:10.1f}ms {ms_streaming:10.1f}ms '
+              f'{ms_pandas / ms_streaming:6.1f}x  {diferencia or "ok"}')
+    return fallos
+
+# Catálogo de libros: carga en paralelo, recarga incremental y subconjuntos
+# por sitio con agregados parciales frente a filas seleccionadas
+SITIOS_BENCH = ['norte', 'sur', 'este', 'oeste']
+TEMPORADAS_BENCH = ['2023', '2024', '2025']
+
+def catalogo_sintetico(n, semilla=0, directorio=DIR_DATOS_BENCH):
+    destino = os.path.join(directorio, f'catalogo_{n}_{semilla}')
+    libros = [(sitio, temporada) for sitio in SITIOS_BENCH for temporada in TEMPORADAS_BENCH]
+    if not os.path.isdir(destino):
+        df = generar_dataset_sintetico(n, semilla)
+        for i, (sitio, temporada) in enumerate(libros):
+            os.makedirs(os.path.join(destino, sitio), exist_ok=True)
+            escribir_xlsx(df.iloc[i::len(libros)], os.path.join(destino, sitio, f'{temporada}.xlsx'))
+    return destino
+
+def comparar_catalogo(tamanos, repeticiones, semilla=0):
+    os.environ.setdefault('LOG_LEVEL', 'WARNING')
+    sys.path.insert(0, BASE_DIR)
+    import app as aplicacion
+    aplicacion.GRAFICOS_AGREGADOS = '1'
+
+    informe, fallos = [], 0
+    for n in tamanos:
+        directorio = catalogo_sintetico(n, semilla)
+        with tempfile.TemporaryDirectory() as tmp:
+            def cache(workers, snapshots):
+                # Sin intervalo entre comprobaciones: la recarga se mide justo tras el cambio
+                fuente = aplicacion.FuenteCatalogo(catalogo, workers=workers, dir_snapshots=snapshots, intervalo=0)
+                return aplicacion.CacheDatos(fuente, ruta_capturas=os.path.join(tmp, 'capturas.jsonl'))
+
+            # Copia de trabajo: la recarga modifica uno de los libros
+            catalogo = os.path.join(tmp, 'catalogo')
+            shutil.copytree(directorio, catalogo)
+
+            # Carga en frío (sin snapshots) con un proceso y con todos
+            tiempos = {}
+            for workers in sorted({1, os.cpu_count() or 1}):
+                inicio = time.perf_counter()
+                datos = cache(workers, os.path.join(tmp, f'snapshots-{workers}'))
+                datos.instantanea()
+                tiempos[workers] = (time.perf_counter() - inicio) * 1000
+
+            # Recarga tras reescribir un libro (sin su última fila): solo se parsea ese
+            ruta = os.path.join(catalogo, SITIOS_BENCH[0], f'{TEMPORADAS_BENCH[0]}.xlsx')
+            escribir_xlsx(pd.read_excel(ruta).iloc[:-1], ruta)
+            inicio = time.perf_counter()
+            df, version = datos.instantanea()
+            recarga = (time.perf_counter() - inicio) * 1000
+
+            # Un sitio: agregados de sus libros frente a sus filas
+            sitio = (SITIOS_BENCH[0],)
+            posiciones = np.flatnonzero(df['Sitio'].to_numpy() == sitio[0])
+
+            def por_agregados():
+                resumen = datos.fuente.resumen(sitio)
+                return resumen.a_kpis(), {nombre: generar(resumen)
+                                          for nombre, generar in aplicacion.GRAFICOS_LIGEROS.items()}
+
+            def por_filas():
+                subconjunto = df.take(posiciones)
+                return aplicacion.calcular_kpis(subconjunto), {nombre: generar(subconjunto)
+                                                               for nombre, generar in aplicacion.GRAFICOS_LIGEROS.items()}
+
+            muestras_agregados, (kpis_a, figuras_a) = cronometrar(por_agregados, repeticiones)
+            muestras_filas, (kpis_f, figuras_f) = cronometrar(por_filas, repeticiones)
+            diferencias = [] if kpis_a == kpis_f else ['kpis']
+            for nombre in figuras_a:
+                if diferencias_json(json.loads(figuras_a[nombre]), json.loads(figuras_f[nombre])):
+                    diferencias.append(nombre)
+            fallos += bool(diferencias)
+            informe.append((n, len(datos.fuente._libros), tiempos, recarga,
+                            percentiles(muestras_filas)['p50_ms'], percentiles(muestras_agregados)['p50_ms'],
+                            diferencias))
+
+    procesos = os.cpu_count() or 1
+    print(f'{"filas":>10s} {"libros":>6s} {"carga 1p":>10s} {f"carga {procesos}p":>10s} {"recarga":>10s} '
+          f'{"sitio filas":>12s} {"sitio agreg.":>12s}  paridad')
+    for n, libros, tiempos, recarga, ms_filas, ms_agregados, diferencias in informe:
+        estado = 'ok' if not diferencias else f'DIFIERE en {", ".join(diferencias)}'
+        print(f'{n:10,d} {libros:6d} {tiempos[1]:8.0f}ms {tiempos[procesos]:8.0f}ms {recarga:8.0f}ms '
+              f'{ms_filas:10.2f}ms {ms_agregados:10.2f}ms  {estado}')
+    return fallos
+
+# Comparar contra una ejecución base: devuelve las métricas que empeoran
+def comparar(actual, base, umbral):
+    regresiones = []
+    for tamano, datos in actual['tamanos'].items():
+        datos_base = base.get('tamanos', {}).get(tamano)
+        if not datos_base:
+            continue
+        for grupo in ('etapas', 'rutas'):
+            for nombre, metricas in datos[grupo].items():
+                previas = datos_base.get(grupo, {}).get(nombre)
+                if not previas:
+                    continue
+                for clave in ('p50_ms', 'p95_ms', 'bytes'):
+                    antes, ahora = previas.get(clave), metricas.get(clave)
+                    if not antes or ahora is None:
+                        continue
+                    cambio = (ahora - antes) / antes
+                    # Ignorar ruido por debajo de 1 ms
+                    if cambio > umbral and (clave == 'bytes' or ahora - antes > 1):
+                        regresiones.append((tamano, grupo, nombre, clave, antes, ahora, cambio))
+        antes, ahora = datos_base.get('rss_pico_mb'), datos.get('rss_pico_mb')
+        if antes and ahora and (ahora - antes) / antes > umbral:
+            regresiones.append((tamano, '-', 'rss_pico_mb', 'mb', antes, ahora, (ahora - antes) / antes))
+    return regresiones
+
+def imprimir_resumen(resultados):
+    for tamano, datos in resultados['tamanos'].items():
+        print(f'\n=== {int(tamano):,} filas (RSS pico {datos["rss_pico_mb"]} MB, '
+              f'{datos.get("bytes_por_fila", "?")} B/fila) ===')
+        for nombre, m in datos['etapas'].items():
+            print(f'  {nombre:38s} p50 {m["p50_ms"]:10.2f} ms  p95 {m["p95_ms"]:10.2f} ms')
+        for nombre, m in datos['rutas'].items():
+            print(f'  {nombre:38s} p50 {m["p50_ms"]:8.2f} ms  p99 {m["p99_ms"]:8.2f} ms  '
+                  f'1ª {m["primera_ms"]:9.1f} ms  {m["peticiones_por_s"]:8.1f} req/s  {m["bytes"]:>9,} B')
+
+def main():
+    parser = argparse.ArgumentParser(description='Benchmark del dashboard de iguanas')
+    parser.add_argument('--tamanos', default='1000,100000,1000000',
+                        help='Filas de cada dataset sintético, separadas por comas')
+    parser.add_argument('--repeticiones', type=int, default=20)
+    parser.add_argument('--salida', help='Archivo JSON donde guardar los resultados')
+    parser.add_argument('--base', help='Resultados anteriores contra los que comparar')
+    parser.add_argument('--umbral', type=float, default=0.10,
+                        help='Empeoramiento relativo que cuenta como regresión (0.10 = 10%%)')
+    parser.add_argument('--memoria', action='store_true',
+                        help='Informe de bytes por fila del esquema crudo frente al compacto')
+    parser.add_argument('--paridad', action='store_true',
+                        help='Comprobar que las figuras ligeras coinciden con las de plotly')
+    parser.add_argument('--ingesta', action='store_true',
+                        help='Comparar el lector de xlsx por streaming con read_excel')
+    parser.add_argument('--catalogo', action='store_true',
+                        help='Medir el catálogo de libros: carga paralela, recarga y subconjuntos')
+    parser.add_argument('--estadisticas', action='store_true',
+                        help='Comprobar la prueba de dimorfismo con casos de respuesta conocida')
+    parser.add_argument('--solo-tamano', type=int, help=argparse.SUPPRESS)
+    args = parser.parse_args()
+
+    if args.paridad:
+        fallos = comprobar_paridad([int(t) for t in args.tamanos.split(',') if t], args.repeticiones)
+        print(f'\n{fallos} figuras con diferencias' if fallos else '\nTodas las figuras coinciden')
+        return 1 if fallos else 0
+
+    if args.ingesta:
+        fallos = comparar_ingesta([int(t) for t in args.tamanos.split(',') if t], args.repeticiones)
+        print(f'\n{fallos} libros con diferencias' if fallos else '\nAmbos lectores producen el mismo dataset')
+        return 1 if fallos else 0
+
+    if args.catalogo:
+        fallos = comparar_catalogo([int(t) for t in args.tamanos.split(',') if t], args.repeticiones)
+        print(f'\n{fallos} catálogos con diferencias' if fallos else '\nAgregados y filas dan el mismo resultado')
+        return 1 if fallos else 0
+
+    if args.estadisticas:
+        fallos = comprobar_estadisticas([int(t) for t in args.tamanos.split(',') if t], args.repeticiones)
+        print(f'\n{fallos} casos incorrectos' if fallos else '\nLas pruebas dan la respuesta esperada')
+        return 1 if fallos else 0
+
+    # Modo subproceso: medir un tamaño y escribir el JSON por stdout
+    if args.solo_tamano:
+        with contextlib.redirect_stdout(io.StringIO()):
+            resultado = medir_tamano(args.solo_tamano, args.repeticiones)
+        print(json.dumps(resultado))
+        return 0
+
+    resultados = {
+        'fecha': time.strftime('%Y-%m-%dT%H:%M:%S'),
+        'python': platform.python_version(),
+        'pandas': pd.__version__,
+        'numpy': np.__version__,
+        'cpus': os.cpu_count(),
+        'repeticiones': args.repeticiones,
+        'tamanos': {},
+    }
+    for tamano in [int(t) for t in args.tamanos.split(',') if t]:
+        print(f'Midiendo {tamano:,} filas...', file=sys.stderr)
+        salida = subprocess.run(
+            [sys.executable, __file__, '--solo-tamano', str(tamano), '--repeticiones', str(args.repeticiones)],
+            check=True, capture_output=True, text=True
+        )
+        resultados['tamanos'][str(tamano)] = json.loads(salida.stdout.strip().splitlines()[-1])
+
+    imprimir_resumen(resultados)
+
+    if args.memoria:
+        resultados['memoria'] = {}
+        for tamano in [int(t) for t in args.tamanos.split(',') if t]:
+            with contextlib.redirect_stdout(io.StringIO()):
+                resultados['memoria'][str(tamano)] = informe_memoria(tamano, args.repeticiones)
+        imprimir_memoria(resultados['memoria'])
+
+    if args.salida:
+        with open(args.salida, 'w', encoding='utf-8') as f:
+            json.dump(resultados, f, indent=2, ensure_ascii=False)
+        print(f'\nResultados guardados en {args.salida}')
+
+    if args.base:
+        with open(args.base, encoding='utf-8') as f:
+            base = json.load(f)
+        regresiones = comparar(resultados, base, args.umbral)
+        if regresiones:
+            print(f'\n{len(regresiones)} regresiones respecto a {args.base}:')
+            for tamano, grupo, nombre, clave, antes, ahora, cambio in regresiones:
+                print(f'  [{tamano}] {nombre} {clave}: {antes} -> {ahora} (+{cambio:.0%})')
+            return 1
+        print(f'\nSin regresiones respecto a {args.base}')
+    return 0
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,17 @@
+# Configuración de gunicorn (se lee sola al arrancar desde este directorio).
+# /api/kpis/stream mantiene abierta la conexión de cada dashboard hasta
+# DURACION_MAXIMA_SSE segundos: con workers síncronos cada espectador
+# bloquearía un worker entero, así que se usan hilos y cada conexión ocupa
+# solo uno de ellos.
+import os
+
+bind = f"0.0.0.0:{os.environ.get('PORT', 8080)}"
+preload_app = True
+worker_class = 'gthread'
+workers = int(os.environ.get('WEB_CONCURRENCY', 2))
+threads = int(os.environ.get('GUNICORN_THREADS', 32))
+# Los streams SSE envían un latido cada LATIDO_SSE segundos; el timeout
+# solo vigila que el worker siga vivo, no la duración de las peticiones
+timeout = 60
+graceful_timeout = 10
+keepalive = 5
@@ -40,15 +40,45 @@ function inicializarEventListeners() {
 
 // Configurar actualización automática
 function configurarAutoRefresh() {
-    // Actualizar cada 60 segundos si estamos en dashboard
-    if (window.location.pathname.includes('/dashboard')) {
+    if (!window.location.pathname.includes('/dashboard')) return;
+    
+    // El servidor empuja los KPIs por SSE solo cuando cambian los datos;
+    // sin EventSource (o en el sitio estático) se consulta la API cada 60 segundos
+    if (window.SITIO_ESTATICO || !('EventSource' in window)) {
         setInterval(actualizarKPIs, 60000);
+        return;
     }
+    
+    let kpisActuales = null;
+    const fuente = new EventSource('/api/kpis/stream' + window.location.search);
+    
+    fuente.addEventListener('kpis', event => {
+        const primera = kpisActuales === null;
+        kpisActuales = JSON.parse(event.data).kpis;
+        actualizarElementosKPIs(kpisActuales);
+        if (!primera) mostrarNotificacion('KPIs actualizados', 'success');
+    });
+    
+    fuente.addEventListener('delta', event => {
+        if (kpisActuales === null) return;
+        Object.assign(kpisActuales, JSON.parse(event.data).cambios);
+        actualizarElementosKPIs(kpisActuales);
+        mostrarNotificacion('KPIs actualizados', 'success');
+    });
+    
+    // EventSource reconecta solo (enviando Last-Event-ID); si el servidor
+    // rechaza la conexión se vuelve a la consulta periódica
+    fuente.onerror = () => {
+        if (fuente.readyState === EventSource.CLOSED) {
+            setInterval(actualizarKPIs, 60000);
+        }
+    };
 }
 
 // Actualizar KPIs desde API
 function actualizarKPIs() {
-    fetch('/api/kpis')
+    // Con los mismos filtros que la página (?sexo=...&desde=...)
+    fetch('/api/kpis' + window.location.search)
         .then(response => {
             if (!response.ok) {
                 throw new Error('Error en la respuesta de la API');
@@ -92,77 +122,82 @@ function actualizarElementosKPIs(data) {
     });
 }
 
-// Exportar datos
-function exportarDatos(format) {
-    fetch('/api/datos')
-        .then(response => response.json())
-        .then(data => {
-            if (data.error) {
-                mostrarNotificacion(data.error, 'error');
-                return;
-            }
-            
-            switch(format) {
-                case 'json':
-                    exportarJSON(data);
-                    break;
-                case 'csv':
-                    exportarCSV(data);
-                    break;
-                default:
-                    mostrarNotificacion('Formato no soportado', 'warning');
-            }
-        })
-        .catch(error => {
-            console.error('Error exportando datos:', error);
-            mostrarNotificacion('Error exportando datos', 'error');
-        });
-}
+// Exportar datos: el servidor genera el archivo en streaming
+const FORMATOS_EXPORTACION = { json: 'ndjson', ndjson: 'ndjson', csv: 'csv', xlsx: 'xlsx' };
 
-function exportarJSON(data) {
-    const dataStr = JSON.stringify(data, null, 2);
-    const dataUri = 'data:application/json;charset=utf-8,' + encodeURIComponent(dataStr);
-    const exportFileDefaultName = 'iguana_datos_' + new Date().toISOString().split('T')[0] + '.json';
-    
-    const linkElement = document.createElement('a');
-    linkElement.setAttribute('href', dataUri);
-    linkElement.setAttribute('download', exportFileDefaultName);
-    document.body.appendChild(linkElement);
-    linkElement.click();
-    document.body.removeChild(linkElement);
-    
-    mostrarNotificacion('Datos exportados como JSON', 'success');
-}
-
-function exportarCSV(data) {
-    // Convertir datos a CSV
-    const headers = ['Individuo', 'Peso (kg)', 'Edad', 'Sexo', 'Fecha'];
-    const rows = data.datos.map(item => [
-        item.Individuos || '',
-        item.Peso_Kg || '',
-        item.Edad || '',
-        item.Sexo || '',
-        item.Fecha_entrga_CAV || ''
-    ]);
-    
-    const csvContent = [
-        headers.join(','),
-        ...rows.map(row => row.map(cell => `"${cell}"`).join(','))
-    ].join('\n');
+function exportarDatos(format, parametros) {
+    const formato = FORMATOS_EXPORTACION[format];
+    if (!formato) {
+        mostrarNotificacion('Formato no soportado', 'warning');
+        return;
+    }
     
-    const blob = new Blob([csvContent], { type: 'text/csv;charset=utf-8;' });
+    const consulta = parametros ? '?' + parametros.toString() : '';
     const link = document.createElement('a');
-    const url = URL.createObjectURL(blob);
-    
-    link.setAttribute('href', url);
-    link.setAttribute('download', 'iguana_datos_' + new Date().toISOString().split('T')[0] + '.csv');
+    if (window.SITIO_ESTATICO) {
+        // El sitio estático solo tiene la exportación completa, sin filtros
+        link.setAttribute('href', `/api/exportar/iguana_datos.${formato}`);
+        link.setAttribute('download', `iguana_datos.${formato}`);
+    } else {
+        link.setAttribute('href', `/api/exportar/${formato}${consulta}`);
+    }
     link.style.visibility = 'hidden';
     
     document.body.appendChild(link);
     link.click();
     document.body.removeChild(link);
     
-    mostrarNotificacion('Datos exportados como CSV', 'success');
+    mostrarNotificacion(`Exportando datos como ${formato.toUpperCase()}`, 'success');
+}
+
+// Dibujar un gráfico Plotly. Si la figura no viene incrustada en la página
+// se pide a /api/graficos/<nombre> (con los filtros de la página) cuando el
+// contenedor se hace visible; el navegador revalida con ETag y recibe 304
+// si los datos no han cambiado.
+function dibujarGrafico(idContenedor, nombre, figura) {
+    const contenedor = document.getElementById(idContenedor);
+    if (!contenedor) return;
+    
+    if (figura && figura.data) {
+        try {
+            Plotly.newPlot(contenedor, figura.data, figura.layout);
+        } catch (error) {
+            console.error(`Error cargando gráfico ${nombre}:`, error);
+        }
+        return;
+    }
+    
+    const cargar = () => {
+        fetch(`/api/graficos/${nombre}${window.location.search}`)
+            .then(response => {
+                if (!response.ok) {
+                    throw new Error('Error en la respuesta de la API');
+                }
+                return response.json();
+            })
+            .then(datos => {
+                if (datos.data) {
+                    Plotly.newPlot(contenedor, datos.data, datos.layout);
+                }
+            })
+            .catch(error => {
+                console.error(`Error cargando gráfico ${nombre}:`, error);
+                contenedor.innerHTML = '<div class="alert alert-warning">No se pudo cargar el gráfico</div>';
+            });
+    };
+    
+    if (!('IntersectionObserver' in window)) {
+        cargar();
+        return;
+    }
+    
+    const observer = new IntersectionObserver((entries) => {
+        if (entries.some(entry => entry.isIntersecting)) {
+            observer.disconnect();
+            cargar();
+        }
+    }, { rootMargin: '200px 0px' });
+    observer.observe(contenedor);
 }
 
 // Descargar gráfico como imagen
@@ -0,0 +1,54 @@
+# Paridad de las figuras ligeras (GRAFICOS_LIGEROS) con las de plotly
+# (GRAFICOS_PLOTLY): mismas trazas y mismo layout con el libro incluido y
+# con un dataset sintético con categorías vacías, nulos y grupos ausentes.
+import json
+import os
+import sys
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+os.environ.setdefault('LOG_LEVEL', 'WARNING')
+
+import app as aplicacion
+from benchmark import diferencias_json, generar_dataset_sintetico
+
+# Sintético con Sexo y Edad nulos o vacíos, pesos y fechas nulos y sin
+# ningún Juvenil
+def dataset_con_huecos():
+    df = generar_dataset_sintetico(600, semilla=1)
+    df = df[df['Edad'] != 'Juvenil'].reset_index(drop=True)
+    df['Sexo'] = df['Sexo'].astype(object)
+    df['Edad'] = df['Edad'].astype(object)
+    df.loc[::17, 'Sexo'] = None
+    df.loc[5::23, 'Edad'] = '  '
+    df.loc[3::29, 'Peso_Kg'] = np.nan
+    df.loc[7::31, 'Fecha_entrga_CAV'] = None
+    return aplicacion.preparar_dataset(df)
+
+@pytest.fixture(scope='module')
+def conjuntos():
+    libro = aplicacion.leer_archivo(aplicacion.RUTA_DATOS)
+    huecos = dataset_con_huecos()
+    return {
+        'libro': libro,
+        'libro, Hembra': libro[libro['Sexo'] == 'Hembra'],
+        'con huecos': huecos,
+        'sin registros': huecos.iloc[:0],
+    }
+
+@pytest.mark.parametrize('conjunto', ['libro', 'libro, Hembra', 'con huecos', 'sin registros'])
+@pytest.mark.parametrize('nombre', sorted(aplicacion.GRAFICOS_LIGEROS))
+def test_figura_ligera_igual_a_plotly(conjuntos, conjunto, nombre):
+    df = conjuntos[conjunto]
+    esperada = json.loads(aplicacion.GRAFICOS_PLOTLY[nombre](df))
+    obtenida = json.loads(aplicacion.GRAFICOS_LIGEROS[nombre](df))
+
+    assert diferencias_json(esperada.get('data'), obtenida.get('data'), 'data') == []
+    assert diferencias_json(esperada.get('layout'), obtenida.get('layout'), 'layout') == []
+    assert diferencias_json(esperada, obtenida) == []
+
+def test_registro_de_figuras_completo():
+    assert set(aplicacion.GRAFICOS_LIGEROS) == set(aplicacion.GRAFICOS_PLOTLY)
+    assert aplicacion.GRAFICOS is aplicacion.GRAFICOS_LIGEROS or aplicacion.GRAFICOS is aplicacion.GRAFICOS_PLOTLY